@@ -0,0 +1,535 @@
+"""Micro-benchmarks and statistical self-checks for the pure helpers in main.py.
+
+Usage:
+    python bench.py                              # before/after comparisons and the regression suite
+    python bench.py --check                      # also run the statistical checks
+    python bench.py --suite --json run.json      # only the suite, saved for later comparison
+    python bench.py --suite --baseline run.json  # exit 1 if any case is slower than the baseline
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timedelta
+
+# Checks that need a database get a scratch one, never the bot's
+SCRATCH_DB = os.path.join(tempfile.gettempdir(), f"bench-{os.getpid()}.db")
+os.environ["DB_PATH"] = SCRATCH_DB
+
+import main
+
+# ---------- TIMING ----------
+def time_call(func, number=None, repeat=5):
+    """Best-of-`repeat` seconds per call for a zero-argument callable"""
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def legacy_desertions(n, p, rng=random):
+    """The original one-coin-flip-per-recruit desertion loop"""
+    deserted = 0
+    for _ in range(n):
+        if rng.random() < p:
+            deserted += 1
+    return deserted
+
+def legacy_unit_types(total_recruits, army_type, knight_chance):
+    """The original take-int(remaining * p)-in-order unit split"""
+    bonuses = main.ARMY_TYPES.get(army_type, main.ARMY_TYPES['Balanced'])
+    distribution = dict(main.UNIT_BASE_DISTRIBUTION, knights=knight_chance)
+    for unit_type in distribution:
+        if unit_type in bonuses:
+            distribution[unit_type] *= bonuses[unit_type]
+    total = sum(distribution.values())
+    unit_types = dict.fromkeys(main.UNIT_TYPES, 0)
+    remaining = total_recruits
+    for unit_type, weight in distribution.items():
+        count = min(int(remaining * weight / total), remaining)
+        unit_types[unit_type] = count
+        remaining -= count
+    unit_types['infantry'] += remaining
+    return unit_types
+
+def legacy_enhanced_damage(attacker, defender, action_type, terrain="Open Plains", weather="Clear Skies"):
+    """calculate_enhanced_damage as it was before the id-indexed tables"""
+    terrain_effects = main.TERRAIN_EFFECTS.get(terrain, main.TERRAIN_EFFECTS["Open Plains"])
+    weather_effects = main.WEATHER_EFFECTS.get(weather, main.WEATHER_EFFECTS["Clear Skies"])
+    knight_bonus = attacker.get('total_knights', 0) * 3
+    archer_bonus = attacker.get('total_archers', 0) * 2
+    cavalry_bonus = attacker.get('total_cavalry', 0) * 2.5
+    base_damage = random.randint(15, 35)
+    action_modifiers = {
+        "power_strike": {"stat": 'strength', "multiplier": 2.2, "terrain": 'infantry'},
+        "magic_bolt": {"stat": 'intelligence', "multiplier": 2.8, "terrain": 'archery'},
+        "quick_strike": {"stat": 'agility', "multiplier": 2.0, "terrain": 'cavalry'},
+        "cavalry_charge": {"stat": 'strength', "multiplier": 2.5, "terrain": 'cavalry'},
+        "archer_volley": {"stat": 'agility', "multiplier": 2.3, "terrain": 'archery'},
+        "shield_wall": {"stat": 'vitality', "multiplier": 1.5, "terrain": 'defense'},
+        "flanking_maneuver": {"stat": 'agility', "multiplier": 2.1, "terrain": 'cavalry'},
+    }
+    action_info = action_modifiers.get(action_type, action_modifiers["power_strike"])
+    if action_info['terrain'] == 'infantry':
+        unit_bonus = knight_bonus
+    elif action_info['terrain'] == 'archery':
+        unit_bonus = archer_bonus
+    elif action_info['terrain'] == 'cavalry':
+        unit_bonus = cavalry_bonus
+    else:
+        unit_bonus = knight_bonus + archer_bonus
+    stat_bonus = (attacker[action_info['stat']] + unit_bonus) * action_info['multiplier']
+    defense_stat = 'vitality' if action_type != "magic_bolt" else 'intelligence'
+    defense_bonus = defender[defense_stat] * 1.8
+    stat_bonus *= terrain_effects.get(action_info['terrain'], 1.0)
+    stat_bonus *= weather_effects.get('morale', 1.0) * weather_effects.get('archery', 1.0)
+    damage = max(5, int((base_damage + stat_bonus - defense_bonus) * random.uniform(0.7, 1.3)))
+    total_crit_chance = (attacker['agility'] + attacker['luck'] + (attacker.get('total_knights', 0) // 10)) * 0.005
+    if random.random() < total_crit_chance:
+        return int(damage * random.uniform(1.5, 2.5)), True
+    return damage, False
+
+def legacy_war_damage(attacker_power, defender_power, terrain, weather, attacker_tactic, defender_tactic):
+    """calculate_war_damage as it was before the id-indexed tables"""
+    try:
+        base_damage = (attacker_power * 0.1) + random.randint(-50, 50)
+        terrain_mod = main.TERRAIN_EFFECTS.get(terrain, main.TERRAIN_EFFECTS["Open Plains"])
+        weather_mod = main.WEATHER_EFFECTS.get(weather, main.WEATHER_EFFECTS["Clear Skies"])
+        attacker_tactic_mod = main.BATTLE_TACTICS.get(attacker_tactic, main.BATTLE_TACTICS["Frontal Assault"])
+        defender_tactic_mod = main.BATTLE_TACTICS.get(defender_tactic, main.BATTLE_TACTICS["Frontal Assault"])
+        total_modifier = (
+            (terrain_mod.get('infantry', 1.0) * 0.3 + terrain_mod.get('cavalry', 1.0) * 0.3 +
+             terrain_mod.get('archery', 1.0) * 0.2 + terrain_mod.get('defense', 1.0) * 0.2) *
+            (weather_mod.get('morale', 1.0) * weather_mod.get('archery', 1.0)) *
+            attacker_tactic_mod['damage'] *
+            (1.0 / defender_tactic_mod['damage'])
+        )
+        damage = max(10, int(base_damage * total_modifier))
+        if random.random() < terrain_mod.get('ambush', 1.0) * 0.1:
+            return int(damage * random.uniform(1.3, 1.8)), True, "surprise"
+        return damage, False, "normal"
+    except ZeroDivisionError:
+        return int(attacker_power * 0.05), False, "normal"
+
+def legacy_casualties(army_power, damage_received, terrain, weather):
+    """calculate_casualties as it was before the id-indexed tables"""
+    casualty_rate = damage_received / (army_power + 1000)
+    terrain_mod = main.TERRAIN_EFFECTS.get(terrain, main.TERRAIN_EFFECTS["Open Plains"])
+    weather_mod = main.WEATHER_EFFECTS.get(weather, main.WEATHER_EFFECTS["Clear Skies"])
+    casualty_rate *= (1.0 / (terrain_mod.get('defense', 1.0) * weather_mod.get('morale', 1.0)))
+    return min(0.5, max(0.05, casualty_rate))
+
+BENCH_ATTACKER = {'strength': 14, 'agility': 12, 'intelligence': 9, 'vitality': 10, 'luck': 8,
+                  'total_knights': 12, 'total_archers': 30, 'total_cavalry': 8}
+BENCH_DEFENDER = {'strength': 10, 'agility': 8, 'intelligence': 12, 'vitality': 15, 'luck': 5}
+
+# ---------- BENCHMARKS ----------
+def bench_desertions():
+    print("Desertion sampling (per call)")
+    print(f"{'recruits':>10} {'loop':>12} {'binomial':>12} {'speedup':>9}")
+    rate = main.calculate_desertion_rate(60, 40, 500)
+    for n in (10, 100, 1000, 10000, 100000):
+        loop = time_call(lambda: legacy_desertions(n, rate))
+        sampled = time_call(lambda: main.binomial_sample(n, rate))
+        print(f"{n:>10} {loop * 1e6:>10.2f}us {sampled * 1e6:>10.2f}us {loop / sampled:>8.1f}x")
+
+def bench_unit_allocation():
+    print("Unit type allocation (per call)")
+    print(f"{'recruits':>10} {'legacy':>12} {'multinomial':>12}")
+    for n in (10, 100, 1000, 10000):
+        legacy = time_call(lambda: legacy_unit_types(n, "Archer Heavy", 0.1))
+        sampled = time_call(lambda: main.distribute_unit_types(n, "Archer Heavy", 0.1))
+        print(f"{n:>10} {legacy * 1e6:>10.2f}us {sampled * 1e6:>10.2f}us")
+
+def bench_combat_modifiers():
+    print("Combat modifier lookups (per call)")
+    print(f"{'function':>24} {'dict lookups':>14} {'id tables':>12} {'speedup':>9}")
+    cases = [
+        ("calculate_enhanced_damage",
+         lambda: legacy_enhanced_damage(BENCH_ATTACKER, BENCH_DEFENDER, "archer_volley", "Dense Forest", "Foggy"),
+         lambda: main.calculate_enhanced_damage(BENCH_ATTACKER, BENCH_DEFENDER, "archer_volley", "Dense Forest", "Foggy")),
+        ("calculate_war_damage",
+         lambda: legacy_war_damage(1500, 1200, "Hilly Highlands", "Light Rain", "Ambush", "Defensive Position"),
+         lambda: main.calculate_war_damage(1500, 1200, "Hilly Highlands", "Light Rain", "Ambush", "Defensive Position")),
+        ("calculate_casualties",
+         lambda: legacy_casualties(1200, 180, "River Crossing", "Stormy"),
+         lambda: main.calculate_casualties(1200, 180, "River Crossing", "Stormy")),
+    ]
+    for name, before, after in cases:
+        legacy = time_call(before, repeat=25)
+        tabled = time_call(after, repeat=25)
+        print(f"{name:>24} {legacy * 1e6:>12.2f}us {tabled * 1e6:>10.2f}us {legacy / tabled:>8.2f}x")
+
+# ---------- REGRESSION SUITE ----------
+SUITE_SEED = 20240601
+
+# A fresh levy, a seasoned standing army and a late-game host
+SUITE_ARMIES = {
+    'levy': {'current_soldiers': 150, 'total_knights': 2, 'total_archers': 20, 'total_cavalry': 5,
+             'total_siege': 0, 'army_type': 'Balanced', 'morale': 85, 'supplies': 70,
+             'battle_formation': 'Line'},
+    'standing': {'current_soldiers': 2500, 'total_knights': 60, 'total_archers': 600, 'total_cavalry': 250,
+                 'total_siege': 12, 'army_type': 'Archer Heavy', 'morale': 70, 'supplies': 45,
+                 'battle_formation': 'Phalanx'},
+    'host': {'current_soldiers': 40000, 'total_knights': 900, 'total_archers': 9000, 'total_cavalry': 4000,
+             'total_siege': 120, 'army_type': 'Cavalry Heavy', 'morale': 55, 'supplies': 30,
+             'battle_formation': 'Wedge'},
+}
+
+def suite_tables():
+    """Static tables seeded from the defaults, so formation bonuses apply without a database"""
+    columns = ('formation_name', 'infantry_bonus', 'cavalry_bonus', 'archer_bonus',
+               'defense_bonus', 'movement_penalty', 'description')
+    return main.GameTables(formations={row[0]: dict(zip(columns, row)) for row in main.DEFAULT_FORMATIONS})
+
+def build_embed():
+    """A stats-sized embed, as most commands send"""
+    embed = main.medieval_embed(title="Combatant Statistics", description="Sir Galahad of the Silver Host",
+                                color_name="blue")
+    for name, value in (("Level", 12), ("Prestige", 340), ("Soldiers", "2,500"),
+                        ("Morale", "70/100"), ("Supplies", "45/100"), ("Formation", "Phalanx")):
+        embed.add_field(name=name, value=value, inline=True)
+    return embed
+
+CALIBRATION_CASE = "calibration[pure python]"
+
+def calibration_workload():
+    """Fixed interpreter-bound work; comparisons divide by it to cancel out machine speed"""
+    total = 0
+    for value in range(64):
+        total += value * value % 7
+    return total
+
+def suite_cases():
+    """(name, zero-argument callable) for every hot per-command function, all on fixed seeds"""
+    tables = suite_tables()
+    powers = {name: main.calculate_army_power(army, tables)['total'] for name, army in SUITE_ARMIES.items()}
+    rng = random.Random(SUITE_SEED)
+    attacker = dict(BENCH_ATTACKER, **SUITE_ARMIES['standing'])
+
+    cases = [
+        (CALIBRATION_CASE, calibration_workload),
+        ("calculate_enhanced_damage[power_strike]",
+         lambda: main.calculate_enhanced_damage(attacker, BENCH_DEFENDER, "power_strike", "Open Plains",
+                                                "Clear Skies", rng)),
+        ("calculate_enhanced_damage[archer_volley]",
+         lambda: main.calculate_enhanced_damage(attacker, BENCH_DEFENDER, "archer_volley", "Dense Forest",
+                                                "Foggy", rng)),
+        ("calculate_war_damage[standing_vs_host]",
+         lambda: main.calculate_war_damage(powers['standing'], powers['host'], "Hilly Highlands", "Light Rain",
+                                           "Ambush", "Defensive Position", rng)),
+        ("calculate_casualties[host]",
+         lambda: main.calculate_casualties(powers['host'], powers['standing'] // 4, "River Crossing", "Stormy")),
+    ]
+    for name, army in SUITE_ARMIES.items():
+        cases.append((f"calculate_army_power[{name}]", lambda army=army: main.calculate_army_power(army, tables)))
+    for total in (120, 2500, 40000):
+        cases.append((f"distribute_unit_types[{total}]",
+                      lambda total=total: main.distribute_unit_types(total, "Archer Heavy", 0.07, rng)))
+    for name, army in SUITE_ARMIES.items():
+        cases.append((f"calculate_desertion_rate[{name}]",
+                      lambda army=army: main.calculate_desertion_rate(army['morale'], army['supplies'],
+                                                                      army['current_soldiers'])))
+    cases += [
+        ("medieval_embed[stats]", build_embed),
+        ("medieval_response", lambda: main.medieval_response("Thy soldiers have been trained", success=True)),
+    ]
+    return cases
+
+def run_suite(repeat=9):
+    """Time every suite case; returns {name: {'best_us', 'median_us', 'number'}}.
+
+    Repeats are interleaved across the cases rather than run back to back, so a
+    noisy stretch on the machine is spread over every case instead of one.
+    """
+    print("Regression suite (per call)")
+    print(f"{'case':<44} {'best':>10} {'median':>10}")
+    timers = []
+    for name, func in suite_cases():
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        timers.append((name, timer, number, []))
+    for _ in range(repeat):
+        for name, timer, number, samples in timers:
+            random.seed(SUITE_SEED)
+            samples.append(timer.timeit(number) / number)
+
+    results = {}
+    for name, _, number, samples in timers:
+        best, median = min(samples), statistics.median(samples)
+        results[name] = {'best_us': best * 1e6, 'median_us': median * 1e6, 'number': number}
+        print(f"{name:<44} {best * 1e6:>8.2f}us {median * 1e6:>8.2f}us")
+    return results
+
+def save_suite(path, results):
+    with open(path, "w") as handle:
+        json.dump({
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'seed': SUITE_SEED,
+            'results': results,
+        }, handle, indent=2, sort_keys=True)
+    print(f"Saved {len(results)} results to {path}")
+
+def compare_suite(path, results, tolerance):
+    """Compare best-of timings with a saved run; returns how many cases regressed past `tolerance`.
+
+    The best of several repeats is the least noisy estimate of a function's own
+    cost. Each is taken relative to the calibration case of its own run, so a
+    machine that is uniformly faster or slower does not read as a change.
+    """
+    with open(path) as handle:
+        baseline = json.load(handle)['results']
+    scale = results[CALIBRATION_CASE]['best_us'] / baseline[CALIBRATION_CASE]['best_us']
+    print(f"Against baseline {path} (regression = more than {tolerance:.0%} slower "
+          f"after scaling by calibration, this machine is {scale:.2f}x the baseline's time)")
+    print(f"{'case':<44} {'baseline':>10} {'now':>10} {'change':>8}")
+    regressions = 0
+    for name, result in results.items():
+        if name == CALIBRATION_CASE:
+            continue
+        if name not in baseline:
+            print(f"{name:<44} {'-':>10} {result['best_us']:>8.2f}us {'new':>8}")
+            continue
+        before = baseline[name]['best_us']
+        change = result['best_us'] / (before * scale) - 1
+        regressed = change > tolerance
+        regressions += regressed
+        print(f"{name:<44} {before:>8.2f}us {result['best_us']:>8.2f}us {change:>+7.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    for name in baseline.keys() - results.keys():
+        print(f"{name:<44} missing from this run")
+    return regressions
+
+# ---------- STATISTICAL CHECKS ----------
+def chi_square_vs_loop(n, p, samples, seed):
+    """Chi-square statistic and degrees of freedom comparing binomial_sample to the legacy loop"""
+    rng_a = random.Random(seed)
+    rng_b = random.Random(seed + 1)
+    observed = [main.binomial_sample(n, p, rng_a) for _ in range(samples)]
+    reference = [legacy_desertions(n, p, rng_b) for _ in range(samples)]
+
+    # Pool into bins with enough expected mass on both sides
+    mean = n * p
+    sd = math.sqrt(n * p * (1 - p)) or 1.0
+    edges = sorted({max(0, int(mean + k * sd / 2)) for k in range(-6, 7)})
+
+    def histogram(values):
+        counts = [0] * (len(edges) + 1)
+        for value in values:
+            index = 0
+            while index < len(edges) and value >= edges[index]:
+                index += 1
+            counts[index] += 1
+        return counts
+
+    a, b = histogram(observed), histogram(reference)
+    statistic = 0.0
+    bins = 0
+    for x, y in zip(a, b):
+        if x + y == 0:
+            continue
+        statistic += (x - y) ** 2 / (x + y)
+        bins += 1
+    return statistic, bins - 1
+
+def check_desertions(samples=20000):
+    """Two-sample chi-square test of binomial_sample against the legacy loop"""
+    print("Desertion distribution vs legacy loop (two-sample chi-square, alpha=0.001)")
+    failures = 0
+    cases = [(10, 0.05), (50, 0.2), (200, 0.1), (1000, 0.03), (1000, 0.14), (2000, 0.08), (1000, 0.3), (5000, 0.15)]
+    for n, p in cases:
+        statistic, dof = chi_square_vs_loop(n, p, samples, seed=n)
+        # Wilson-Hilferty approximation of the chi-square 99.9th percentile
+        critical = dof * (1 - 2 / (9 * dof) + 3.09 * math.sqrt(2 / (9 * dof))) ** 3
+        ok = statistic <= critical
+        failures += not ok
+        print(f"  n={n:>5} p={p:<5} chi2={statistic:8.2f} critical={critical:8.2f} "
+              f"{'ok' if ok else 'MISMATCH'}")
+    return failures
+
+def check_unit_allocation(total=500, trials=4000, tolerance=0.005):
+    """Average multinomial shares must match the configured ratios for every army type"""
+    print(f"Unit allocation shares vs configured ratios (tolerance {tolerance})")
+    rng = random.Random(9)
+    failures = 0
+    for army_type, bonuses in main.ARMY_TYPES.items():
+        weights = dict(main.UNIT_BASE_DISTRIBUTION, knights=0.1)
+        weights = {unit: weight * bonuses.get(unit, 1.0) for unit, weight in weights.items()}
+        weight_total = sum(weights.values())
+
+        counts = dict.fromkeys(main.UNIT_TYPES, 0)
+        for _ in range(trials):
+            for unit, count in main.distribute_unit_types(total, army_type, 0.1, rng).items():
+                counts[unit] += count
+        worst = max(abs(counts[unit] / (total * trials) - weights[unit] / weight_total)
+                    for unit in main.UNIT_TYPES)
+        ok = worst <= tolerance
+        failures += not ok
+        print(f"  {army_type:<18} max share error={worst:.4f} {'ok' if ok else 'MISMATCH'}")
+    return failures
+
+def check_combat_tables():
+    """The id tables must reproduce the dict-based formulas exactly for the same random stream"""
+    print("Combat tables vs dict lookups (identical outputs over every combination)")
+    mismatches = 0
+    for terrain in main.TERRAIN_EFFECTS:
+        for weather in main.WEATHER_EFFECTS:
+            for action in main.DUEL_ACTIONS:
+                random.seed(hash((terrain, weather, action)) & 0xFFFF)
+                expected = legacy_enhanced_damage(BENCH_ATTACKER, BENCH_DEFENDER, action, terrain, weather)
+                random.seed(hash((terrain, weather, action)) & 0xFFFF)
+                actual = main.calculate_enhanced_damage(BENCH_ATTACKER, BENCH_DEFENDER, action, terrain, weather)
+                mismatches += expected != actual
+            for attacker in main.BATTLE_TACTICS:
+                for defender in main.BATTLE_TACTICS:
+                    random.seed(hash((terrain, weather, attacker, defender)) & 0xFFFF)
+                    expected = legacy_war_damage(1500, 1200, terrain, weather, attacker, defender)
+                    random.seed(hash((terrain, weather, attacker, defender)) & 0xFFFF)
+                    actual = main.calculate_war_damage(1500, 1200, terrain, weather, attacker, defender)
+                    mismatches += expected != actual
+            mismatches += legacy_casualties(1200, 480, terrain, weather) != main.calculate_casualties(1200, 480, terrain, weather)
+    print(f"  {mismatches} mismatches {'ok' if not mismatches else 'MISMATCH'}")
+    return 1 if mismatches else 0
+
+def check_seeded_events(events=2000):
+    """Seeded duel, war and training draws must repeat exactly for the same (seed, turn)"""
+    print("Seeded event generators (same seed and turn -> same outcome)")
+
+    def outcomes(seed, turn):
+        return (
+            main.calculate_enhanced_damage(BENCH_ATTACKER, BENCH_DEFENDER, "magic_bolt", "Swampy Marshlands",
+                                           "Stormy", main.event_rng(seed, turn)),
+            main.calculate_war_damage(1500, 1200, "Dense Forest", "Foggy", "Ambush", "Flank Attack",
+                                      main.event_rng(seed, turn)),
+            main.distribute_unit_types(400, "Balanced", 0.1, main.event_rng(seed, turn)),
+        )
+
+    repeats = sum(outcomes(seed, seed % 10) == outcomes(seed, seed % 10) for seed in range(events))
+    distinct = len({repr(outcomes(seed, 1)) for seed in range(200)})
+    ok = repeats == events and distinct > 150
+    print(f"  {repeats}/{events} repeated exactly, {distinct}/200 distinct across seeds  {'ok' if ok else 'MISMATCH'}")
+    return 0 if ok else 1
+
+def check_supply_accrual(hours=72, steps=(1, 5, 7)):
+    """Accruing upkeep every few hours must end exactly where one catch-up accrual does"""
+    print(f"Supply accrual over {hours}h, every {'/'.join(map(str, steps))}h vs once (supplies, morale, owed)")
+    db = sqlite3.connect(":memory:")
+    db.execute("""
+    CREATE TABLE armies (user_id INTEGER, guild_id INTEGER, current_soldiers INTEGER, total_knights INTEGER,
+                         total_archers INTEGER, total_cavalry INTEGER, total_siege INTEGER, morale INTEGER,
+                         supplies INTEGER, last_supply_check TIMESTAMP, supply_upkeep_owed INTEGER DEFAULT 0)""")
+    start = datetime(2024, 6, 1, 12, 0, 0)
+    garrison = {'total_knights': 0, 'total_archers': 0, 'total_cavalry': 0, 'total_siege': 0}
+    armies = dict(SUITE_ARMIES,
+                  infantry_1000=dict(garrison, current_soldiers=1000, morale=80, supplies=100),
+                  # Runs low only in the last hours, so part of the morale penalty applies
+                  outpost=dict(garrison, current_soldiers=70, morale=100, supplies=12))
+
+    def accrue(army, step):
+        db.execute("DELETE FROM armies")
+        db.execute("""
+        INSERT INTO armies VALUES (1, 1, :current_soldiers, :total_knights, :total_archers, :total_cavalry,
+                                   :total_siege, :morale, :supplies, :start, 0)""",
+                   dict(army, start=start.strftime("%Y-%m-%d %H:%M:%S")))
+        for hour in list(range(step, hours + 1, step)) + [hours]:
+            db.execute(f"{main.SUPPLY_ACCRUAL_SQL} AND user_id=1",
+                       {'now': (start + timedelta(hours=hour)).isoformat()})
+        return db.execute("SELECT supplies, morale, supply_upkeep_owed FROM armies").fetchone()
+
+    failures = 0
+    for name, army in armies.items():
+        once = accrue(army, hours)
+        results = [accrue(army, step) for step in steps]
+        ok = all(result == once for result in results)
+        failures += not ok
+        print(f"  {name:<14} once={once} " + " ".join(f"{step}h={result}" for step, result in zip(steps, results))
+              + f"  {'ok' if ok else 'MISMATCH'}")
+    return failures
+
+def check_duel_replay(duels=30):
+    """Stored duels replayed from their seed, stats snapshot and duel_turns must match what was logged"""
+    print(f"Duel replay from stored state ({duels} seeded duels, stats changed before every turn)")
+    main.init_combat_db()
+    rng = random.Random(SUITE_SEED)
+    actions = list(main.DUEL_ACTIONS)
+    turns = mismatches = 0
+    for index in range(duels):
+        challenger, defender = 2 * index + 1, 2 * index + 2
+        for user_id in (challenger, defender):
+            main.register_combatant(user_id, 1, f"Knight {user_id}", f"Host {user_id}", None, "Sir")
+            main.update_combatant_stats(user_id, 1, strength=rng.randint(5, 40), agility=rng.randint(5, 40),
+                                        luck=rng.randint(5, 40))
+        main.create_duel(1, challenger, defender, 0, rng.choice(list(main.TERRAIN_EFFECTS)),
+                         rng.choice(list(main.WEATHER_EFFECTS)))
+        duel_id = main.get_active_duel(1, challenger)['id']
+        current = challenger
+        while duel := main.get_active_duel(1, current):
+            # Training or leveling mid-duel must not change how its turns resolve
+            main.update_combatant_stats(current, 1, strength=rng.randint(5, 80))
+            if main.resolve_duel_turn(duel, current, 1, rng.choice(actions))['winner']:
+                break
+            current = defender if current == challenger else challenger
+        logged, replayed = main.replay_recorded_duel(duel_id)
+        turns += len(logged)
+        mismatches += logged != replayed
+    ok = turns > duels and not mismatches
+    print(f"  {turns} turns over {duels} duels, {mismatches} duels replayed differently  {'ok' if ok else 'MISMATCH'}")
+    return 0 if ok else 1
+
+def remove_scratch_db():
+    main.history_writer.close()
+    main.connection_pool.close_all()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(SCRATCH_DB + suffix):
+            os.remove(SCRATCH_DB + suffix)
+
+# ---------- RUN ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="run statistical checks as well")
+    parser.add_argument("--suite", action="store_true", help="run only the regression suite")
+    parser.add_argument("--json", metavar="PATH", help="save the suite results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare the suite with a saved JSON run")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline (default 0.25 = 25%%)")
+    parser.add_argument("--repeat", type=int, default=9, help="timing repeats per suite case")
+    args = parser.parse_args()
+
+    failures = 0
+    if not args.suite:
+        bench_desertions()
+        print()
+        bench_unit_allocation()
+        print()
+        bench_combat_modifiers()
+        print()
+    results = run_suite(args.repeat)
+    if args.json:
+        save_suite(args.json, results)
+    if args.baseline:
+        print()
+        failures += compare_suite(args.baseline, results, args.tolerance)
+    if args.check:
+        print()
+        failures += check_desertions()
+        print()
+        failures += check_unit_allocation()
+        print()
+        failures += check_combat_tables()
+        print()
+        failures += check_seeded_events()
+        print()
+        failures += check_supply_accrual()
+        print()
+        failures += check_duel_replay()
+        remove_scratch_db()
+    sys.exit(1 if failures else 0)
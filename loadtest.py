@@ -0,0 +1,257 @@
+"""Headless load test: drives the bot's commands through stub contexts against a scratch database.
+
+Players are paired inside guilds; each pair registers, recruits, trains,
+fights a duel to the end and then a full war, with every command going
+through the same handler, run_db and unit-of-work path as on Discord.
+
+Usage:
+    python loadtest.py                                  # 1000 players in 20 guilds
+    python loadtest.py --players 5000 --guilds 50 --concurrency 400
+    python loadtest.py --db /tmp/load.db --keep         # keep the scratch database
+    DB_RECORD=load.jsonl.gz python loadtest.py          # also record the workload for workload.py
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+main = None  # Imported by run() once DB_PATH points at the scratch database
+
+# ---------- STUB GATEWAY ----------
+class StubUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"player{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+
+class StubGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.members = {}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+class StubReplies:
+    """Collects what a command sent, in place of a channel or interaction response"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, *, embed=None, view=None, **kwargs):
+        self.sent.append((content, embed, view))
+
+    @property
+    def last_view(self):
+        return next((view for _, _, view in reversed(self.sent) if view is not None), None)
+
+    def outcome(self):
+        """'locked', 'error', 'refused' (a game rule said no) or 'ok', judged from the replies"""
+        text = " ".join(f"{content or ''} {embed.title if embed else ''} {embed.description if embed else ''}"
+                        for content, embed, _ in self.sent).lower()
+        if "locked" in text:
+            return "locked"
+        if "error" in text or "ill omen" in text:
+            return "error"
+        if "❌" in text:
+            return "refused"
+        return "ok"
+
+class StubContext(StubReplies):
+    def __init__(self, user, guild):
+        super().__init__()
+        self.author = user
+        self.guild = guild
+
+class StubResponse:
+    def __init__(self, replies):
+        self._replies = replies
+        self._done = False
+
+    async def send_message(self, content=None, *, embed=None, view=None, **kwargs):
+        self._done = True
+        await self._replies.send(content, embed=embed, view=view)
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+    def is_done(self):
+        return self._done
+
+class StubInteraction(StubReplies):
+    def __init__(self, user, guild):
+        super().__init__()
+        self.user = user
+        self.guild = guild
+        self.channel_id = None
+        self.response = StubResponse(self)
+        self.extras = {}
+
+# ---------- SCENARIO ----------
+class LoadStats:
+    def __init__(self):
+        self.latencies = {}
+        self.outcomes = {}
+
+    def record(self, command, seconds, outcome):
+        self.latencies.setdefault(command, []).append(seconds)
+        key = (command, outcome)
+        self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+async def invoke(stats, name, handler, replies, *args):
+    """Run one command handler the way the bot would, timing it and classifying the reply"""
+    main.current_operation.set(f"{main.PREFIX}{name}")
+    started = time.perf_counter()
+    try:
+        await handler(replies, *args)
+        outcome = replies.outcome()
+    except Exception as e:
+        replies.sent.append((f"error: {e}", None, None))
+        outcome = "locked" if "locked" in str(e) else "error"
+    stats.record(name, time.perf_counter() - started, outcome)
+    return replies
+
+async def press(stats, name, button, user, guild):
+    """Press a view button as `user`"""
+    return await invoke(stats, name, lambda interaction: button.callback(interaction), StubInteraction(user, guild))
+
+async def register(stats, user, guild):
+    ctx = await invoke(stats, "register", main.enhanced_register_cmd, StubContext(user, guild))
+    view = ctx.last_view
+    if view is None:
+        return
+    view.character_name = user.name
+    view.army_name = f"Host of {user.name}"
+    await press(stats, "register:complete", view.complete_registration, user, guild)
+
+async def build_army(stats, user, guild, rng):
+    await invoke(stats, "recruit", main.enhanced_recruit_cmd, StubContext(user, guild))
+    await invoke(stats, "train", main.enhanced_train_cmd, StubContext(user, guild), rng.randint(20, 120))
+
+async def fight_duel(stats, challenger, defender, guild, rng, max_turns=80):
+    ctx = await invoke(stats, "duel", main.enhanced_duel_cmd, StubContext(challenger, guild), defender, 0)
+    view = ctx.last_view
+    if view is None:
+        return
+    await press(stats, "duel:accept", view.accept_duel, defender, guild)
+    actions = list(main.DUEL_ACTION_IDS)
+    current = challenger
+    for _ in range(max_turns):
+        ctx = await invoke(stats, "turn", main.enhanced_turn_cmd, StubContext(current, guild), rng.choice(actions))
+        if ctx.outcome() != "ok" or any(embed and "Victory" in (embed.title or "") for _, embed, _ in ctx.sent):
+            return
+        current = defender if current is challenger else challenger
+
+async def fight_war(stats, challenger, defender, guild, rng, max_turns=30):
+    ctx = await invoke(stats, "war", main.enhanced_war_cmd, StubContext(challenger, guild), defender,
+                       f"War of {challenger.name}")
+    view = ctx.last_view
+    if view is None:
+        return
+    await press(stats, "war:accept", view.accept_war, defender, guild)
+    tactics = list(main.TACTIC_IDS)
+    current = challenger
+    for _ in range(max_turns):
+        ctx = await invoke(stats, "warturn", main.war_turn_cmd, StubContext(current, guild), rng.choice(tactics))
+        if ctx.outcome() != "ok" or any(embed and "Concluded" in (embed.title or "") for _, embed, _ in ctx.sent):
+            return
+        current = defender if current is challenger else challenger
+
+async def play_pair(stats, slots, challenger, defender, guild, seed):
+    """One rivalry from registration to the end of a war"""
+    rng = random.Random(seed)
+    async with slots:
+        await asyncio.gather(register(stats, challenger, guild), register(stats, defender, guild))
+        await asyncio.gather(build_army(stats, challenger, guild, rng), build_army(stats, defender, guild, rng))
+        await fight_duel(stats, challenger, defender, guild, rng)
+        await fight_war(stats, challenger, defender, guild, rng)
+
+# ---------- REPORT ----------
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def report(stats, wall_seconds):
+    total = sum(len(values) for values in stats.latencies.values())
+    print(f"\n{total:,} commands in {wall_seconds:.1f}s = {total / wall_seconds:,.0f} commands/s")
+    print(f"{'command':<18} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  outcomes")
+    for command, values in sorted(stats.latencies.items()):
+        values.sort()
+        outcomes = ", ".join(f"{outcome} {count}" for (name, outcome), count in sorted(stats.outcomes.items())
+                             if name == command)
+        print(f"{command:<18} {len(values):7d} {percentile(values, 0.50) * 1000:8.1f} "
+              f"{percentile(values, 0.95) * 1000:8.1f} {percentile(values, 0.99) * 1000:8.1f} "
+              f"{values[-1] * 1000:8.1f}  {outcomes}")
+
+    lock_waits = main.metrics.value("combat_db_lock_waits_total")
+    lock_histogram = main.metrics.value("combat_db_lock_wait_seconds")
+    locked = sum(count for (_, outcome), count in stats.outcomes.items() if outcome == "locked")
+    executor = main.db_executor.stats()
+    pool = main.connection_pool.stats()
+    print(f"\nSQLite write lock: {lock_waits:,} of {lock_histogram[-1] if lock_histogram else 0:,} units of work "
+          f"waited, {lock_histogram[-2] if lock_histogram else 0:.2f}s total; {locked} commands failed 'locked'")
+    print(f"DB executor: {executor['completed']:,} calls, avg wait {executor['avg_wait_ms']:.1f} ms, "
+          f"max wait {executor['max_wait_ms']:.1f} ms, peak pending {executor['peak_pending']}, "
+          f"throttled {executor['throttled']}")
+    print(f"Connection pool: {pool['open']} open, {pool['waits']} checkouts waited")
+    print(f"Event loop stalls over {main.LOOP_STALL_MS:.0f} ms: {main.loop_watchdog.total_stalls}")
+    return locked
+
+# ---------- RUN ----------
+async def run(args):
+    await main.run_db(main.init_combat_db)
+    if main.DB_RECORD:
+        main.start_workload_recording(main.DB_RECORD)
+    main.loop_watchdog.start(asyncio.get_running_loop())
+
+    guilds = [StubGuild(900_000 + index) for index in range(args.guilds)]
+    slots = asyncio.Semaphore(args.concurrency)
+    stats = LoadStats()
+    pairs = []
+    for index in range(args.players // 2):
+        guild = guilds[index % len(guilds)]
+        challenger, defender = StubUser(2 * index + 1), StubUser(2 * index + 2)
+        guild.members[challenger.id] = challenger
+        guild.members[defender.id] = defender
+        pairs.append(play_pair(stats, slots, challenger, defender, guild, args.seed + index))
+
+    started = time.perf_counter()
+    await asyncio.gather(*pairs)
+    return stats, time.perf_counter() - started
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=200, help="player pairs in flight at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="scratch database path (default: a new temporary file)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database afterwards")
+    args = parser.parse_args()
+
+    db_path = args.db or tempfile.mktemp(prefix="loadtest-", suffix=".db")
+    if os.path.exists(db_path):
+        sys.exit(f"{db_path} already exists; load tests only run against a fresh scratch database")
+    os.environ["DB_PATH"] = db_path
+
+    import main
+    stats, wall_seconds = asyncio.run(run(args))
+    main.history_writer.close()
+    locked = report(stats, wall_seconds)
+    if main.workload_recorder:
+        main.workload_recorder.close()
+
+    main.connection_pool.close_all()
+    if args.keep:
+        print(f"Scratch database kept at {db_path}")
+    else:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    sys.exit(1 if locked else 0)
@@ -16,16 +16,42 @@ import sys
 import traceback
 from contextlib import contextmanager
 import math
+import time
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple, Any
-from threading import Thread
+from threading import Thread, Lock, Condition, local, get_ident
 import flask
 import json
+import gzip
+import queue
+import heapq
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, count
+from types import MappingProxyType
 
 # ---------- ENVIRONMENT ----------
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 PREFIX = os.getenv("PREFIX", "!")
 COMBAT_DB_NAME = os.getenv("DB_PATH", "medieval_combat_enhanced.db")
+DB_WORKERS = int(os.getenv("DB_WORKERS", "2"))
+DB_MAX_PENDING = int(os.getenv("DB_MAX_PENDING", "64"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+COMBATANT_CACHE_SIZE = int(os.getenv("COMBATANT_CACHE_SIZE", "4096"))
+COMBATANT_CACHE_TTL = float(os.getenv("COMBATANT_CACHE_TTL", "30"))
+DUEL_TURN_TIMEOUT = int(os.getenv("DUEL_TURN_TIMEOUT", "900"))
+WAR_TURN_TIMEOUT = int(os.getenv("WAR_TURN_TIMEOUT", "3600"))
+DB_PROFILE = os.getenv("DB_PROFILE", "0").lower() in ("1", "true", "yes", "on")
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "50"))
+LOOP_STALL_MS = float(os.getenv("LOOP_STALL_MS", "250"))
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "0").lower() in ("1", "true", "yes", "on")
+DB_RECORD = os.getenv("DB_RECORD")
+HISTORY_FLUSH_MS = float(os.getenv("HISTORY_FLUSH_MS", "250"))
+HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", "500"))
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "20000"))
 
 # ---------- ROYAL SEAL IMAGE ----------
 ROYAL_SEAL_URL = "https://imgs.search.brave.com/ybyUdUFEw0dNXKCLGu2FuNAlJpvCTxkjXZUxOSFKcMM/rs:fit:500:0:1:0/g:ce/aHR0cHM6Ly90aHVt/YnMuZHJlYW1zdGlt/ZS5jb20vYi9yb3lh/bC1kZWNyZWUtdW52/ZWlsZWQtZXhxdWlz/aXRlLWdvbGQtc2Vh/bC12aW50YWdlLXN0/YXRpb25lcnktaGFu/ZHdyaXR0ZW4tbGV0/dGVyLWV4cGxvcmUt/b3B1bGVuY2UtcmVn/YWwtc3RlcC1iYWNr/LTM1MTI2NjUwOC5q/cGc"
@@ -37,27 +63,927 @@ intents.message_content = True
 intents.moderation = True
 intents.guilds = True
 
-bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None, case_insensitive=True)
+class CombatCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        # Runs in the slash command's own task, so everything it awaits inherits these
+        interaction.extras['started'] = time.perf_counter()
+        current_operation.set(f"/{interaction.command.qualified_name}" if interaction.command else "/unknown")
+        return True
+
+bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None, case_insensitive=True,
+                   tree_cls=CombatCommandTree)
 tree = bot.tree
 
 # ---------- DATABASE CONNECTION MANAGER ----------
+class CombatConnectionPool:
+    """Keeps configured SQLite connections open between calls (checkout/checkin)"""
+
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-16000",  # 16 MB page cache per connection
+        "PRAGMA mmap_size=268435456",  # 256 MB memory-mapped reads
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    def __init__(self, database, max_size=DB_POOL_SIZE, timeout=10.0):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = Lock()
+        self.created = 0
+        self.reused = 0
+        self.waits = 0
+        self.discarded = 0
+        self.in_use = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        conn.set_trace_callback(_count_statement)
+        return conn
+
+    def acquire(self):
+        """Check out an idle connection, opening a new one while under max_size"""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.reused += 1
+                self.in_use += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self.created - self.discarded < self.max_size
+            if can_create:
+                self.created += 1
+                self.in_use += 1
+            else:
+                self.waits += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self.discarded += 1
+                    self.in_use -= 1
+                raise
+
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("combat database connection pool exhausted")
+        with self._lock:
+            self.reused += 1
+            self.in_use += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, rolling back anything left open"""
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+        with self._lock:
+            self.in_use -= 1
+            if discard:
+                self.discarded += 1
+        if discard:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def stats(self):
+        """Snapshot of pool usage"""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'open': self.created - self.discarded,
+                'idle': self._idle.qsize(),
+                'in_use': self.in_use,
+                'created': self.created,
+                'reused': self.reused,
+                'waits': self.waits,
+                'discarded': self.discarded,
+            }
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self.discarded += 1
+
+connection_pool = CombatConnectionPool(COMBAT_DB_NAME)
+
+class UnitOfWork:
+    """Connection shared by every helper inside combat_unit_of_work; commits wait for the outer block"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.failed = False
+        self.touched = set()
+        self.touched_all = False
+        self.history = []  # record_history rows, queued once the unit commits
+        self.deadlines = []  # turn_timeouts changes, applied once the unit commits
+
+    def execute(self, *args):
+        try:
+            return self.conn.execute(*args)
+        except sqlite3.Error:
+            # Even if a helper swallows the error, the unit must not commit
+            self.failed = True
+            raise
+
+    def executemany(self, *args):
+        try:
+            return self.conn.executemany(*args)
+        except sqlite3.Error:
+            self.failed = True
+            raise
+
+    def commit(self):
+        # Deferred - the unit of work commits once when its block exits
+        pass
+
+    def rollback(self):
+        self.failed = True
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+_unit_of_work_state = local()
+
+def in_unit_of_work():
+    """True inside combat_unit_of_work, where helpers must re-raise rather than return a default"""
+    return getattr(_unit_of_work_state, 'unit', None) is not None
+
+# Taking the write lock longer than this means another writer held it
+LOCK_WAIT_THRESHOLD = 0.001
+
+@contextmanager
+def combat_unit_of_work():
+    """Run all database helpers called inside the block as one transaction on one connection"""
+    unit = getattr(_unit_of_work_state, 'unit', None)
+    if unit is not None:
+        # Nested unit of work joins the outer transaction
+        yield unit
+        return
+
+    with get_combat_db_connection() as conn:
+        unit = UnitOfWork(conn)
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        waited = time.perf_counter() - started
+        metrics.observe("combat_db_lock_wait_seconds", waited)
+        if waited >= LOCK_WAIT_THRESHOLD:
+            metrics.inc("combat_db_lock_waits_total")
+        _unit_of_work_state.unit = unit
+        try:
+            yield unit
+            if unit.failed:
+                raise sqlite3.OperationalError("unit of work aborted after a failed statement")
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        else:
+            history_writer.add(unit.history)
+            turn_timeouts.apply(unit.deadlines)
+        finally:
+            _unit_of_work_state.unit = None
+            # Other threads may have cached pre-commit snapshots of what we wrote
+            if unit.touched_all:
+                combatant_cache.clear()
+            for key in unit.touched:
+                combatant_cache.invalidate(key)
+
 @contextmanager
 def get_combat_db_connection():
     """Context manager for combat database connections"""
+    unit = getattr(_unit_of_work_state, 'unit', None)
+    if unit is not None:
+        # Inside a unit of work every helper shares its connection and transaction
+        try:
+            yield unit
+        except sqlite3.Error as e:
+            print(f"Combat database error: {e}")
+            unit.rollback()
+            raise
+        return
+
     conn = None
+    discard = False
     try:
-        conn = sqlite3.connect(COMBAT_DB_NAME, timeout=10.0, isolation_level=None)
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.row_factory = sqlite3.Row
-        yield conn
+        conn = connection_pool.acquire()
+        handle = query_profiler.wrap(conn) if query_profiler else conn
+        yield RecordingConnection(handle, workload_recorder) if workload_recorder else handle
     except sqlite3.Error as e:
         print(f"Combat database error: {e}")
         if conn:
-            conn.rollback()
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
         raise
     finally:
         if conn:
-            conn.close()
+            connection_pool.release(conn, discard=discard)
+
+# ---------- ASYNC DATABASE EXECUTOR ----------
+class CombatDBExecutor:
+    """Runs blocking database work on dedicated threads behind a bounded queue"""
+
+    def __init__(self, workers=DB_WORKERS, max_pending=DB_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="combat-db")
+        self._slots = asyncio.Semaphore(max_pending)
+        self._lock = Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.pending = 0
+        self.peak_pending = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def _execute(self, queued_at, func, args, kwargs):
+        started = time.perf_counter()
+        waited = started - queued_at
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            ran = time.perf_counter() - started
+            with self._lock:
+                self.completed += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                self.total_run += ran
+            metrics.observe("combat_db_call_seconds", ran, func=getattr(func, '__name__', 'unknown'))
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking function on a database thread and await its result"""
+        queued_at = time.perf_counter()
+        if self._slots.locked():
+            # Queue is full - the caller waits here instead of piling work onto the threads
+            self.throttled += 1
+        async with self._slots:
+            self.submitted += 1
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+            try:
+                loop = asyncio.get_running_loop()
+                # Carry the caller's context (current_operation) onto the database thread
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(
+                    self._executor,
+                    functools.partial(context.run, self._execute, queued_at, func, args, kwargs)
+                )
+            finally:
+                self.pending -= 1
+
+    def stats(self):
+        """Snapshot of queue depth and backpressure metrics"""
+        with self._lock:
+            completed = self.completed
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'peak_pending': self.peak_pending,
+                'submitted': self.submitted,
+                'completed': completed,
+                'failed': self.failed,
+                'throttled': self.throttled,
+                'avg_wait_ms': (self.total_wait / completed * 1000) if completed else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+                'avg_run_ms': (self.total_run / completed * 1000) if completed else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+db_executor = CombatDBExecutor()
+
+async def run_db(func, *args, **kwargs):
+    """Await a blocking database helper without stalling the event loop"""
+    return await db_executor.run(func, *args, **kwargs)
+
+# ---------- METRICS ----------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class MetricsRegistry:
+    """Counters, gauges and histograms, rendered in the Prometheus text format for /metrics"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._meta = {}  # name -> (type, help, buckets)
+        self._values = {}  # name -> {label tuple: value, or bucket counts + [sum, count]}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = (kind, help_text, buckets)
+        self._values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name].get(key)
+            if series is None:
+                series = self._values[name][key] = [0] * (len(buckets) + 3)
+            series[bisect_left(buckets, value)] += 1  # Last slot before sum/count is +Inf
+            series[-2] += value
+            series[-1] += 1
+
+    def value(self, name, **labels):
+        """Current value of a counter/gauge, or (bucket counts..., sum, count) of a histogram"""
+        with self._lock:
+            value = self._values[name].get(tuple(sorted(labels.items())), 0)
+            return tuple(value) if isinstance(value, list) else value
+
+    def add_collector(self, collector):
+        """Register a callable returning [(name, type, help, [(labels, value)])] read at scrape time"""
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ""
+        escaped = (key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                   for key, value in pairs)
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            snapshot = {name: {key: (list(value) if isinstance(value, list) else value)
+                               for key, value in series.items()}
+                        for name, series in self._values.items()}
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in snapshot[name].items():
+                if kind != 'histogram':
+                    lines.append(f"{name}{self._labels(key)} {value}")
+                    continue
+                cumulative = 0
+                for bound, in_bucket in zip(buckets + (math.inf,), value):
+                    cumulative += in_bucket
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f"{name}_bucket{self._labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(key)} {value[-2]}")
+                lines.append(f"{name}_count{self._labels(key)} {value[-1]}")
+
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{self._labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("combat_command_seconds", "histogram", "Command latency by command, kind (prefix/slash) and outcome")
+metrics.describe("combat_db_call_seconds", "histogram", "Run time of database helpers on the executor threads")
+metrics.describe("combat_db_statements_total", "counter", "SQL statements executed on pooled connections")
+metrics.describe("combat_db_lock_wait_seconds", "histogram", "Time a unit of work waited to take the write lock")
+metrics.describe("combat_db_lock_waits_total", "counter", "Units of work that found the write lock held")
+metrics.describe("combat_task_seconds", "histogram", "Background task run time", buckets=LATENCY_BUCKETS + (60.0, 300.0))
+metrics.describe("combat_task_failures_total", "counter", "Background task runs that raised")
+metrics.describe("combat_event_loop_lag_seconds", "histogram", "Delay of the loop watchdog heartbeat past its scheduled time")
+metrics.describe("combat_loop_stalls_total", "counter", "Heartbeats more than LOOP_STALL_MS late, by the blocking operation")
+metrics.describe("combat_history_rows_total", "counter", "History rows written behind the command path")
+metrics.describe("combat_history_rows_dropped_total", "counter", "History rows dropped because the buffer stayed full")
+metrics.describe("combat_history_flush_seconds", "histogram", "Time to write one batch of history rows")
+
+def _count_statement(_statement):
+    metrics.inc("combat_db_statements_total")
+
+def collect_runtime_metrics():
+    """Pool, executor, cache and scheduler state at scrape time"""
+    pool = connection_pool.stats()
+    executor = db_executor.stats()
+    cache = combatant_cache.stats()
+    tracked = turn_timeouts.pending_by_kind()
+    return [
+        ("combat_db_connections_opened_total", "counter", "Connections opened by the pool",
+         [({}, pool['created'])]),
+        ("combat_db_pool_connections", "gauge", "Pooled connections by state",
+         [({'state': 'open'}, pool['open']), ({'state': 'idle'}, pool['idle']),
+          ({'state': 'in_use'}, pool['in_use'])]),
+        ("combat_db_pool_waits_total", "counter", "Checkouts that waited for a free connection",
+         [({}, pool['waits'])]),
+        ("combat_db_executor_pending", "gauge", "Database calls queued or running",
+         [({}, executor['pending'])]),
+        ("combat_db_executor_calls_total", "counter", "Database calls by outcome",
+         [({'outcome': 'completed'}, executor['completed']), ({'outcome': 'failed'}, executor['failed']),
+          ({'outcome': 'throttled'}, executor['throttled'])]),
+        ("combat_db_executor_wait_seconds_max", "gauge", "Longest queue wait before a database call ran",
+         [({}, executor['max_wait_ms'] / 1000)]),
+        ("combat_combatant_cache_entries", "gauge", "Combatants held in the read cache",
+         [({}, cache['size'])]),
+        ("combat_combatant_cache_lookups_total", "counter", "Combatant cache lookups by result",
+         [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache['misses'])]),
+        ("combat_active_events", "gauge", "Active duels and wars with a turn deadline",
+         [({'kind': 'duel'}, tracked['duel']), ({'kind': 'war'}, tracked['war'])]),
+        ("combat_expired_events_total", "counter", "Duels forfeited and wars closed by turn timeouts",
+         [({'kind': 'duel'}, turn_timeouts.expired['duels']), ({'kind': 'war'}, turn_timeouts.expired['wars'])]),
+        ("combat_history_pending_rows", "gauge", "History rows buffered and not yet written",
+         [({}, history_writer.pending())]),
+    ]
+
+metrics.add_collector(collect_runtime_metrics)
+
+def timed_task(name):
+    """Record a background task's run time and failures under combat_task_seconds"""
+    def decorator(coro):
+        @functools.wraps(coro)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            token = current_operation.set(f"task:{name}")
+            try:
+                return await coro(*args, **kwargs)
+            except Exception:
+                metrics.inc("combat_task_failures_total", task=name)
+                raise
+            finally:
+                current_operation.reset(token)
+                metrics.observe("combat_task_seconds", time.perf_counter() - started, task=name)
+        return wrapper
+    return decorator
+
+# ---------- QUERY PROFILER ----------
+# Command or task the current database work belongs to; run_db copies it onto the executor thread
+current_operation = contextvars.ContextVar('current_operation', default='unattributed')
+
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SQL_SPACE = re.compile(r"\s+")
+
+def normalize_sql(sql):
+    """Collapse whitespace and literals so one query shape aggregates under one key"""
+    sql = _SQL_STRING.sub("?", sql)
+    sql = _SQL_NUMBER.sub("?", sql)
+    sql = _SQL_IN_LIST.sub("(...)", sql)
+    return _SQL_SPACE.sub(" ", sql).strip()
+
+class QueryProfiler:
+    """Per-statement timings grouped by operation and query shape, plus a slow-query log"""
+
+    def __init__(self, slow_ms=DB_SLOW_QUERY_MS, slow_log_size=200):
+        self.slow_seconds = slow_ms / 1000
+        self._lock = Lock()
+        self._stats = {}  # (operation, normalized sql) -> [calls, seconds, max seconds, rows]
+        self._plans = {}  # normalized sql -> EXPLAIN QUERY PLAN lines
+        self.slow_log = deque(maxlen=slow_log_size)
+
+    def wrap(self, conn):
+        return ProfiledConnection(conn, self)
+
+    def record(self, sql, seconds, rows, calls=1, statement_seconds=None):
+        """Add one execute (or a later fetch, with calls=0) to the query's totals"""
+        key = (current_operation.get(), normalize_sql(sql))
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                entry = self._stats[key] = [0, 0.0, 0.0, 0]
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] = max(entry[2], statement_seconds if statement_seconds is not None else seconds)
+            entry[3] += max(rows, 0)
+
+    def check_slow(self, conn, sql, params, before, after):
+        """Log a statement the first time its execute plus fetch time crosses the threshold"""
+        if before < self.slow_seconds <= after:
+            self._log_slow(conn, sql, params, normalize_sql(sql), current_operation.get(), after)
+
+    def _log_slow(self, conn, sql, params, normalized, operation, seconds):
+        plan = self._plans.get(normalized)
+        if plan is None and normalized.split(" ", 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'):
+            try:
+                plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())]
+            except sqlite3.Error as e:
+                plan = [f"(no plan: {e})"]
+            self._plans[normalized] = plan
+        self.slow_log.append({'operation': operation, 'sql': normalized, 'ms': seconds * 1000,
+                              'plan': plan or [], 'at': utcnow().isoformat()})
+        print(f"🐢 Slow query ({seconds * 1000:.1f} ms) in {operation}: {normalized[:200]}")
+        for line in plan or ():
+            print(f"    ↳ {line}")
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+        self.slow_log.clear()
+
+    def report(self, top=20, sort='total'):
+        """Top-N query shapes and a per-operation summary as plain text"""
+        with self._lock:
+            stats = [(operation, sql, *entry) for (operation, sql), entry in self._stats.items()]
+        sort_keys = {'total': lambda row: row[3], 'calls': lambda row: row[2],
+                     'max': lambda row: row[4], 'rows': lambda row: row[5]}
+        stats.sort(key=sort_keys.get(sort, sort_keys['total']), reverse=True)
+
+        lines = [f"Top {top} queries by {sort if sort in sort_keys else 'total'}:",
+                 f"{'total ms':>10} {'calls':>7} {'avg ms':>8} {'max ms':>8} {'rows':>8}  operation / query"]
+        for operation, sql, calls, seconds, max_seconds, rows in stats[:top]:
+            avg_ms = seconds / calls * 1000 if calls else 0.0
+            lines.append(f"{seconds * 1000:10.1f} {calls:7d} {avg_ms:8.2f} {max_seconds * 1000:8.2f} {rows:8d}  "
+                         f"{operation}: {sql[:160]}")
+
+        by_operation = {}
+        for operation, _, calls, seconds, _, rows in stats:
+            totals = by_operation.setdefault(operation, [0, 0.0, 0])
+            totals[0] += calls
+            totals[1] += seconds
+            totals[2] += rows
+        lines.append("")
+        lines.append("Per operation:")
+        for operation, (calls, seconds, rows) in sorted(by_operation.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{seconds * 1000:10.1f} ms {calls:7d} statements {rows:8d} rows  {operation}")
+        lines.append(f"\n{len(self.slow_log)} slow queries logged (>= {self.slow_seconds * 1000:.0f} ms)")
+        return "\n".join(lines) + "\n"
+
+class ProfiledCursor:
+    """Cursor proxy that charges fetch time and rows back to the statement that produced them"""
+
+    def __init__(self, cursor, profiler, conn, sql, params, seconds):
+        self._cursor = cursor
+        self._profiler = profiler
+        self._conn = conn
+        self._sql = sql
+        self._params = params
+        self._seconds = seconds
+
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = fetch(*args)
+        elapsed = time.perf_counter() - started
+        rows = len(result) if isinstance(result, list) else int(result is not None)
+        before, self._seconds = self._seconds, self._seconds + elapsed
+        self._profiler.record(self._sql, elapsed, rows, calls=0, statement_seconds=self._seconds)
+        self._profiler.check_slow(self._conn, self._sql, self._params, before, self._seconds)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchmany(self, size=None):
+        return self._fetch(self._cursor.fetchmany, size if size is not None else self._cursor.arraysize)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class ProfiledConnection:
+    """Connection proxy handed out by get_combat_db_connection when DB_PROFILE is on"""
+
+    def __init__(self, conn, profiler):
+        self._conn = conn
+        self._profiler = profiler
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        cursor = self._conn.execute(sql, params)
+        elapsed = time.perf_counter() - started
+        self._profiler.record(sql, elapsed, cursor.rowcount)
+        self._profiler.check_slow(self._conn, sql, params, 0.0, elapsed)
+        return ProfiledCursor(cursor, self._profiler, self._conn, sql, params, elapsed)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        started = time.perf_counter()
+        cursor = self._conn.executemany(sql, seq_of_params)
+        elapsed = time.perf_counter() - started
+        self._profiler.record(sql, elapsed, cursor.rowcount, calls=len(seq_of_params))
+        self._profiler.check_slow(self._conn, sql, seq_of_params[0] if seq_of_params else (), 0.0, elapsed)
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+query_profiler = QueryProfiler() if DB_PROFILE else None
+
+# ---------- WORKLOAD RECORDER ----------
+def _encode_param(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$b': bytes(value).hex()}
+    return str(value)
+
+class WorkloadRecorder:
+    """Appends every statement (text, parameters, timing, operation) to a gzipped JSONL log for workload.py.
+
+    Statement texts are written once and then referenced by id. Writing happens
+    on a background thread behind a bounded queue; when it falls behind, entries
+    are dropped and counted rather than slowing the database threads down.
+    """
+
+    def __init__(self, path, snapshot=None, max_pending=10000):
+        self.path = path
+        self.snapshot = snapshot
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._sessions = count(1)
+        self._started = time.perf_counter()
+        self._thread = Thread(target=self._write, name="workload-recorder", daemon=True)
+        self._thread.start()
+
+    def session(self):
+        """Id for one connection checkout; a unit of work is one session"""
+        return next(self._sessions)
+
+    def record(self, session, sql, params, started, seconds, rows, many=False):
+        entry = (started - self._started, session, current_operation.get(), sql, params, seconds, rows, many)
+        try:
+            self._queue.put_nowait(entry)
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        query_ids = {}
+        with gzip.open(self.path, "wt", encoding="utf-8") as log:
+            log.write(json.dumps({'workload': 1, 'started': utcnow().isoformat(), 'snapshot': self.snapshot}) + "\n")
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    break
+                offset, session, operation, sql, params, seconds, rows, many = entry
+                query_id = query_ids.get(sql)
+                if query_id is None:
+                    query_id = query_ids[sql] = len(query_ids)
+                    log.write(json.dumps({'q': query_id, 'sql': sql}) + "\n")
+                record = {'t': round(offset, 6), 's': session, 'op': operation, 'q': query_id,
+                          'p': params, 'ms': round(seconds * 1000, 3), 'rows': rows}
+                if many:
+                    record['many'] = True
+                log.write(json.dumps(record, default=_encode_param, separators=(',', ':')) + "\n")
+                if self._queue.empty():
+                    log.flush()  # Sync point, so a killed process still leaves a readable log
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=30)
+        print(f"📼 Workload log {self.path}: {self.recorded} statements recorded, {self.dropped} dropped")
+
+class RecordingConnection:
+    """Connection proxy that copies every statement into the workload log when DB_RECORD is set"""
+
+    def __init__(self, conn, recorder):
+        self._conn = conn
+        self._recorder = recorder
+        self._session = recorder.session()
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        cursor = self._conn.execute(sql, params)
+        self._recorder.record(self._session, sql, params, started, time.perf_counter() - started, cursor.rowcount)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        started = time.perf_counter()
+        cursor = self._conn.executemany(sql, seq_of_params)
+        self._recorder.record(self._session, sql, seq_of_params, started, time.perf_counter() - started,
+                              cursor.rowcount, many=True)
+        return cursor
+
+    def commit(self):
+        if self._conn.in_transaction:
+            self.execute("COMMIT")
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self.execute("ROLLBACK")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+workload_recorder = None
+
+def start_workload_recording(path):
+    """Snapshot the database beside `path`, then log every statement from here on"""
+    global workload_recorder
+    snapshot = re.sub(r"(\.jsonl)?(\.gz)?$", "", path) + ".snapshot.db"
+    with get_combat_db_connection() as db:
+        target = sqlite3.connect(snapshot)
+        db.backup(target)
+        target.close()
+    workload_recorder = WorkloadRecorder(path, snapshot)
+    print(f"📼 Recording the database workload to {path} (snapshot {snapshot})")
+    return workload_recorder
+
+# ---------- HISTORY WRITE-BEHIND ----------
+# Callers wait this long for room in a full buffer before their rows are dropped
+HISTORY_FULL_WAIT = 5.0
+
+class HistoryWriter:
+    """Write-behind buffer for append-only history rows (XP, training, daily actions, war logs).
+
+    Rows are grouped by statement and written with executemany in a single
+    transaction on the writer's own connection, every HISTORY_FLUSH_MS or as soon
+    as HISTORY_FLUSH_ROWS are waiting. The buffer is bounded: a full buffer makes
+    callers wait for the next flush, and rows are dropped and counted only if
+    none comes in time.
+    """
+
+    def __init__(self, database, flush_ms=HISTORY_FLUSH_MS, flush_rows=HISTORY_FLUSH_ROWS,
+                 max_pending=HISTORY_MAX_PENDING):
+        self.database = database
+        self.flush_interval = flush_ms / 1000
+        self.flush_rows = flush_rows
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self._rows = []  # (table, columns, values)
+        self._condition = Condition()
+        self._pool = None
+        self._thread = None
+        self._closing = False
+        self._in_flight = False
+
+    def add(self, rows):
+        """Queue (table, columns, values) rows; False if they had to be dropped"""
+        if not rows:
+            return True
+        deadline = time.monotonic() + HISTORY_FULL_WAIT
+        with self._condition:
+            if self._pool is None:
+                self._pool = CombatConnectionPool(self.database, max_size=1)
+            if self._closing:
+                # Shut down already - nothing will flush these later
+                return self._write(rows)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+            while len(self._rows) + len(rows) > self.max_pending:
+                self._condition.notify_all()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.dropped += len(rows)
+                    metrics.inc("combat_history_rows_dropped_total", len(rows))
+                    print(f"⚠️ History buffer full; dropped {len(rows)} rows")
+                    return False
+                self._condition.wait(remaining)
+            self._rows.extend(rows)
+            if len(self._rows) >= self.flush_rows:
+                self._condition.notify_all()
+        return True
+
+    def pending(self):
+        with self._condition:
+            return len(self._rows)
+
+    def flush(self):
+        """Write everything buffered now, for readers that need the history up to date"""
+        with self._condition:
+            if self._pool is None:
+                return True
+            batch, self._rows = self._rows, []
+            self._condition.notify_all()
+        written = self._write(batch) if batch else True
+        if not written:
+            self._requeue(batch)
+        with self._condition:
+            while self._in_flight:
+                self._condition.wait()
+        return written
+
+    def _requeue(self, batch):
+        with self._condition:
+            # Keep the batch for the next attempt if there is room for it
+            if not self._closing and len(self._rows) + len(batch) <= self.max_pending:
+                self._rows[:0] = batch
+            else:
+                self.dropped += len(batch)
+                metrics.inc("combat_history_rows_dropped_total", len(batch))
+
+    def _run(self):
+        current_operation.set("task:history_writer")
+        while True:
+            with self._condition:
+                while not self._rows and not self._closing:
+                    self._condition.wait()
+                if not self._rows:
+                    return
+                if len(self._rows) < self.flush_rows and not self._closing:
+                    self._condition.wait(self.flush_interval)
+                batch, self._rows = self._rows, []
+                self._in_flight = True
+                self._condition.notify_all()
+            written = self._write(batch)
+            with self._condition:
+                self._in_flight = False
+                self._condition.notify_all()
+            if not written:
+                self._requeue(batch)
+                time.sleep(1.0)
+
+    def _write(self, rows):
+        """Insert rows with one executemany per statement, all in one transaction"""
+        grouped = {}
+        for table, columns, values in rows:
+            grouped.setdefault((table, columns), []).append(values)
+        started = time.perf_counter()
+        conn = self._pool.acquire()
+        discard = False
+        try:
+            handle = query_profiler.wrap(conn) if query_profiler else conn
+            if workload_recorder:
+                handle = RecordingConnection(handle, workload_recorder)
+            handle.execute("BEGIN IMMEDIATE")
+            for (table, columns), values in grouped.items():
+                handle.executemany(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                   f"VALUES ({', '.join('?' * len(columns))})", values)
+            handle.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"Error writing history rows: {e}")
+            self.failed_flushes += 1
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+            return False
+        finally:
+            self._pool.release(conn, discard=discard)
+        self.flushes += 1
+        self.written += len(rows)
+        metrics.observe("combat_history_flush_seconds", time.perf_counter() - started)
+        for (table, _), values in grouped.items():
+            metrics.inc("combat_history_rows_total", len(values), table=table)
+        return True
+
+    def close(self):
+        """Flush everything still buffered and stop the writer thread"""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=30)
+            self._pool.close_all()
+            print(f"📜 History writer: {self.written} rows in {self.flushes} flushes, "
+                  f"{self.dropped} dropped, {self.pending()} left unwritten")
+
+history_writer = HistoryWriter(COMBAT_DB_NAME)
+
+def sqlite_timestamp(moment=None):
+    """UTC time in the text format CURRENT_TIMESTAMP defaults write"""
+    return (moment or utcnow()).strftime("%Y-%m-%d %H:%M:%S")
+
+def record_history(table, columns, rows):
+    """Queue append-only rows for `table`; inside a unit of work they are queued once it commits"""
+    entries = [(table, columns, values) for values in rows]
+    unit = getattr(_unit_of_work_state, 'unit', None)
+    if unit is not None:
+        unit.history.extend(entries)
+    else:
+        history_writer.add(entries)
 
 # ---------- ENHANCED MEDIEVAL FLAIR ----------
 MEDIEVAL_COLORS = {
@@ -176,6 +1102,29 @@ TERRAIN_EFFECTS = {
     "Coastal Cliffs": {"defense": 1.6, "cavalry": 0.2, "archery": 1.3, "ambush": 1.0, "infantry": 1.0, "siege": 0.5, "description": "Cliffs provide strong defense"},
 }
 
+# Seeded battle formations: name, infantry, cavalry, archer, defense, movement, description
+DEFAULT_FORMATIONS = [
+    ("Line", 1.0, 0.8, 1.2, 0.9, 0.0, "Standard infantry line with archer support"),
+    ("Phalanx", 1.3, 0.5, 0.7, 1.4, -0.2, "Dense spear formation, strong defense"),
+    ("Wedge", 0.9, 1.4, 0.6, 0.8, 0.1, "Cavalry wedge formation for breaking lines"),
+    ("Square", 1.1, 0.6, 1.0, 1.3, -0.3, "Defensive square against cavalry"),
+    ("Skirmish", 0.8, 0.9, 1.3, 0.7, 0.2, "Loose formation for archers and skirmishers"),
+    ("Column", 1.0, 1.1, 0.8, 0.8, 0.3, "Fast marching column"),
+    ("Echelon", 1.1, 1.2, 0.9, 0.9, 0.0, "Staggered formation for flanking"),
+    ("Tortoise", 1.2, 0.4, 0.5, 1.5, -0.4, "Testudo formation with overlapping shields"),
+]
+
+# Duel actions: the stat they scale with, its multiplier and the terrain column they use
+DUEL_ACTIONS = {
+    "power_strike": {"stat": 'strength', "multiplier": 2.2, "terrain": 'infantry'},
+    "magic_bolt": {"stat": 'intelligence', "multiplier": 2.8, "terrain": 'archery'},
+    "quick_strike": {"stat": 'agility', "multiplier": 2.0, "terrain": 'cavalry'},
+    "cavalry_charge": {"stat": 'strength', "multiplier": 2.5, "terrain": 'cavalry'},
+    "archer_volley": {"stat": 'agility', "multiplier": 2.3, "terrain": 'archery'},
+    "shield_wall": {"stat": 'vitality', "multiplier": 1.5, "terrain": 'defense'},
+    "flanking_maneuver": {"stat": 'agility', "multiplier": 2.1, "terrain": 'cavalry'},
+}
+
 # Army types with different strengths
 ARMY_TYPES = {
     "Infantry Heavy": {"infantry": 1.3, "cavalry": 0.8, "archers": 1.0, "siege": 0.9, "description": "Strong infantry forces"},
@@ -227,10 +1176,27 @@ def medieval_response(message, success=True, extra="", title=""):
     return medieval_embed(title=embed_title, description=full_message, color_name=color)
 
 # ---------- UTILITY FUNCTIONS ----------
-def generate_random_recruits():
+_seed_source = random.SystemRandom()
+
+def new_rng_seed():
+    """Fresh seed for a duel, war or training event (63 bits, fits a SQLite INTEGER)"""
+    return _seed_source.getrandbits(63)
+
+def event_rng(seed, step=0):
+    """Independent, reproducible generator for one step (turn) of a seeded event"""
+    return random.Random(f"{seed}:{step}")
+
+def parse_db_timestamp(value):
+    """Parse a stored timestamp (isoformat or SQLite CURRENT_TIMESTAMP) as an aware UTC datetime"""
+    if value is None:
+        return None
+    parsed = value if isinstance(value, dt) else dt.fromisoformat(str(value))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def generate_random_recruits(rng=random):
     """Generate random number of recruits with variation"""
-    base = random.randint(50, 150)
-    variation = random.randint(-20, 20)
+    base = rng.randint(50, 150)
+    variation = rng.randint(-20, 20)
     return max(10, base + variation)
 
 def get_random_terrain():
@@ -256,6 +1222,108 @@ def calculate_desertion_rate(morale, supplies, army_size):
     size_effect = army_size / 10000  # Larger armies harder to control
     return min(0.3, base_rate + morale_effect + supply_effect + size_effect)
 
+# Below this mode binomial_sample walks the exact CDF (a dozen steps at most);
+# above it BTRD rejection sampling takes constant expected time
+BINOMIAL_INVERSION_MODE = 11
+HALF_LOG_2PI = 0.5 * math.log(2 * math.pi)
+
+def stirling_correction(k):
+    """log(k!) minus its Stirling approximation (k + 1/2)log(k + 1) - (k + 1) + log(2pi)/2"""
+    return math.lgamma(k + 1) - (k + 0.5) * math.log(k + 1) + (k + 1) - HALF_LOG_2PI
+
+def binomial_btrd(n, p, rng):
+    """Exact Binomial(n, p) draw for p <= 0.5 and mode >= 11 (Hormann's BTRD, 1993)"""
+    mode = int((n + 1) * p)
+    r = p / (1 - p)
+    nr = (n + 1) * r
+    npq = n * p * (1 - p)
+    sqrt_npq = math.sqrt(npq)
+    b = 1.15 + 2.53 * sqrt_npq
+    a = -0.0873 + 0.0248 * b + 0.01 * p
+    c = n * p + 0.5
+    alpha = (2.83 + 5.1 / b) * sqrt_npq
+    v_r = 0.92 - 4.2 / b
+    u_rv_r = 0.86 * v_r
+
+    while True:
+        v = rng.random()
+        if v <= u_rv_r:
+            # Inside the hat's central box: accept straight away (most draws)
+            u = v / v_r - 0.43
+            return int(math.floor((2 * a / (0.5 - abs(u)) + b) * u + c))
+        if v >= v_r:
+            u = rng.random() - 0.5
+        else:
+            u = v / v_r - 0.93
+            u = math.copysign(0.5, u) - u
+            v = rng.random() * v_r
+
+        us = 0.5 - abs(u)
+        k = int(math.floor((2 * a / us + b) * u + c))
+        if k < 0 or k > n:
+            continue
+        v = v * alpha / (a / (us * us) + b)
+        km = abs(k - mode)
+        if km <= 15:
+            # Close to the mode: compare against the exact probability ratio
+            f = 1.0
+            if mode < k:
+                for i in range(mode + 1, k + 1):
+                    f *= nr / i - r
+            elif mode > k:
+                for i in range(k + 1, mode + 1):
+                    v *= nr / i - r
+            if v <= f:
+                return k
+            continue
+
+        # Far from the mode: squeeze, then the log-probability test
+        v = math.log(v)
+        rho = (km / npq) * (((km / 3 + 0.625) * km + 1 / 6) / npq + 0.5)
+        t = -km * km / (2 * npq)
+        if v < t - rho:
+            return k
+        if v > t + rho:
+            continue
+        nm = n - mode + 1
+        h = ((mode + 0.5) * math.log((mode + 1) / (r * nm)) +
+             stirling_correction(mode) + stirling_correction(n - mode))
+        nk = n - k + 1
+        if v <= (h + (n + 1) * math.log(nm / nk) + (k + 0.5) * math.log(nk * r / (k + 1)) -
+                 stirling_correction(k) - stirling_correction(n - k)):
+            return k
+
+def binomial_sample(n, p, rng=random):
+    """Draw one Binomial(n, p) sample without n separate coin flips, in constant expected time"""
+    if n <= 0 or p <= 0:
+        return 0
+    if p >= 1:
+        return n
+
+    # Sample the rarer outcome: BTRD needs p <= 0.5 and the inversion walk stays short
+    flipped = p > 0.5
+    if flipped:
+        p = 1 - p
+
+    if (n + 1) * p < BINOMIAL_INVERSION_MODE:
+        # Exact inversion: walk P(X=0), P(X=1), ... until u is used up
+        q = 1 - p
+        ratio = p / q
+        prob = q ** n
+        u = rng.random()
+        successes = 0
+        while u > prob and successes < n:
+            u -= prob
+            successes += 1
+            prob *= ratio * (n - successes + 1) / successes
+    else:
+        successes = binomial_btrd(n, p, rng)
+
+    return n - successes if flipped else successes
+
+# Sampler used for training desertions; swap for another (n, p, rng) -> count callable if needed
+desertion_sampler = binomial_sample
+
 def calculate_supply_consumption(army_size, days=1):
     """Calculate daily supply consumption for army"""
     base_consumption = army_size * 0.01  # 1% of army size per day
@@ -269,6 +1337,77 @@ def calculate_knight_chance(training_size, commander_level):
     return min(0.15, base_chance + size_bonus + level_bonus)  # Max 15% chance
 
 # ---------- ENHANCED COMBAT DATABASE ----------
+def ensure_column(db, table, column, definition):
+    """Add a column to an existing table if an older schema lacks it"""
+    columns = {row['name'] for row in db.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        print(f"✅ Added {table}.{column}")
+
+def migrate_duel_action_blobs(db):
+    """Move legacy challenger_actions/defender_actions lists into duel_turns"""
+    legacy = db.execute("""
+    SELECT id, challenger_id, defender_id, challenger_actions, defender_actions
+    FROM active_duels
+    WHERE challenger_actions NOT IN ('[]', '') OR defender_actions NOT IN ('[]', '')
+    """).fetchall()
+
+    migrated = 0
+    for duel in legacy:
+        turns = []
+        cleared = []
+        for field, user_id in (('challenger_actions', duel['challenger_id']),
+                               ('defender_actions', duel['defender_id'])):
+            try:
+                actions = ast.literal_eval(duel[field] or '[]')
+            except (ValueError, SyntaxError):
+                print(f"⚠️ Unreadable {field} on duel {duel['id']}, skipping")
+                continue
+            turns.extend((duel['id'], entry.get('turn'), user_id, entry.get('action'),
+                          entry.get('damage'), bool(entry.get('critical')))
+                         for entry in actions)
+            cleared.append(field)
+
+        if not cleared:
+            continue
+        # Only reset the lists that were moved; unreadable ones stay for a manual look
+        db.executemany("""
+        INSERT INTO duel_turns (duel_id, turn, user_id, action, damage, critical)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, sorted(turns, key=lambda turn: turn[1] or 0))
+        db.execute(f"""
+        UPDATE active_duels SET {', '.join(f"{field}='[]'" for field in cleared)} WHERE id=?
+        """, (duel['id'],))
+        migrated += len(turns)
+
+    if legacy:
+        print(f"✅ Migrated {migrated} duel actions from {len(legacy)} duels into duel_turns")
+
+def migrate_legacy_achievements(db):
+    """Move the repr lists in combatants.achievements into player_achievements"""
+    legacy = db.execute("""
+    SELECT user_id, guild_id, achievements FROM combatants
+    WHERE achievements NOT IN ('[]', '')
+    """).fetchall()
+
+    migrated = 0
+    for combatant in legacy:
+        try:
+            names = ast.literal_eval(combatant['achievements'])
+        except (ValueError, SyntaxError):
+            print(f"⚠️ Unreadable achievements for {combatant['user_id']}, skipping")
+            continue
+        migrated += db.executemany("""
+        INSERT OR IGNORE INTO player_achievements (user_id, guild_id, achievement_name)
+        VALUES (?, ?, ?)
+        """, [(combatant['user_id'], combatant['guild_id'], name) for name in names]).rowcount
+        db.execute("""
+        UPDATE combatants SET achievements='[]' WHERE user_id=? AND guild_id=?
+        """, (combatant['user_id'], combatant['guild_id']))
+
+    if legacy:
+        print(f"✅ Migrated {migrated} achievements from {len(legacy)} combatants into player_achievements")
+
 def init_combat_db():
     """Initialize enhanced combat database with comprehensive systems"""
     try:
@@ -340,6 +1479,7 @@ def init_combat_db():
                 total_siege INTEGER DEFAULT 0,
                 recruitment_cooldown TIMESTAMP,
                 last_supply_check TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                supply_upkeep_owed INTEGER DEFAULT 0,
                 battle_formation TEXT DEFAULT 'Line',
                 fortifications INTEGER DEFAULT 0,
                 daily_actions INTEGER DEFAULT 3,
@@ -363,7 +1503,8 @@ def init_combat_db():
                 training_quality TEXT DEFAULT 'Normal',
                 success_rate REAL,
                 morale_change INTEGER,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                rng_seed INTEGER
             )""")
 
             # Comprehensive War casualties tracking
@@ -407,9 +1548,39 @@ def init_combat_db():
                 last_action TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 round_timeout INTEGER DEFAULT 60,
                 terrain TEXT DEFAULT 'Open Plains',
-                weather TEXT DEFAULT 'Clear Skies'
+                weather TEXT DEFAULT 'Clear Skies',
+                rng_seed INTEGER,
+                combatant_snapshot TEXT,
+                turn_expires_at TIMESTAMP,
+                channel_id INTEGER
             )""")
 
+            # Duel action log, one row per action
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS duel_turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                duel_id INTEGER,
+                turn INTEGER,
+                user_id INTEGER,
+                action TEXT,
+                damage INTEGER,
+                critical BOOLEAN DEFAULT FALSE,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )""")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_duel_turns_duel ON duel_turns (duel_id, turn)")
+            migrate_duel_action_blobs(db)
+
+            # Earned achievements, one row per award
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS player_achievements (
+                user_id INTEGER,
+                guild_id INTEGER,
+                achievement_name TEXT,
+                earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, guild_id, achievement_name)
+            )""")
+            migrate_legacy_achievements(db)
+
             # Enhanced Faction wars with more details
             db.execute("""
             CREATE TABLE IF NOT EXISTS faction_wars (
@@ -442,7 +1613,9 @@ def init_combat_db():
                 ended_at TIMESTAMP,
                 victory_conditions TEXT DEFAULT '{"type": "annihilation", "rounds": 10}',
                 current_tactic_a TEXT DEFAULT 'Frontal Assault',
-                current_tactic_b TEXT DEFAULT 'Frontal Assault'
+                current_tactic_b TEXT DEFAULT 'Frontal Assault',
+                rng_seed INTEGER,
+                last_action TIMESTAMP
             )""")
 
             # Comprehensive War actions
@@ -542,23 +1715,63 @@ def init_combat_db():
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )""")
 
+            # Per-event random seeds, added after these tables first shipped
+            for table in ('active_duels', 'faction_wars', 'training_history'):
+                ensure_column(db, table, 'rng_seed', 'INTEGER')
+            for table in ('active_duels', 'faction_wars'):
+                db.execute(f"""
+                UPDATE {table} SET rng_seed = random() & 9223372036854775807
+                WHERE rng_seed IS NULL AND status='active'
+                """)
+
+            # Stats each duel is fought with, added after active_duels first shipped
+            ensure_column(db, 'active_duels', 'combatant_snapshot', 'TEXT')
+
+            # Turn clock and where to announce forfeits; NULL on duels from before the clock
+            ensure_column(db, 'active_duels', 'turn_expires_at', 'TIMESTAMP')
+            ensure_column(db, 'active_duels', 'channel_id', 'INTEGER')
+
+            # Turn deadlines for wars, added after faction_wars first shipped
+            ensure_column(db, 'faction_wars', 'last_action', 'TIMESTAMP')
+
+            # Unpaid fraction of supply upkeep, added after armies first shipped
+            ensure_column(db, 'armies', 'supply_upkeep_owed', 'INTEGER DEFAULT 0')
+
+            # Static seed tables are keyed by name; drop duplicate seed rows left
+            # by earlier startups so the unique indexes can be created
+            for table, name_column in STATIC_TABLE_KEYS.items():
+                db.execute(f"""
+                DELETE FROM {table} WHERE id NOT IN (
+                    SELECT MIN(id) FROM {table} GROUP BY {name_column}
+                )""")
+                db.execute(f"""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_unique_name
+                ON {table} ({name_column})
+                """)
+
+            # Every change to a static table bumps its version so the in-memory copy knows to reload
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS static_table_versions (
+                table_name TEXT PRIMARY KEY,
+                version INTEGER DEFAULT 0
+            )""")
+            for table in STATIC_TABLE_KEYS:
+                db.execute("INSERT OR IGNORE INTO static_table_versions (table_name) VALUES (?)", (table,))
+                for event in ("INSERT", "UPDATE", "DELETE"):
+                    db.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                    AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE static_table_versions SET version=version+1 WHERE table_name='{table}';
+                    END""")
+
             # Insert default battle formations
-            default_formations = [
-                ("Line", 1.0, 0.8, 1.2, 0.9, 0.0, "Standard infantry line with archer support"),
-                ("Phalanx", 1.3, 0.5, 0.7, 1.4, -0.2, "Dense spear formation, strong defense"),
-                ("Wedge", 0.9, 1.4, 0.6, 0.8, 0.1, "Cavalry wedge formation for breaking lines"),
-                ("Square", 1.1, 0.6, 1.0, 1.3, -0.3, "Defensive square against cavalry"),
-                ("Skirmish", 0.8, 0.9, 1.3, 0.7, 0.2, "Loose formation for archers and skirmishers"),
-                ("Column", 1.0, 1.1, 0.8, 0.8, 0.3, "Fast marching column"),
-                ("Echelon", 1.1, 1.2, 0.9, 0.9, 0.0, "Staggered formation for flanking"),
-                ("Tortoise", 1.2, 0.4, 0.5, 1.5, -0.4, "Testudo formation with overlapping shields"),
-            ]
 
             db.executemany("""
             INSERT OR IGNORE INTO battle_formations
             (formation_name, infantry_bonus, cavalry_bonus, archer_bonus, defense_bonus, movement_penalty, description)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, default_formations)
+            """, DEFAULT_FORMATIONS)
 
             # Insert default siege equipment
             default_siege = [
@@ -597,100 +1810,471 @@ def init_combat_db():
             VALUES (?, ?, ?, ?, ?)
             """, default_achievements)
 
+            # Secondary indexes for the hot lookups. The duel/war lookups OR two
+            # leader columns together, so status is an index column rather than a
+            # partial-index predicate (SQLite cannot use partial indexes per OR branch).
+            db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_active_duels_challenger
+            ON active_duels (challenger_id, guild_id, status)
+            """)
+            db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_active_duels_defender
+            ON active_duels (defender_id, guild_id, status)
+            """)
+            db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_faction_wars_team_a
+            ON faction_wars (team_a_leader, guild_id, status)
+            """)
+            db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_faction_wars_team_b
+            ON faction_wars (team_b_leader, guild_id, status)
+            """)
+            db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_armies_recruitment_cooldown
+            ON armies (datetime(recruitment_cooldown))
+            WHERE recruitment_cooldown IS NOT NULL
+            """)
+            db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_armies_daily_reset
+            ON armies (datetime(last_daily_reset))
+            """)
+
+            # Append-only history tables
+            db.execute("CREATE INDEX IF NOT EXISTS idx_xp_history_user ON xp_history (user_id, guild_id, timestamp)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_training_history_user ON training_history (user_id, guild_id, timestamp)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_daily_actions_user ON daily_actions (user_id, guild_id, timestamp)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_fortification_history_user ON fortification_history (user_id, guild_id, timestamp)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_war_casualties_war ON war_casualties (war_id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_war_casualties_user ON war_casualties (user_id, guild_id)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_war_actions_war ON war_actions (war_id)")
+
             db.commit()
             print("✅ Enhanced combat database with comprehensive systems initialized")
+
+            check_query_plans(db)
+            refresh_game_tables(db, force=True)
     except sqlite3.Error as e:
         print(f"❌ Enhanced combat database initialization error: {e}")
         traceback.print_exc()
         raise
 
+# Queries run on every command; check_query_plans warns if any of them stop using an index.
+# Each is defined once, beside the function that runs it, and registered here under its name.
+HOT_QUERIES = {
+    "duel_turns": "SELECT * FROM duel_turns WHERE duel_id=? ORDER BY turn, id",
+}
+
+def check_query_plans(db):
+    """Run EXPLAIN QUERY PLAN over the hot queries and warn about full table scans"""
+    full_scans = []
+    for name, query in HOT_QUERIES.items():
+        try:
+            named = re.findall(r":(\w+)", query)
+            params = {name: None for name in named} if named else [None] * query.count("?")
+            plan = db.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not explain hot query '{name}': {e}")
+            continue
+
+        for row in plan:
+            detail = row['detail']
+            # Any SCAN walks a whole table or index; hot queries should only SEARCH
+            if detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW":
+                full_scans.append((name, detail))
+                print(f"⚠️ Full table scan in hot query '{name}': {detail}")
+
+    if not full_scans:
+        print(f"✅ Query plans checked: {len(HOT_QUERIES)} hot queries use indexes")
+    return full_scans
+
+# ---------- STATIC GAME TABLES ----------
+# Seed tables that only change by hand, mapped to the column they are keyed by
+STATIC_TABLE_KEYS = {
+    'battle_formations': 'formation_name',
+    'siege_equipment': 'equipment_name',
+    'achievements': 'achievement_name',
+}
+
+# Achievement requirement keys mapped to the combatant/army column they read
+ACHIEVEMENT_STATS = {
+    'wins': 'wins',
+    'level': 'level',
+    'soldiers': 'current_soldiers',
+    'knights': 'total_knights',
+    'total_recruits': 'total_recruits_trained',
+    'fortifications': 'fortifications',
+}
+
+class AchievementRule:
+    """Compiled achievement: every required column must reach its threshold"""
+
+    __slots__ = ('name', 'description', 'reward', 'requirements')
+
+    def __init__(self, name, description, reward, requirements):
+        self.name = name
+        self.description = description
+        self.reward = reward
+        self.requirements = MappingProxyType(requirements)
+
+    def is_met(self, stats):
+        return all(stats.get(column, 0) >= threshold for column, threshold in self.requirements.items())
+
+def compile_achievement_rules(achievements):
+    """Compile requirement JSON into rules indexed by the columns they depend on"""
+    by_stat = {}
+    for achievement in achievements:
+        try:
+            requirement = json.loads(achievement['requirement'] or '{}')
+        except ValueError:
+            print(f"⚠️ Achievement '{achievement['achievement_name']}' has an unreadable requirement, skipping")
+            continue
+
+        unknown = [key for key in requirement if key not in ACHIEVEMENT_STATS]
+        if unknown or not requirement:
+            # Nothing tracks these stats, so the achievement can never be earned
+            print(f"⚠️ Achievement '{achievement['achievement_name']}' needs untracked stats {unknown}, disabled")
+            continue
+
+        rule = AchievementRule(
+            achievement['achievement_name'], achievement['description'], achievement['reward'],
+            {ACHIEVEMENT_STATS[key]: value for key, value in requirement.items()}
+        )
+        for column in rule.requirements:
+            by_stat.setdefault(column, []).append(rule)
+
+    return MappingProxyType({column: tuple(rules) for column, rules in by_stat.items()})
+
+class GameTables:
+    """Read-only snapshot of the static seed tables; replaced wholesale on refresh"""
+
+    __slots__ = ('formations', 'formation_bonuses', 'siege_equipment', 'achievements',
+                 'achievement_rules', 'versions')
+
+    def __init__(self, formations=None, siege_equipment=None, achievements=(), versions=None):
+        self.formations = MappingProxyType(formations or {})
+        self.siege_equipment = MappingProxyType(siege_equipment or {})
+        self.achievements = tuple(achievements)
+        self.versions = MappingProxyType(versions or {})
+        self.achievement_rules = compile_achievement_rules(self.achievements)
+
+        # Average of the four combat bonuses, the multiplier used for army power
+        self.formation_bonuses = MappingProxyType({
+            name: (row['infantry_bonus'] + row['cavalry_bonus'] +
+                   row['archer_bonus'] + row['defense_bonus']) / 4
+            for name, row in self.formations.items()
+        })
+
+    @classmethod
+    def load(cls, db, versions):
+        """Build a snapshot from the current table contents"""
+        def rows(table):
+            return [MappingProxyType(dict(row)) for row in db.execute(f"SELECT * FROM {table} ORDER BY id")]
+
+        return cls(
+            formations={row['formation_name']: row for row in rows('battle_formations')},
+            siege_equipment={row['equipment_name']: row for row in rows('siege_equipment')},
+            achievements=rows('achievements'),
+            versions=versions
+        )
+
+game_tables = GameTables()
+_game_tables_lock = Lock()
+
+def refresh_game_tables(db=None, force=False):
+    """Reload the static tables if their version counters moved; returns True if reloaded"""
+    global game_tables
+
+    if db is None:
+        with get_combat_db_connection() as db:
+            return refresh_game_tables(db, force)
+
+    versions = {row['table_name']: row['version']
+                for row in db.execute("SELECT table_name, version FROM static_table_versions")}
+    if not force and versions == dict(game_tables.versions):
+        return False
+
+    with _game_tables_lock:
+        game_tables = GameTables.load(db, versions)
+    print(f"✅ Static tables loaded: {len(game_tables.formations)} formations, "
+          f"{len(game_tables.siege_equipment)} siege engines, {len(game_tables.achievements)} achievements")
+    return True
+
 # ---------- CHARACTER SYSTEM ----------
+class CombatantCache:
+    """LRU cache of combatant records with a TTL, keyed by (user_id, guild_id)"""
+
+    def __init__(self, max_size=COMBATANT_CACHE_SIZE, ttl=COMBATANT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._columns = ()
+        self._lock = Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(zip(self._columns, entry[1]))
+
+    def put(self, key, record, version):
+        """Store a record read at `version`; dropped if an invalidation happened since"""
+        with self._lock:
+            if version != self.version:
+                return
+            self._columns = tuple(record.keys())
+            self._entries[key] = (time.monotonic(), tuple(record.values()))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
+
+combatant_cache = CombatantCache()
+
+def invalidate_combatant(user_id, guild_id):
+    """Drop a cached combatant after its combatants or armies row changes"""
+    combatant_cache.invalidate((user_id, guild_id))
+    unit = getattr(_unit_of_work_state, 'unit', None)
+    if unit is not None:
+        unit.touched.add((user_id, guild_id))
+
+def invalidate_all_combatants():
+    """Drop every cached combatant after a bulk armies/combatants update"""
+    combatant_cache.clear()
+    unit = getattr(_unit_of_work_state, 'unit', None)
+    if unit is not None:
+        unit.touched_all = True
+
+COMBATANT_SQL = """
+SELECT c.*, a.army_type, a.current_soldiers, a.current_recruits, a.max_soldiers,
+       a.max_recruits, a.tactical_points, a.morale, a.supplies,
+       a.total_knights, a.total_archers, a.total_cavalry, a.total_siege,
+       a.fortifications, a.weekly_recruitment_used, a.daily_actions,
+       a.battle_formation, a.last_daily_reset, a.last_supply_check
+FROM combatants c
+LEFT JOIN armies a ON c.user_id = a.user_id AND c.guild_id = a.guild_id
+WHERE c.user_id=? AND c.guild_id=?"""
+
+HOT_QUERIES["get_enhanced_combatant"] = COMBATANT_SQL
+
 def get_enhanced_combatant(user_id, guild_id):
     """Get combatant character with enhanced army data"""
+    # Inside a unit of work reads must see the transaction's own uncommitted writes
+    in_unit = getattr(_unit_of_work_state, 'unit', None) is not None
+    key = (user_id, guild_id)
+    if not in_unit:
+        cached = combatant_cache.get(key)
+        if cached is not None:
+            return cached
+
     try:
+        version = combatant_cache.version
         with get_combat_db_connection() as db:
-            result = db.execute("""
-            SELECT c.*, a.army_type, a.current_soldiers, a.current_recruits, a.max_soldiers,
-                   a.max_recruits, a.tactical_points, a.morale, a.supplies,
-                   a.total_knights, a.total_archers, a.total_cavalry, a.total_siege,
-                   a.fortifications, a.weekly_recruitment_used, a.daily_actions,
-                   a.battle_formation, a.last_daily_reset
-            FROM combatants c
-            LEFT JOIN armies a ON c.user_id = a.user_id AND c.guild_id = a.guild_id
-            WHERE c.user_id=? AND c.guild_id=?
-            """, (user_id, guild_id)).fetchone()
-
-            return dict(result) if result else None
+            accrue_army_supplies(db, user_id, guild_id)
+            result = db.execute(COMBATANT_SQL, (user_id, guild_id)).fetchone()
+
+            if not result:
+                return None
+            combatant = dict(result)
+            if not in_unit:
+                combatant_cache.put(key, combatant, version)
+            return combatant
     except sqlite3.Error as e:
+        if in_unit_of_work():
+            raise
         print(f"Error getting enhanced combatant: {e}")
         return None
 
+# {assignments} is filled with "column=?" pairs for the stats being changed
+COMBATANT_UPDATE_SQL = "UPDATE combatants SET {assignments}, last_active=? WHERE user_id=? AND guild_id=?"
+
+HOT_QUERIES["update_combatant_stats"] = COMBATANT_UPDATE_SQL.format(assignments="wins=?")
+
 def update_combatant_stats(user_id, guild_id, **stats):
     """Update combatant stats with timestamp"""
     try:
         with get_combat_db_connection() as db:
             set_clause = ", ".join([f"{key}=?" for key in stats.keys()])
-            values = list(stats.values()) + [user_id, guild_id]
+            values = list(stats.values()) + [utcnow().isoformat(), user_id, guild_id]
 
-            db.execute(f"""
-            UPDATE combatants SET {set_clause}, last_active=? WHERE user_id=? AND guild_id=?
-            """, values + [utcnow().isoformat()])
+            db.execute(COMBATANT_UPDATE_SQL.format(assignments=set_clause), values)
+            invalidate_combatant(user_id, guild_id)
             db.commit()
     except Exception as e:
+        if in_unit_of_work():
+            raise
         print(f"Error updating combatant stats: {e}")
 
-def add_experience(user_id, guild_id, exp, source="unknown"):
-    """Add experience with scaling requirements and achievements"""
+MAX_LEVEL = 200
+STAT_POINTS_PER_LEVEL = 3
+
+def xp_needed_for_level(level):
+    """XP needed to advance from `level` to the next"""
+    return int(100 * (1.7 ** (level - 1)))
+
+# XP_THRESHOLDS[i] is the lifetime XP needed to reach level i + 1
+XP_THRESHOLDS = tuple(accumulate((xp_needed_for_level(level) for level in range(1, MAX_LEVEL)), initial=0))
+
+def resolve_level(level, experience, exp_gained):
+    """Return (level, experience, experience_needed, levels_gained) after gaining XP"""
+    level = min(max(1, level), MAX_LEVEL)
+    total = XP_THRESHOLDS[level - 1] + max(0, experience) + exp_gained
+    new_level = max(level, min(bisect_right(XP_THRESHOLDS, total), MAX_LEVEL))
+    return new_level, total - XP_THRESHOLDS[new_level - 1], xp_needed_for_level(new_level), new_level - level
+
+def add_experience_bulk(guild_id, awards):
+    """Award XP to many combatants at once; `awards` is a list of (user_id, exp, source).
+
+    Returns {user_id: levels_gained} for every registered combatant awarded.
+    """
     try:
-        combatant = get_enhanced_combatant(user_id, guild_id)
-        if not combatant:
-            return False, 0
-
-        new_exp = combatant['experience'] + exp
-        new_level = combatant['level']
-        new_stat_points = combatant['stat_points']
-        levels_gained = 0
-
-        # Calculate XP needed for next level (scaling)
-        while new_exp >= combatant['experience_needed']:
-            new_exp -= combatant['experience_needed']
-            new_level += 1
-            levels_gained += 1
-            new_stat_points += 3  # 3 stat points per level
-            # Increase XP needed for next level
-            new_xp_needed = int(100 * (1.7 ** (new_level - 1)))
-
-            # Update XP needed
-            update_combatant_stats(user_id, guild_id,
-                                  level=new_level,
-                                  stat_points=new_stat_points,
-                                  experience_needed=new_xp_needed)
-
-            # Check for level-based achievements
-            check_achievements(user_id, guild_id)
-
-        update_combatant_stats(user_id, guild_id,
-                              experience=new_exp,
-                              level=new_level,
-                              stat_points=new_stat_points)
-
-        # Record XP gain for tracking
-        with get_combat_db_connection() as db:
-            db.execute("""
-            INSERT INTO xp_history (user_id, guild_id, amount, source, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-            """, (user_id, guild_id, exp, source, utcnow().isoformat()))
-            db.commit()
+        totals = {}
+        for user_id, exp, _ in awards:
+            totals[user_id] = totals.get(user_id, 0) + exp
+        if not totals:
+            return {}
+
+        now = utcnow().isoformat()
+        level_changes = {}
+        with combat_unit_of_work() as db:
+            placeholders = ", ".join("?" * len(totals))
+            rows = db.execute(f"""
+            SELECT user_id, level, experience, stat_points FROM combatants
+            WHERE guild_id=? AND user_id IN ({placeholders})
+            """, [guild_id, *totals]).fetchall()
+
+            updates = []
+            for row in rows:
+                level, experience, experience_needed, gained = resolve_level(
+                    row['level'], row['experience'], totals[row['user_id']]
+                )
+                updates.append((experience, level, row['stat_points'] + gained * STAT_POINTS_PER_LEVEL,
+                                experience_needed, now, row['user_id'], guild_id))
+                level_changes[row['user_id']] = (row['level'], level)
 
-        return levels_gained > 0, levels_gained
+            db.executemany("""
+            UPDATE combatants
+            SET experience=?, level=?, stat_points=?, experience_needed=?, last_active=?
+            WHERE user_id=? AND guild_id=?
+            """, updates)
+
+            # Record XP gain for tracking
+            record_history("xp_history", ("user_id", "guild_id", "amount", "source", "timestamp"),
+                           [(user_id, guild_id, exp, source, now)
+                            for user_id, exp, source in awards if user_id in level_changes])
+
+            for user_id, (old_level, new_level) in level_changes.items():
+                invalidate_combatant(user_id, guild_id)
+                # Check for level-based achievements
+                if new_level > old_level:
+                    award_achievements(user_id, guild_id, {'level': new_level}, {'level': old_level})
+
+        return {user_id: new_level - old_level for user_id, (old_level, new_level) in level_changes.items()}
 
     except Exception as e:
+        if in_unit_of_work():
+            raise
         print(f"Error adding experience: {e}")
-        return False, 0
+        return {}
 
 # ---------- ENHANCED ARMY MANAGEMENT ----------
-def calculate_army_power(combatant):
-    """Calculate comprehensive army power"""
+SUPPLY_CHUNK_SIZE = 5000
+SUPPLY_IDLE_HOURS = 24
+
+# Army size in supply-consuming heads (matches calculate_army_power's unit weights)
+ARMY_SIZE_SQL = """(current_soldiers + total_knights * 10 + total_archers * 3 +
+                    total_cavalry * 8 + total_siege * 15)"""
+
+# Whole hours of supply consumption not yet applied to the row
+# (integer seconds: julianday differences can land a hair under a whole hour)
+SUPPLY_ELAPSED_HOURS_SQL = """((CAST(strftime('%s', :now) AS INTEGER)
+                              - CAST(strftime('%s', COALESCE(last_supply_check, :now)) AS INTEGER)) / 3600)"""
+
+# An army eats 1% of its size in supplies a day, i.e. size/2400 an hour. Upkeep
+# is counted in 1/2400ths of a supply so the unpaid fraction carries over exactly
+# in supply_upkeep_owed, and accruing hourly costs the same as once a week.
+SUPPLY_UPKEEP_UNITS = 2400
+
+SUPPLY_OWED_SQL = f"""(COALESCE(supply_upkeep_owed, 0) + {ARMY_SIZE_SQL} * {SUPPLY_ELAPSED_HOURS_SQL})"""
+
+SUPPLY_REMAINING_SQL = f"""MAX(0, supplies - {SUPPLY_OWED_SQL} / {SUPPLY_UPKEEP_UNITS})"""
+
+# Elapsed hours spent at 10 supplies or fewer: every hour from the first one whose
+# upkeep brought the army that low
+SUPPLY_LOW_HOURS_SQL = f"""CASE
+    WHEN {SUPPLY_REMAINING_SQL} > 10 THEN 0
+    WHEN supplies <= 10 THEN {SUPPLY_ELAPSED_HOURS_SQL}
+    ELSE {SUPPLY_ELAPSED_HOURS_SQL} + 1 - MAX(1,
+        ((supplies - 10) * {SUPPLY_UPKEEP_UNITS} - COALESCE(supply_upkeep_owed, 0) + {ARMY_SIZE_SQL} - 1)
+        / {ARMY_SIZE_SQL})
+END"""
+
+# Apply all whole hours of consumption since last_supply_check. Armies lose 10
+# morale for each of those hours spent at 10 supplies or fewer (the old 30-minute
+# sweep's -5 per tick). last_supply_check advances by whole hours only, so the
+# partial hour carries over. All SET expressions see the pre-update row. Callers
+# append further WHERE conditions with AND.
+SUPPLY_ACCRUAL_SQL = f"""
+UPDATE armies
+SET morale = CASE WHEN {SUPPLY_REMAINING_SQL} <= 10
+                  THEN MAX(1, morale - 10 * {SUPPLY_LOW_HOURS_SQL})
+                  ELSE morale END,
+    supplies = {SUPPLY_REMAINING_SQL},
+    supply_upkeep_owed = {SUPPLY_OWED_SQL} % {SUPPLY_UPKEEP_UNITS},
+    last_supply_check = datetime(COALESCE(last_supply_check, :now),
+                                 '+' || {SUPPLY_ELAPSED_HOURS_SQL} || ' hours')
+WHERE {SUPPLY_ELAPSED_HOURS_SQL} >= 1"""
+
+ARMY_SUPPLY_ACCRUAL_SQL = f"{SUPPLY_ACCRUAL_SQL} AND user_id=:user_id AND guild_id=:guild_id"
+
+HOT_QUERIES["accrue_army_supplies"] = ARMY_SUPPLY_ACCRUAL_SQL
+
+def accrue_army_supplies(db, user_id, guild_id):
+    """Bring one army's supplies and morale up to date before it is read or changed"""
+    accrued = db.execute(ARMY_SUPPLY_ACCRUAL_SQL, {
+        'now': utcnow().isoformat(), 'user_id': user_id, 'guild_id': guild_id
+    }).rowcount
+    if accrued:
+        invalidate_combatant(user_id, guild_id)
+    return accrued > 0
+
+def calculate_army_power(combatant, tables=None):
+    """Calculate comprehensive army power from the combatant and the static tables"""
+    tables = tables or game_tables
     try:
         # Base calculations
         infantry_power = combatant['current_soldiers']
@@ -716,7 +2300,7 @@ def calculate_army_power(combatant):
         morale_multiplier = 0.5 + (morale / 100) * 0.5  # 0.75x to 1.25x
 
         # Apply formation bonus
-        formation_bonus = get_formation_bonus(combatant.get('battle_formation', 'Line'))
+        formation_bonus = tables.formation_bonuses.get(combatant.get('battle_formation', 'Line'), 1.0)
         total_power = int(total_power * morale_multiplier * formation_bonus)
 
         return {
@@ -734,23 +2318,6 @@ def calculate_army_power(combatant):
         print(f"Error calculating army power: {e}")
         return {'total': 0, 'infantry': 0, 'knights': 0, 'archers': 0, 'cavalry': 0, 'siege': 0, 'morale_multiplier': 1.0, 'formation_bonus': 1.0}
 
-def get_formation_bonus(formation_name):
-    """Get bonus from formation"""
-    try:
-        with get_combat_db_connection() as db:
-            formation = db.execute("""
-            SELECT infantry_bonus, cavalry_bonus, archer_bonus, defense_bonus
-            FROM battle_formations WHERE formation_name=?
-            """, (formation_name,)).fetchone()
-
-            if formation:
-                # Average of bonuses
-                return (formation['infantry_bonus'] + formation['cavalry_bonus'] +
-                       formation['archer_bonus'] + formation['defense_bonus']) / 4
-            return 1.0
-    except:
-        return 1.0
-
 def can_perform_daily_action(user_id, guild_id):
     """Check if user can perform a daily action"""
     try:
@@ -759,7 +2326,7 @@ def can_perform_daily_action(user_id, guild_id):
             return False, "Not registered"
 
         # Check if daily reset is needed
-        last_reset = dt.fromisoformat(combatant['last_daily_reset']) if combatant['last_daily_reset'] else utcnow()
+        last_reset = parse_db_timestamp(combatant['last_daily_reset']) or utcnow()
         if (utcnow() - last_reset).days >= 1:
             # Reset daily actions
             with get_combat_db_connection() as db:
@@ -767,6 +2334,7 @@ def can_perform_daily_action(user_id, guild_id):
                 UPDATE armies SET daily_actions=3, last_daily_reset=?
                 WHERE user_id=? AND guild_id=?
                 """, (utcnow().isoformat(), user_id, guild_id))
+                invalidate_combatant(user_id, guild_id)
                 db.commit()
             return True, "Actions reset"
 
@@ -775,6 +2343,8 @@ def can_perform_daily_action(user_id, guild_id):
 
         return True, f"{combatant['daily_actions']} actions remaining"
     except Exception as e:
+        if in_unit_of_work():
+            raise
         return False, f"Error: {str(e)}"
 
 def use_daily_action(user_id, guild_id, action_type):
@@ -782,31 +2352,36 @@ def use_daily_action(user_id, guild_id, action_type):
     try:
         with get_combat_db_connection() as db:
             # Record action
-            db.execute("""
-            INSERT INTO daily_actions (user_id, guild_id, action_type)
-            VALUES (?, ?, ?)
-            """, (user_id, guild_id, action_type))
+            record_history("daily_actions", ("user_id", "guild_id", "action_type", "timestamp"),
+                           [(user_id, guild_id, action_type, sqlite_timestamp())])
 
             # Decrement action count
             db.execute("""
             UPDATE armies SET daily_actions=daily_actions-1
             WHERE user_id=? AND guild_id=?
             """, (user_id, guild_id))
+            invalidate_combatant(user_id, guild_id)
             db.commit()
             return True
     except Exception as e:
+        if in_unit_of_work():
+            raise
         print(f"Error using daily action: {e}")
         return False
 
 # ---------- RECRUITMENT & TRAINING ----------
+RECRUIT_ELIGIBILITY_SQL = """
+SELECT weekly_recruitment_used, recruitment_cooldown, morale, supplies, daily_actions
+FROM armies WHERE user_id=? AND guild_id=?"""
+
+HOT_QUERIES["can_recruit_army"] = RECRUIT_ELIGIBILITY_SQL
+
 def can_recruit_army(user_id, guild_id):
     """Recruitment eligibility check"""
     try:
         with get_combat_db_connection() as db:
-            army = db.execute("""
-            SELECT weekly_recruitment_used, recruitment_cooldown, morale, supplies, daily_actions
-            FROM armies WHERE user_id=? AND guild_id=?
-            """, (user_id, guild_id)).fetchone()
+            accrue_army_supplies(db, user_id, guild_id)
+            army = db.execute(RECRUIT_ELIGIBILITY_SQL, (user_id, guild_id)).fetchone()
 
             if not army:
                 return False, "No army found"
@@ -830,35 +2405,42 @@ def can_recruit_army(user_id, guild_id):
 
             # Check if new week has started
             if army['recruitment_cooldown']:
-                cooldown_time = dt.fromisoformat(army['recruitment_cooldown'])
+                cooldown_time = parse_db_timestamp(army['recruitment_cooldown'])
                 if utcnow() >= cooldown_time:
                     # Reset weekly recruitment
                     db.execute("""
                     UPDATE armies SET weekly_recruitment_used=0, recruitment_cooldown=NULL
                     WHERE user_id=? AND guild_id=?
                     """, (user_id, guild_id))
+                    invalidate_combatant(user_id, guild_id)
                     db.commit()
                     return True, "New week started - recruitment reset!"
 
             return True, "Ready to recruit"
     except Exception as e:
+        if in_unit_of_work():
+            raise
         print(f"Error checking enhanced recruitment: {e}")
         return False, "Error checking recruitment"
 
-def recruit_soldiers(user_id, guild_id):
+RECRUIT_ARMY_SQL = """
+SELECT current_recruits, max_recruits, weekly_recruitment_used, morale, supplies
+FROM armies WHERE user_id=? AND guild_id=?"""
+
+HOT_QUERIES["recruit_soldiers"] = RECRUIT_ARMY_SQL
+
+def recruit_soldiers(user_id, guild_id, seed=None):
     """Randomized recruitment system with supply costs"""
     try:
         with get_combat_db_connection() as db:
-            army = db.execute("""
-            SELECT current_recruits, max_recruits, weekly_recruitment_used, morale, supplies
-            FROM armies WHERE user_id=? AND guild_id=?
-            """, (user_id, guild_id)).fetchone()
+            accrue_army_supplies(db, user_id, guild_id)
+            army = db.execute(RECRUIT_ARMY_SQL, (user_id, guild_id)).fetchone()
 
             if not army:
                 return False, "No army found"
 
             # Generate random recruitment amount with morale modifier
-            base_recruit_amount = generate_random_recruits()
+            base_recruit_amount = generate_random_recruits(event_rng(new_rng_seed() if seed is None else seed))
             morale_modifier = army['morale'] / 100  # 0.3 to 1.0 range
             recruit_amount = int(base_recruit_amount * morale_modifier)
 
@@ -890,10 +2472,11 @@ def recruit_soldiers(user_id, guild_id):
             db.execute("""
             UPDATE armies
             SET current_recruits=?, weekly_recruitment_used=?, supplies=?,
-                recruitment_cooldown=?, morale=GREATEST(1, morale - 1)
+                recruitment_cooldown=?, morale=MAX(1, morale - 1)
             WHERE user_id=? AND guild_id=?
             """, (new_recruits, new_weekly_used, new_supplies,
                   (utcnow() + timedelta(days=7)).isoformat(), user_id, guild_id))
+            invalidate_combatant(user_id, guild_id)
             db.commit()
 
             return True, (
@@ -906,19 +2489,28 @@ def recruit_soldiers(user_id, guild_id):
                 f"**Weekly Quota Used:** {new_weekly_used}/700"
             )
     except Exception as e:
+        if in_unit_of_work():
+            raise
         print(f"Error in enhanced recruitment: {e}")
         return False, "Error recruiting soldiers"
 
-def train_soldiers(user_id, guild_id, train_amount):
+TRAIN_ARMY_SQL = """
+SELECT current_recruits, current_soldiers, max_soldiers, total_knights,
+       total_archers, total_cavalry, total_siege, morale, supplies,
+       army_type
+FROM armies WHERE user_id=? AND guild_id=?"""
+
+HOT_QUERIES["train_soldiers"] = TRAIN_ARMY_SQL
+
+def train_soldiers(user_id, guild_id, train_amount, seed=None):
     """Enhanced training system with multiple unit types and desertions"""
+    if seed is None:
+        seed = new_rng_seed()
+    rng = event_rng(seed)
     try:
         with get_combat_db_connection() as db:
-            army = db.execute("""
-            SELECT current_recruits, current_soldiers, max_soldiers, total_knights,
-                   total_archers, total_cavalry, total_siege, morale, supplies,
-                   army_type
-            FROM armies WHERE user_id=? AND guild_id=?
-            """, (user_id, guild_id)).fetchone()
+            accrue_army_supplies(db, user_id, guild_id)
+            army = db.execute(TRAIN_ARMY_SQL, (user_id, guild_id)).fetchone()
 
             if not army:
                 return False, "No army found"
@@ -947,16 +2539,13 @@ def train_soldiers(user_id, guild_id, train_amount):
 
             # Calculate desertions based on morale and supplies
             desertion_rate = calculate_desertion_rate(army['morale'], army['supplies'], train_amount)
-            soldiers_deserted = 0
-            for _ in range(train_amount):
-                if random.random() < desertion_rate:
-                    soldiers_deserted += 1
+            soldiers_deserted = desertion_sampler(train_amount, desertion_rate, rng)
 
             # Calculate knight chance (7% base + bonuses)
             knight_chance = calculate_knight_chance(train_amount, commander_level)
 
             # Calculate unit type distribution
-            unit_types = distribute_unit_types(train_amount - soldiers_deserted, army_type, knight_chance)
+            unit_types = distribute_unit_types(train_amount - soldiers_deserted, army_type, knight_chance, rng)
 
             # Calculate final trained soldiers
             soldiers_trained = max(0, train_amount - soldiers_deserted)
@@ -992,6 +2581,7 @@ def train_soldiers(user_id, guild_id, train_amount):
             WHERE user_id=? AND guild_id=?
             """, (new_recruits, new_soldiers, new_knights, new_archers,
                   new_cavalry, new_siege, new_supplies, new_morale, user_id, guild_id))
+            invalidate_combatant(user_id, guild_id)
 
             # Update combatant stats
             if combatant:
@@ -999,19 +2589,24 @@ def train_soldiers(user_id, guild_id, train_amount):
                     user_id, guild_id,
                     total_recruits_trained=combatant['total_recruits_trained'] + soldiers_trained
                 )
+                award_achievements(
+                    user_id, guild_id,
+                    {'current_soldiers': new_soldiers, 'total_knights': new_knights,
+                     'total_recruits_trained': combatant['total_recruits_trained'] + soldiers_trained},
+                    {'current_soldiers': current_soldiers, 'total_knights': army['total_knights'],
+                     'total_recruits_trained': combatant['total_recruits_trained']}
+                )
 
             # Record training history
-            db.execute("""
-            INSERT INTO training_history (user_id, guild_id, soldiers_trained,
-                                        soldiers_deserted, knights_gained, archers_gained,
-                                        cavalry_gained, siege_gained, training_type,
-                                        training_quality, success_rate, morale_change)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (user_id, guild_id, soldiers_trained, soldiers_deserted,
-                  unit_types['knights'], unit_types['archers'], unit_types['cavalry'],
-                  unit_types['siege'], "enhanced", "Normal",
-                  ((soldiers_trained)/train_amount)*100 if train_amount > 0 else 0,
-                  morale_change))
+            record_history("training_history",
+                           ("user_id", "guild_id", "soldiers_trained", "soldiers_deserted", "knights_gained",
+                            "archers_gained", "cavalry_gained", "siege_gained", "training_type",
+                            "training_quality", "success_rate", "morale_change", "rng_seed", "timestamp"),
+                           [(user_id, guild_id, soldiers_trained, soldiers_deserted,
+                             unit_types['knights'], unit_types['archers'], unit_types['cavalry'],
+                             unit_types['siege'], "enhanced", "Normal",
+                             ((soldiers_trained)/train_amount)*100 if train_amount > 0 else 0,
+                             morale_change, seed, sqlite_timestamp())])
 
             db.commit()
 
@@ -1051,170 +2646,197 @@ def train_soldiers(user_id, guild_id, train_amount):
             return True, message
 
     except Exception as e:
+        if in_unit_of_work():
+            raise
         print(f"Error in enhanced training: {e}")
         traceback.print_exc()
         return False, "Error during training!"
 
-def distribute_unit_types(total_recruits, army_type, knight_chance):
-    """Distribute recruits into different unit types based on army specialization"""
-    unit_types = {
-        'infantry': 0,
-        'knights': 0,
-        'archers': 0,
-        'cavalry': 0,
-        'siege': 0
-    }
+UNIT_TYPES = ('infantry', 'knights', 'archers', 'cavalry', 'siege')
 
+# Base share of each unit type before army specialization (knights use knight_chance)
+UNIT_BASE_DISTRIBUTION = {
+    'infantry': 0.7,
+    'knights': 0.02,
+    'archers': 0.15,
+    'cavalry': 0.10,
+    'siege': 0.03
+}
+
+# Knight chance is bucketed so every (army_type, bucket) pair has a prebuilt table
+KNIGHT_CHANCE_STEP = 0.005
+KNIGHT_CHANCE_BUCKETS = int(round(0.15 / KNIGHT_CHANCE_STEP))
+
+def knight_chance_bucket(knight_chance):
+    """Map a knight chance onto its allocation table bucket"""
+    return min(KNIGHT_CHANCE_BUCKETS, max(0, int(round(knight_chance / KNIGHT_CHANCE_STEP))))
+
+def build_unit_allocation_table():
+    """Precompute conditional unit-type probabilities for each army type and knight chance bucket"""
+    table = {}
+    for army_type, bonuses in ARMY_TYPES.items():
+        for bucket in range(KNIGHT_CHANCE_BUCKETS + 1):
+            weights = dict(UNIT_BASE_DISTRIBUTION, knights=bucket * KNIGHT_CHANCE_STEP)
+            for unit_type in weights:
+                weights[unit_type] *= bonuses.get(unit_type, 1.0)
+            total = sum(weights.values())
+
+            # Store P(type | not an earlier type) so a draw is a chain of binomials
+            conditional = []
+            left = 1.0
+            for unit_type in UNIT_TYPES[:-1]:
+                share = weights[unit_type] / total
+                conditional.append(min(1.0, share / left) if left > 0 else 0.0)
+                left -= share
+            table[(army_type, bucket)] = tuple(conditional)
+    return table
+
+UNIT_ALLOCATION_TABLE = build_unit_allocation_table()
+
+def distribute_unit_types(total_recruits, army_type, knight_chance, rng=random):
+    """Draw a multinomial split of recruits into unit types based on army specialization"""
+    unit_types = dict.fromkeys(UNIT_TYPES, 0)
     if total_recruits <= 0:
         return unit_types
 
-    # Get army type bonuses
-    bonuses = ARMY_TYPES.get(army_type, ARMY_TYPES['Balanced'])
-
-    # Calculate distribution probabilities based on army type
-    base_distribution = {
-        'infantry': 0.7,  # 70% infantry by default
-        'knights': 0.02,  # 2% knights base (will be adjusted)
-        'archers': 0.15,  # 15% archers
-        'cavalry': 0.10,  # 10% cavalry
-        'siege': 0.03     # 3% siege equipment
-    }
-
-    # Adjust knight chance
-    base_distribution['knights'] = knight_chance
-
-    # Adjust based on army type bonuses
-    for unit_type in base_distribution:
-        if unit_type in bonuses:
-            # Increase probability for specialized units
-            base_distribution[unit_type] *= bonuses[unit_type]
-
-    # Normalize probabilities
-    total_prob = sum(base_distribution.values())
-    for unit_type in base_distribution:
-        base_distribution[unit_type] /= total_prob
+    if army_type not in ARMY_TYPES:
+        army_type = 'Balanced'
+    conditional = UNIT_ALLOCATION_TABLE[(army_type, knight_chance_bucket(knight_chance))]
 
-    # Distribute recruits
     remaining = total_recruits
-    for unit_type, probability in base_distribution.items():
+    for unit_type, probability in zip(UNIT_TYPES, conditional):
+        drawn = binomial_sample(remaining, probability, rng)
+        unit_types[unit_type] = drawn
+        remaining -= drawn
         if remaining <= 0:
             break
 
-        # Calculate number for this unit type
-        count = int(remaining * probability)
-        if count < 0:
-            count = 0
+    # Whoever is left after the earlier draws is the last unit type
+    unit_types[UNIT_TYPES[-1]] += remaining
+    return unit_types
 
-        # Ensure we don't exceed remaining
-        count = min(count, remaining)
-        unit_types[unit_type] = count
-        remaining -= count
+# ---------- COMBAT SYSTEM ----------
+# Small integer ids for the static combat tables
+TERRAIN_IDS = {name: index for index, name in enumerate(TERRAIN_EFFECTS)}
+WEATHER_IDS = {name: index for index, name in enumerate(WEATHER_EFFECTS)}
+TACTIC_IDS = {name: index for index, name in enumerate(BATTLE_TACTICS)}
+DUEL_ACTION_IDS = {name: index for index, name in enumerate(DUEL_ACTIONS)}
+DEFAULT_TERRAIN_ID = TERRAIN_IDS["Open Plains"]
+DEFAULT_WEATHER_ID = WEATHER_IDS["Clear Skies"]
+DEFAULT_TACTIC_ID = TACTIC_IDS["Frontal Assault"]
+DEFAULT_DUEL_ACTION_ID = DUEL_ACTION_IDS["power_strike"]
+
+# Strides into the flattened tables below
+WEATHER_COUNT = len(WEATHER_IDS)
+TACTIC_COUNT = len(TACTIC_IDS)
+DUEL_ACTION_COUNT = len(DUEL_ACTION_IDS)
+
+# Unit bonus weights (knights, archers, cavalry) for each duel action terrain column
+DUEL_UNIT_WEIGHTS = {'infantry': (3, 0, 0), 'archery': (0, 2, 0), 'cavalry': (0, 0, 2.5)}
+
+def build_combat_tables():
+    """Flatten every static terrain/weather/tactic/action combination into id-indexed tables"""
+    terrains = list(TERRAIN_EFFECTS.values())
+    weathers = list(WEATHER_EFFECTS.values())
+    tactics = list(BATTLE_TACTICS.values())
+
+    # Per action: (attack stat, multiplier, knight/archer/cavalry weights, defense stat)
+    duel_actions = tuple(
+        (info['stat'], info['multiplier'], *DUEL_UNIT_WEIGHTS.get(info['terrain'], (3, 2, 0)),
+         'intelligence' if name == "magic_bolt" else 'vitality')
+        for name, info in DUEL_ACTIONS.items()
+    )
 
-    # Distribute any remaining recruits to infantry
-    if remaining > 0:
-        unit_types['infantry'] += remaining
+    # [(terrain * weathers + weather) * actions + action] -> terrain bonus * weather multiplier
+    duel_attack = tuple(
+        terrain.get(info['terrain'], 1.0) * (weather.get('morale', 1.0) * weather.get('archery', 1.0))
+        for terrain in terrains for weather in weathers for info in DUEL_ACTIONS.values()
+    )
 
-    return unit_types
+    # [((terrain * weathers + weather) * tactics + attacker) * tactics + defender] -> damage modifier,
+    # None where the defending tactic deals no damage
+    war_modifiers = tuple(
+        None if defender['damage'] == 0 else (
+            (terrain.get('infantry', 1.0) * 0.3 + terrain.get('cavalry', 1.0) * 0.3 +
+             terrain.get('archery', 1.0) * 0.2 + terrain.get('defense', 1.0) * 0.2) *
+            (weather.get('morale', 1.0) * weather.get('archery', 1.0)) *
+            attacker['damage'] * (1.0 / defender['damage'])
+        )
+        for terrain in terrains for weather in weathers for attacker in tactics for defender in tactics
+    )
 
-# ---------- COMBAT SYSTEM ----------
-def calculate_enhanced_damage(attacker, defender, action_type, terrain="Open Plains", weather="Clear Skies"):
+    war_surprise = tuple(terrain.get('ambush', 1.0) * 0.1 for terrain in terrains)
+
+    # [terrain * weathers + weather] -> 1 / (terrain defense * weather morale)
+    casualty_factor = tuple(
+        1.0 / (terrain.get('defense', 1.0) * weather.get('morale', 1.0))
+        for terrain in terrains for weather in weathers
+    )
+    return duel_actions, duel_attack, war_modifiers, war_surprise, casualty_factor
+
+(DUEL_ACTION_TABLE, DUEL_ATTACK_MULTIPLIERS, WAR_MODIFIERS,
+ WAR_SURPRISE_CHANCE, CASUALTY_FACTORS) = build_combat_tables()
+
+def calculate_enhanced_damage(attacker, defender, action_type, terrain="Open Plains", weather="Clear Skies", rng=random):
     """Calculate enhanced combat damage with terrain and weather effects"""
     try:
-        # Get terrain and weather effects
-        terrain_effects = TERRAIN_EFFECTS.get(terrain, TERRAIN_EFFECTS["Open Plains"])
-        weather_effects = WEATHER_EFFECTS.get(weather, WEATHER_EFFECTS["Clear Skies"])
-
-        # Include all unit types in combat calculations
-        knight_bonus = attacker.get('total_knights', 0) * 3  # Knights are elite
-        archer_bonus = attacker.get('total_archers', 0) * 2  # Archers provide ranged support
-        cavalry_bonus = attacker.get('total_cavalry', 0) * 2.5  # Cavalry are fast and powerful
-        siege_bonus = attacker.get('total_siege', 0) * 4  # Siege equipment is devastating
+        action_id = DUEL_ACTION_IDS.get(action_type, DEFAULT_DUEL_ACTION_ID)
+        terrain_id = TERRAIN_IDS.get(terrain, DEFAULT_TERRAIN_ID)
+        weather_id = WEATHER_IDS.get(weather, DEFAULT_WEATHER_ID)
+        stat, multiplier, knight_weight, archer_weight, cavalry_weight, defense_stat = DUEL_ACTION_TABLE[action_id]
 
         # Base damage calculation
-        base_damage = random.randint(15, 35)
-
-        # Action type modifiers
-        action_modifiers = {
-            "power_strike": {"stat": 'strength', "multiplier": 2.2, "terrain": 'infantry'},
-            "magic_bolt": {"stat": 'intelligence', "multiplier": 2.8, "terrain": 'archery'},
-            "quick_strike": {"stat": 'agility', "multiplier": 2.0, "terrain": 'cavalry'},
-            "cavalry_charge": {"stat": 'strength', "multiplier": 2.5, "terrain": 'cavalry'},
-            "archer_volley": {"stat": 'agility', "multiplier": 2.3, "terrain": 'archery'},
-            "shield_wall": {"stat": 'vitality', "multiplier": 1.5, "terrain": 'defense'},
-            "flanking_maneuver": {"stat": 'agility', "multiplier": 2.1, "terrain": 'cavalry'},
-        }
-
-        action_info = action_modifiers.get(action_type, action_modifiers["power_strike"])
+        base_damage = rng.randint(15, 35)
 
         # Calculate stat bonus with unit contributions
-        if action_info['terrain'] == 'infantry':
-            unit_bonus = knight_bonus
-        elif action_info['terrain'] == 'archery':
-            unit_bonus = archer_bonus
-        elif action_info['terrain'] == 'cavalry':
-            unit_bonus = cavalry_bonus
-        else:
-            unit_bonus = knight_bonus + archer_bonus
+        knights = attacker.get('total_knights', 0)
+        unit_bonus = (knights * knight_weight + attacker.get('total_archers', 0) * archer_weight +
+                      attacker.get('total_cavalry', 0) * cavalry_weight)
+        stat_bonus = (attacker[stat] + unit_bonus) * multiplier
 
-        stat_bonus = (attacker[action_info['stat']] + unit_bonus) * action_info['multiplier']
+        # Apply terrain bonus and weather effects
+        stat_bonus *= DUEL_ATTACK_MULTIPLIERS[(terrain_id * WEATHER_COUNT + weather_id) * DUEL_ACTION_COUNT + action_id]
 
         # Calculate defense
-        defense_stat = 'vitality' if action_type != "magic_bolt" else 'intelligence'
         defense_bonus = defender[defense_stat] * 1.8
 
-        # Apply terrain bonus to attack/defense
-        terrain_bonus = terrain_effects.get(action_info['terrain'], 1.0)
-        stat_bonus *= terrain_bonus
-
-        # Apply weather effects
-        weather_multiplier = weather_effects.get('morale', 1.0) * weather_effects.get('archery', 1.0)
-        stat_bonus *= weather_multiplier
-
         # Calculate final damage
-        damage = max(5, int((base_damage + stat_bonus - defense_bonus) * random.uniform(0.7, 1.3)))
+        damage = max(5, int((base_damage + stat_bonus - defense_bonus) * rng.uniform(0.7, 1.3)))
 
         # Critical hit chance (based on luck + agility + knights)
-        total_crit_chance = (attacker['agility'] + attacker['luck'] + (attacker.get('total_knights', 0) // 10)) * 0.005
-        if random.random() < total_crit_chance:
-            damage = int(damage * random.uniform(1.5, 2.5))
+        total_crit_chance = (attacker['agility'] + attacker['luck'] + (knights // 10)) * 0.005
+        if rng.random() < total_crit_chance:
+            damage = int(damage * rng.uniform(1.5, 2.5))
             return damage, True  # Return damage and critical flag
 
         return damage, False
 
     except Exception as e:
         print(f"Error calculating enhanced damage: {e}")
-        return random.randint(10, 25), False
+        return rng.randint(10, 25), False
 
-def calculate_war_damage(attacker_power, defender_power, terrain, weather, attacker_tactic, defender_tactic):
+def calculate_war_damage(attacker_power, defender_power, terrain, weather, attacker_tactic, defender_tactic, rng=random):
     """Calculate war damage with all modifiers"""
     try:
         # Base damage
-        base_damage = (attacker_power * 0.1) + random.randint(-50, 50)
-
-        # Get modifiers
-        terrain_mod = TERRAIN_EFFECTS.get(terrain, TERRAIN_EFFECTS["Open Plains"])
-        weather_mod = WEATHER_EFFECTS.get(weather, WEATHER_EFFECTS["Clear Skies"])
-        attacker_tactic_mod = BATTLE_TACTICS.get(attacker_tactic, BATTLE_TACTICS["Frontal Assault"])
-        defender_tactic_mod = BATTLE_TACTICS.get(defender_tactic, BATTLE_TACTICS["Frontal Assault"])
-
-        # Calculate total modifier
-        total_modifier = (
-            (terrain_mod.get('infantry', 1.0) * 0.3 + terrain_mod.get('cavalry', 1.0) * 0.3 +
-             terrain_mod.get('archery', 1.0) * 0.2 + terrain_mod.get('defense', 1.0) * 0.2) *
-            (weather_mod.get('morale', 1.0) * weather_mod.get('archery', 1.0)) *
-            attacker_tactic_mod['damage'] *
-            (1.0 / defender_tactic_mod['damage'])
-        )
-
-        damage = int(base_damage * total_modifier)
+        base_damage = (attacker_power * 0.1) + rng.randint(-50, 50)
+
+        terrain_id = TERRAIN_IDS.get(terrain, DEFAULT_TERRAIN_ID)
+        total_modifier = WAR_MODIFIERS[
+            ((terrain_id * WEATHER_COUNT + WEATHER_IDS.get(weather, DEFAULT_WEATHER_ID)) * TACTIC_COUNT +
+             TACTIC_IDS.get(attacker_tactic, DEFAULT_TACTIC_ID)) * TACTIC_COUNT +
+            TACTIC_IDS.get(defender_tactic, DEFAULT_TACTIC_ID)
+        ]
+        if total_modifier is None:
+            # Defender deals no damage (Full Retreat): flat 5% of attacker power
+            return int(attacker_power * 0.05), False, "normal"
 
         # Ensure minimum damage
-        damage = max(10, damage)
+        damage = max(10, int(base_damage * total_modifier))
 
         # Chance for critical/surprise based on terrain
-        surprise_chance = terrain_mod.get('ambush', 1.0) * 0.1
-        if random.random() < surprise_chance:
-            damage = int(damage * random.uniform(1.3, 1.8))
+        if rng.random() < WAR_SURPRISE_CHANCE[terrain_id]:
+            damage = int(damage * rng.uniform(1.3, 1.8))
             return damage, True, "surprise"
 
         return damage, False, "normal"
@@ -1226,26 +2848,40 @@ def calculate_war_damage(attacker_power, defender_power, terrain, weather, attac
 def calculate_casualties(army_power, damage_received, terrain, weather):
     """Calculate casualties from battle"""
     try:
-        # Base casualty rate
-        casualty_rate = damage_received / (army_power + 1000)  # Relative to army power
-
-        # Apply terrain and weather modifiers
-        terrain_mod = TERRAIN_EFFECTS.get(terrain, TERRAIN_EFFECTS["Open Plains"])
-        weather_mod = WEATHER_EFFECTS.get(weather, WEATHER_EFFECTS["Clear Skies"])
-
-        defense_modifier = terrain_mod.get('defense', 1.0) * weather_mod.get('morale', 1.0)
-        casualty_rate *= (1.0 / defense_modifier)
+        # Base casualty rate, relative to army power, scaled by terrain defense and weather morale
+        casualty_rate = damage_received / (army_power + 1000) * CASUALTY_FACTORS[
+            TERRAIN_IDS.get(terrain, DEFAULT_TERRAIN_ID) * WEATHER_COUNT + WEATHER_IDS.get(weather, DEFAULT_WEATHER_ID)
+        ]
 
         # Cap casualty rate
-        casualty_rate = min(0.5, max(0.05, casualty_rate))
-
-        return casualty_rate
+        return min(0.5, max(0.05, casualty_rate))
 
     except Exception as e:
         print(f"Error calculating casualties: {e}")
         return 0.1
 
 # ---------- REGISTRATION SYSTEM ----------
+def register_combatant(user_id, guild_id, character_name, army_name, faction, title):
+    """Create a combatant and their starting army"""
+    with get_combat_db_connection() as db:
+        # Create combatant with enhanced stats
+        db.execute("""
+        INSERT INTO combatants (user_id, guild_id, character_name, army_name,
+        faction, title, level, experience, experience_needed, stat_points,
+        strength, agility, intelligence, vitality, charisma, luck, wins, losses)
+        VALUES (?, ?, ?, ?, ?, ?, 1, 0, 100, 5, 5, 5, 5, 5, 5, 5, 0, 0)
+        """, (user_id, guild_id, character_name, army_name,
+             faction or "Independent", title))
+
+        # Create enhanced army
+        db.execute("""
+        INSERT INTO armies (user_id, guild_id, army_type, current_soldiers, current_recruits,
+        max_soldiers, max_recruits, tactical_points, morale, supplies)
+        VALUES (?, ?, 'Balanced', 0, 0, 500, 1000, 5, 100, 100)
+        """, (user_id, guild_id))
+
+        db.commit()
+
 class EnhancedRegistrationView(discord.ui.View):
     def __init__(self, user_id, guild_id):
         super().__init__(timeout=300.0)
@@ -1283,24 +2919,8 @@ class EnhancedRegistrationView(discord.ui.View):
 
         # Create character and army
         try:
-            with get_combat_db_connection() as db:
-                # Create combatant with enhanced stats
-                db.execute("""
-                INSERT INTO combatants (user_id, guild_id, character_name, army_name,
-                faction, title, level, experience, experience_needed, stat_points,
-                strength, agility, intelligence, vitality, charisma, luck, wins, losses)
-                VALUES (?, ?, ?, ?, ?, ?, 1, 0, 100, 5, 5, 5, 5, 5, 5, 5, 0, 0)
-                """, (self.user_id, self.guild_id, self.character_name, self.army_name,
-                     self.faction or "Independent", self.title))
-
-                # Create enhanced army
-                db.execute("""
-                INSERT INTO armies (user_id, guild_id, army_type, current_soldiers, current_recruits,
-                max_soldiers, max_recruits, tactical_points, morale, supplies)
-                VALUES (?, ?, 'Balanced', 0, 0, 500, 1000, 5, 100, 100)
-                """, (self.user_id, self.guild_id))
-
-                db.commit()
+            await run_db(register_combatant, self.user_id, self.guild_id, self.character_name,
+                         self.army_name, self.faction, self.title)
 
             embed = medieval_embed(
                 title="🎖️ Registration Complete!",
@@ -1468,7 +3088,7 @@ async def enhanced_register_cmd(ctx):
     """Enhanced registration with more customization"""
     try:
         # Check if already registered
-        combatant = get_enhanced_combatant(ctx.author.id, ctx.guild.id)
+        combatant = await run_db(get_enhanced_combatant, ctx.author.id, ctx.guild.id)
         if combatant:
             embed = medieval_embed(
                 title="⚔️ Already Registered",
@@ -1512,7 +3132,7 @@ async def enhanced_stats_cmd(ctx, member: discord.Member = None):
     """View enhanced combatant statistics"""
     try:
         member = member or ctx.author
-        combatant = get_enhanced_combatant(member.id, ctx.guild.id)
+        combatant = await run_db(get_enhanced_combatant, member.id, ctx.guild.id)
 
         if not combatant:
             return await ctx.send(embed=medieval_response(
@@ -1593,7 +3213,7 @@ async def enhanced_stats_cmd(ctx, member: discord.Member = None):
 async def enhanced_recruit_cmd(ctx):
     """Enhanced recruitment with supply costs"""
     try:
-        combatant = get_enhanced_combatant(ctx.author.id, ctx.guild.id)
+        combatant = await run_db(get_enhanced_combatant, ctx.author.id, ctx.guild.id)
         if not combatant:
             return await ctx.send(embed=medieval_response(
                 "Thou must first register as a combatant!",
@@ -1601,19 +3221,19 @@ async def enhanced_recruit_cmd(ctx):
             ))
 
         # Check daily actions
-        can_action, action_msg = can_perform_daily_action(ctx.author.id, ctx.guild.id)
+        can_action, action_msg = await run_db(can_perform_daily_action, ctx.author.id, ctx.guild.id)
         if not can_action:
             return await ctx.send(embed=medieval_response(action_msg, success=False))
 
         # Check recruitment eligibility
-        can_recruit, message = can_recruit_army(ctx.author.id, ctx.guild.id)
+        can_recruit, message = await run_db(can_recruit_army, ctx.author.id, ctx.guild.id)
         if not can_recruit:
             return await ctx.send(embed=medieval_response(message, success=False))
 
         # Attempt enhanced recruitment
-        success, message = recruit_soldiers(ctx.author.id, ctx.guild.id)
+        success, message = await run_db(recruit_soldiers, ctx.author.id, ctx.guild.id)
         if success:
-            use_daily_action(ctx.author.id, ctx.guild.id, "recruit")
+            await run_db(use_daily_action, ctx.author.id, ctx.guild.id, "recruit")
             embed = medieval_embed(
                 title="✅ Recruitment Successful",
                 description=message,
@@ -1636,7 +3256,7 @@ async def enhanced_recruit_cmd(ctx):
 async def enhanced_train_cmd(ctx, amount: int):
     """Enhanced training system with multiple unit types"""
     try:
-        combatant = get_enhanced_combatant(ctx.author.id, ctx.guild.id)
+        combatant = await run_db(get_enhanced_combatant, ctx.author.id, ctx.guild.id)
         if not combatant:
             return await ctx.send(embed=medieval_response(
                 "Thou must first register as a combatant!",
@@ -1644,7 +3264,7 @@ async def enhanced_train_cmd(ctx, amount: int):
             ))
 
         # Check daily actions
-        can_action, action_msg = can_perform_daily_action(ctx.author.id, ctx.guild.id)
+        can_action, action_msg = await run_db(can_perform_daily_action, ctx.author.id, ctx.guild.id)
         if not can_action:
             return await ctx.send(embed=medieval_response(action_msg, success=False))
 
@@ -1656,9 +3276,9 @@ async def enhanced_train_cmd(ctx, amount: int):
             ))
 
         # Attempt enhanced training
-        success, message = train_soldiers(ctx.author.id, ctx.guild.id, amount)
+        success, message = await run_db(train_soldiers, ctx.author.id, ctx.guild.id, amount)
         if success:
-            use_daily_action(ctx.author.id, ctx.guild.id, "train")
+            await run_db(use_daily_action, ctx.author.id, ctx.guild.id, "train")
             embed = medieval_embed(
                 title="⚔️ Training Complete",
                 description=message,
@@ -1677,6 +3297,219 @@ async def enhanced_train_cmd(ctx, amount: int):
         await ctx.send(embed=medieval_response(f"Error in training: {str(e)}", success=False))
 
 # ---------- DUEL SYSTEM ----------
+# Everything calculate_enhanced_damage reads from a combatant
+DUEL_SNAPSHOT_FIELDS = ('strength', 'agility', 'intelligence', 'vitality', 'charisma', 'luck',
+                        'total_knights', 'total_archers', 'total_cavalry')
+
+def snapshot_duel_combatants(challenger, defender):
+    """JSON of both sides' damage stats, frozen when the duel is accepted"""
+    return json.dumps({side: {field: combatant.get(field, 0) for field in DUEL_SNAPSHOT_FIELDS}
+                       for side, combatant in (('challenger', challenger), ('defender', defender))})
+
+def duel_fighters(duel, challenger=None, defender=None):
+    """(challenger, defender) stats a duel is fought with: its snapshot, or the live rows for older duels"""
+    if duel.get('combatant_snapshot'):
+        snapshot = json.loads(duel['combatant_snapshot'])
+        return snapshot['challenger'], snapshot['defender']
+    return challenger, defender
+
+def create_duel(guild_id, challenger_id, defender_id, wager, terrain, weather, channel_id=None):
+    """Record an accepted duel, with the seed and stats its turns will be resolved from"""
+    snapshot = snapshot_duel_combatants(get_enhanced_combatant(challenger_id, guild_id) or {},
+                                        get_enhanced_combatant(defender_id, guild_id) or {})
+    with get_combat_db_connection() as db:
+        now = utcnow()
+        duel_id = db.execute("""
+        INSERT INTO active_duels (guild_id, challenger_id, defender_id,
+                                current_turn_user, duel_type, wager, terrain, weather, rng_seed,
+                                combatant_snapshot, last_action, round_timeout, turn_expires_at, channel_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (guild_id, challenger_id, defender_id,
+              challenger_id, "Enhanced Duel", wager, terrain, weather, new_rng_seed(),
+              snapshot, now.isoformat(), DUEL_TURN_TIMEOUT,
+              (now + timedelta(seconds=DUEL_TURN_TIMEOUT)).isoformat(), channel_id)).lastrowid
+        db.commit()
+    turn_timeouts.schedule('duel', duel_id, now.timestamp() + DUEL_TURN_TIMEOUT)
+
+DUEL_BETWEEN_SQL = """
+SELECT * FROM active_duels
+WHERE guild_id=? AND (
+    (challenger_id=? AND defender_id=?) OR
+    (challenger_id=? AND defender_id=?)
+) AND status='active'"""
+
+ACTIVE_DUEL_SQL = """
+SELECT * FROM active_duels
+WHERE guild_id=? AND (
+    challenger_id=? OR defender_id=?
+) AND status='active'"""
+
+HOT_QUERIES["get_duel_between"] = DUEL_BETWEEN_SQL
+HOT_QUERIES["get_active_duel"] = ACTIVE_DUEL_SQL
+
+def get_duel_between(guild_id, first_id, second_id):
+    """Get the active duel between two combatants, if any"""
+    with get_combat_db_connection() as db:
+        duel = db.execute(DUEL_BETWEEN_SQL, (guild_id, first_id, second_id, second_id, first_id)).fetchone()
+        return dict(duel) if duel else None
+
+def get_active_duel(guild_id, user_id):
+    """Get the active duel a combatant is taking part in"""
+    with get_combat_db_connection() as db:
+        duel = db.execute(ACTIVE_DUEL_SQL, (guild_id, user_id, user_id)).fetchone()
+        return dict(duel) if duel else None
+
+def replay_duel(duel, turns):
+    """Recompute a duel's damage from its seed, stats snapshot and logged actions, without the database.
+
+    `turns` are duel_turns rows; returns [(turn, damage, critical)] in the order given.
+    """
+    challenger, defender = duel_fighters(duel)
+    terrain = duel.get('terrain') or 'Open Plains'
+    weather = duel.get('weather') or 'Clear Skies'
+    replayed = []
+    for entry in turns:
+        attacker, target = (challenger, defender) if entry['user_id'] == duel['challenger_id'] else (defender, challenger)
+        damage, critical = calculate_enhanced_damage(
+            attacker, target, entry['action'], terrain, weather, event_rng(duel['rng_seed'], entry['turn'])
+        )
+        replayed.append((entry['turn'], damage, critical))
+    return replayed
+
+def replay_recorded_duel(duel_id):
+    """Replay a stored duel; returns (logged, replayed) [(turn, damage, critical)], or None if it can't be.
+
+    Duels created before stats snapshots were stored have nothing to replay from.
+    """
+    with get_combat_db_connection() as db:
+        duel = db.execute("SELECT * FROM active_duels WHERE id=?", (duel_id,)).fetchone()
+        if not duel or not duel['combatant_snapshot'] or duel['rng_seed'] is None:
+            return None
+        turns = [dict(row) for row in db.execute(HOT_QUERIES["duel_turns"], (duel_id,))]
+    logged = [(turn['turn'], turn['damage'], bool(turn['critical'])) for turn in turns]
+    return logged, replay_duel(dict(duel), turns)
+
+class TurnAlreadyResolved(Exception):
+    """The duel or war moved on (another turn, a forfeit) after the command read it"""
+
+def resolve_duel_turn(duel, user_id, guild_id, action):
+    """Apply one duel action and settle the duel if a combatant falls.
+
+    The HP update, action log and every duel-end mutation (status, wins/losses,
+    XP and its history, achievements, wager) commit together or not at all.
+    """
+    with combat_unit_of_work() as db:
+        return _resolve_duel_turn(db, duel, user_id, guild_id, action)
+
+# One per side on the clock; the WHERE clause rejects a turn that was already taken
+CHALLENGER_STRIKE_SQL = """
+UPDATE active_duels
+SET defender_hp=?, current_turn_user=?, turn=turn+1,
+    last_action=?, turn_expires_at=?
+WHERE id=? AND status='active' AND turn=? AND current_turn_user=?"""
+
+DEFENDER_STRIKE_SQL = """
+UPDATE active_duels
+SET challenger_hp=?, current_turn_user=?, turn=turn+1,
+    last_action=?, turn_expires_at=?
+WHERE id=? AND status='active' AND turn=? AND current_turn_user=?"""
+
+HOT_QUERIES["challenger_strike"] = CHALLENGER_STRIKE_SQL
+HOT_QUERIES["defender_strike"] = DEFENDER_STRIKE_SQL
+
+def _resolve_duel_turn(db, duel, user_id, guild_id, action):
+    challenger = get_enhanced_combatant(duel['challenger_id'], guild_id)
+    defender = get_enhanced_combatant(duel['defender_id'], guild_id)
+
+    is_challenger = user_id == duel['challenger_id']
+    fighting_challenger, fighting_defender = duel_fighters(duel, challenger, defender)
+    attacker = fighting_challenger if is_challenger else fighting_defender
+    target = fighting_defender if is_challenger else fighting_challenger
+
+    # Calculate damage from this turn's own generator and the duel's stats snapshot so it can be replayed
+    damage, critical = calculate_enhanced_damage(
+        attacker, target, action,
+        duel.get('terrain') or 'Open Plains',
+        duel.get('weather') or 'Clear Skies',
+        event_rng(duel['rng_seed'], duel['turn'])
+    )
+
+    new_challenger_hp = duel['challenger_hp']
+    new_defender_hp = duel['defender_hp']
+
+    # Update HP and restart the turn clock for the other side
+    now = utcnow()
+    expires_at = (now + timedelta(seconds=duel.get('round_timeout') or DUEL_TURN_TIMEOUT)).isoformat()
+    if is_challenger:
+        new_defender_hp = max(0, duel['defender_hp'] - damage)
+        updated = db.execute(CHALLENGER_STRIKE_SQL, (new_defender_hp, duel['defender_id'], now.isoformat(), expires_at,
+              duel['id'], duel['turn'], user_id))
+    else:
+        new_challenger_hp = max(0, duel['challenger_hp'] - damage)
+        updated = db.execute(DEFENDER_STRIKE_SQL, (new_challenger_hp, duel['challenger_id'], now.isoformat(), expires_at,
+              duel['id'], duel['turn'], user_id))
+    # The command read `duel` in an earlier call; only the turn it saw may be applied
+    if updated.rowcount == 0:
+        raise TurnAlreadyResolved(duel['id'])
+
+    # Record action
+    db.execute("""
+    INSERT INTO duel_turns (duel_id, turn, user_id, action, damage, critical)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, (duel['id'], duel['turn'], user_id, action, damage, critical))
+
+    # Check for winner
+    winner = None
+    if new_defender_hp <= 0:
+        winner = duel['challenger_id']
+    elif new_challenger_hp <= 0:
+        winner = duel['defender_id']
+
+    if winner:
+        # End duel
+        db.execute("""
+        UPDATE active_duels
+        SET status='ended', last_action=?
+        WHERE id=?
+        """, (utcnow().isoformat(), duel['id']))
+
+        # Update combatant stats
+        winner_data = challenger if winner == duel['challenger_id'] else defender
+        loser_data = defender if winner == duel['challenger_id'] else challenger
+
+        update_combatant_stats(winner, guild_id, wins=winner_data['wins'] + 1)
+        update_combatant_stats(
+            loser_data['user_id'], guild_id,
+            losses=loser_data['losses'] + 1
+        )
+
+        # Handle wager (before achievements and XP, so their rewards build on the settled prestige)
+        if duel['wager'] > 0:
+            update_combatant_stats(winner, guild_id, prestige=winner_data['prestige'] + duel['wager'])
+            update_combatant_stats(
+                loser_data['user_id'], guild_id,
+                prestige=max(0, loser_data['prestige'] - duel['wager'])
+            )
+
+        award_achievements(winner, guild_id, {'wins': winner_data['wins'] + 1}, {'wins': winner_data['wins']})
+
+        # Award XP
+        add_experience_bulk(guild_id, [
+            (winner, 50, "duel_win"),
+            (loser_data['user_id'], 15, "duel_loss")
+        ])
+        turn_timeouts.cancel('duel', duel['id'])
+    else:
+        turn_timeouts.schedule('duel', duel['id'], parse_db_timestamp(expires_at).timestamp())
+
+    return {
+        'damage': damage,
+        'critical': critical,
+        'challenger_hp': new_challenger_hp,
+        'defender_hp': new_defender_hp,
+        'winner': winner
+    }
+
 class DuelChallengeView(discord.ui.View):
     def __init__(self, challenger_id, defender_id, terrain, weather, wager):
         super().__init__(timeout=300.0)
@@ -1696,19 +3529,14 @@ class DuelChallengeView(discord.ui.View):
 
         # Start the duel
         try:
-            with get_combat_db_connection() as db:
-                db.execute("""
-                INSERT INTO active_duels (guild_id, challenger_id, defender_id,
-                                        current_turn_user, duel_type, wager, terrain, weather)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (interaction.guild.id, self.challenger_id, self.defender_id,
-                      self.challenger_id, "Enhanced Duel", self.wager, self.terrain, self.weather))
-                db.commit()
+            await run_db(create_duel, interaction.guild.id, self.challenger_id, self.defender_id,
+                         self.wager, self.terrain, self.weather, interaction.channel_id)
 
             await interaction.response.send_message(
                 embed=medieval_embed(
                     title="⚔️ Duel Accepted!",
-                    description="The duel begins! Use `/turn` to take your action.",
+                    description=f"The duel begins! Use `/turn` to take your action. Each side has "
+                                f"{describe_turn_clock(DUEL_TURN_TIMEOUT)} per turn or forfeits the duel.",
                     color_name="green"
                 )
             )
@@ -1747,8 +3575,8 @@ async def enhanced_duel_cmd(ctx, opponent: discord.Member = None, wager: int = 0
             ))
 
         # Check if both are registered
-        challenger = get_enhanced_combatant(ctx.author.id, ctx.guild.id)
-        defender = get_enhanced_combatant(opponent.id, ctx.guild.id)
+        challenger = await run_db(get_enhanced_combatant, ctx.author.id, ctx.guild.id)
+        defender = await run_db(get_enhanced_combatant, opponent.id, ctx.guild.id)
 
         if not challenger:
             return await ctx.send(embed=medieval_response(
@@ -1763,20 +3591,12 @@ async def enhanced_duel_cmd(ctx, opponent: discord.Member = None, wager: int = 0
             ))
 
         # Check for existing duel
-        with get_combat_db_connection() as db:
-            existing_duel = db.execute("""
-            SELECT * FROM active_duels
-            WHERE guild_id=? AND (
-                (challenger_id=? AND defender_id=?) OR
-                (challenger_id=? AND defender_id=?)
-            ) AND status='active'
-            """, (ctx.guild.id, ctx.author.id, opponent.id, opponent.id, ctx.author.id)).fetchone()
-
-            if existing_duel:
-                return await ctx.send(embed=medieval_response(
-                    f"A duel between {ctx.author.display_name} and {opponent.display_name} is already in progress!",
-                    success=False
-                ))
+        existing_duel = await run_db(get_duel_between, ctx.guild.id, ctx.author.id, opponent.id)
+        if existing_duel:
+            return await ctx.send(embed=medieval_response(
+                f"A duel between {ctx.author.display_name} and {opponent.display_name} is already in progress!",
+                success=False
+            ))
 
         # Generate terrain and weather
         terrain = get_random_terrain()
@@ -1792,6 +3612,7 @@ async def enhanced_duel_cmd(ctx, opponent: discord.Member = None, wager: int = 0
         embed.add_field(name="🏞️ Terrain", value=terrain, inline=True)
         embed.add_field(name="🌤️ Weather", value=weather, inline=True)
         embed.add_field(name="🎯 Wager", value=f"{wager} prestige" if wager > 0 else "None", inline=True)
+        embed.add_field(name="⌛ Turn Clock", value=f"{describe_turn_clock(DUEL_TURN_TIMEOUT)} per turn", inline=True)
 
         embed.add_field(
             name="Terrain Effects",
@@ -1817,171 +3638,280 @@ async def enhanced_turn_cmd(ctx, action: str = None):
     """Take your turn in an enhanced duel"""
     try:
         # Get active duel
-        with get_combat_db_connection() as db:
-            duel = db.execute("""
-            SELECT * FROM active_duels
-            WHERE guild_id=? AND (
-                challenger_id=? OR defender_id=?
-            ) AND status='active'
-            """, (ctx.guild.id, ctx.author.id, ctx.author.id)).fetchone()
-
-            if not duel:
-                return await ctx.send(embed=medieval_response(
-                    "Thou hast no active duels!",
-                    success=False
-                ))
-
-            if duel['current_turn_user'] != ctx.author.id:
-                opponent = duel['defender_id'] if duel['challenger_id'] == ctx.author.id else duel['challenger_id']
-                opponent_name = ctx.guild.get_member(opponent)
-                return await ctx.send(embed=medieval_response(
-                    f"It is {opponent_name.display_name if opponent_name else 'your opponent'}'s turn!",
-                    success=False
-                ))
-
-            if not action:
-                # Show available actions
-                embed = medieval_embed(
-                    title="⚔️ Your Turn - Choose Action",
-                    description="Available actions:",
-                    color_name="gold"
-                )
+        duel = await run_db(get_active_duel, ctx.guild.id, ctx.author.id)
+
+        if not duel:
+            return await ctx.send(embed=medieval_response(
+                "Thou hast no active duels!",
+                success=False
+            ))
+
+        if duel['current_turn_user'] != ctx.author.id:
+            opponent = duel['defender_id'] if duel['challenger_id'] == ctx.author.id else duel['challenger_id']
+            opponent_name = ctx.guild.get_member(opponent)
+            return await ctx.send(embed=medieval_response(
+                f"It is {opponent_name.display_name if opponent_name else 'your opponent'}'s turn!",
+                success=False
+            ))
 
-                actions = [
-                    ("power_strike", "Heavy melee attack (Strength-based)"),
-                    ("quick_strike", "Fast attack (Agility-based)"),
-                    ("magic_bolt", "Magical attack (Intelligence-based)"),
-                    ("cavalry_charge", "Cavalry charge (Strength-based)"),
-                    ("archer_volley", "Ranged attack (Agility-based)"),
-                    ("shield_wall", "Defensive stance (Vitality-based)"),
-                    ("flanking_maneuver", "Tactical attack (Agility-based)")
-                ]
-
-                for action_name, description in actions:
-                    embed.add_field(name=action_name.replace("_", " ").title(), value=description, inline=False)
-
-                return await ctx.send(embed=embed)
-
-            # Process action
-            challenger = get_enhanced_combatant(duel['challenger_id'], ctx.guild.id)
-            defender = get_enhanced_combatant(duel['defender_id'], ctx.guild.id)
-
-            is_challenger = ctx.author.id == duel['challenger_id']
-            attacker = challenger if is_challenger else defender
-            target = defender if is_challenger else challenger
-
-            # Calculate damage
-            damage, critical = calculate_enhanced_damage(
-                attacker, target, action,
-                duel.get('terrain', 'Open Plains'),
-                duel.get('weather', 'Clear Skies')
+        if not action:
+            # Show available actions
+            embed = medieval_embed(
+                title="⚔️ Your Turn - Choose Action",
+                description="Available actions:",
+                color_name="gold"
             )
 
-            # Update HP
-            if is_challenger:
-                new_defender_hp = max(0, duel['defender_hp'] - damage)
-                db.execute("""
-                UPDATE active_duels
-                SET defender_hp=?, current_turn_user=?, turn=turn+1,
-                    last_action=?
-                WHERE id=?
-                """, (new_defender_hp, duel['defender_id'], utcnow().isoformat(), duel['id']))
-            else:
-                new_challenger_hp = max(0, duel['challenger_hp'] - damage)
-                db.execute("""
-                UPDATE active_duels
-                SET challenger_hp=?, current_turn_user=?, turn=turn+1,
-                    last_action=?
-                WHERE id=?
-                """, (new_challenger_hp, duel['challenger_id'], utcnow().isoformat(), duel['id']))
+            actions = [
+                ("power_strike", "Heavy melee attack (Strength-based)"),
+                ("quick_strike", "Fast attack (Agility-based)"),
+                ("magic_bolt", "Magical attack (Intelligence-based)"),
+                ("cavalry_charge", "Cavalry charge (Strength-based)"),
+                ("archer_volley", "Ranged attack (Agility-based)"),
+                ("shield_wall", "Defensive stance (Vitality-based)"),
+                ("flanking_maneuver", "Tactical attack (Agility-based)")
+            ]
 
-            # Record action
-            actions_field = 'challenger_actions' if is_challenger else 'defender_actions'
-            current_actions = eval(duel[actions_field])
-            current_actions.append({
-                'turn': duel['turn'],
-                'action': action,
-                'damage': damage,
-                'critical': critical
-            })
-
-            db.execute(f"""
-            UPDATE active_duels
-            SET {actions_field}=?
-            WHERE id=?
-            """, (str(current_actions), duel['id']))
+            for action_name, description in actions:
+                embed.add_field(name=action_name.replace("_", " ").title(), value=description, inline=False)
 
-            db.commit()
+            return await ctx.send(embed=embed)
 
-            # Check for winner
-            winner = None
-            if new_defender_hp <= 0:
-                winner = duel['challenger_id']
-            elif new_challenger_hp <= 0:
-                winner = duel['defender_id']
+        # Process action
+        is_challenger = ctx.author.id == duel['challenger_id']
+        result = await run_db(resolve_duel_turn, duel, ctx.author.id, ctx.guild.id, action)
+        damage = result['damage']
+        critical = result['critical']
+        winner = result['winner']
+
+        if winner:
+            winner_member = ctx.guild.get_member(winner)
+            await ctx.send(embed=medieval_embed(
+                title="🏆 Duel Victory!",
+                description=f"**{winner_member.display_name if winner_member else 'The victor'}** wins the duel!",
+                color_name="green"
+            ))
+        else:
+            # Send turn result
+            opponent_id = duel['defender_id'] if is_challenger else duel['challenger_id']
+            opponent_member = ctx.guild.get_member(opponent_id)
 
-            if winner:
-                # End duel
-                db.execute("""
-                UPDATE active_duels
-                SET status='ended', last_action=?
-                WHERE id=?
-                """, (utcnow().isoformat(), duel['id']))
+            embed = medieval_embed(
+                title="⚔️ Action Executed!",
+                description=f"**{ctx.author.display_name}** used **{action.replace('_', ' ').title()}**!",
+                color_name="blue"
+            )
 
-                # Update combatant stats
-                winner_data = challenger if winner == duel['challenger_id'] else defender
-                loser_data = defender if winner == duel['challenger_id'] else challenger
+            embed.add_field(name="Damage", value=f"{damage} HP", inline=True)
+            if critical:
+                embed.add_field(name="Critical Hit!", value="⭐", inline=True)
+            embed.add_field(name="Next Turn", value=opponent_member.display_name if opponent_member else "Opponent", inline=True)
+            embed.add_field(name="⌛ Turn Clock",
+                            value=f"{describe_turn_clock(duel.get('round_timeout') or DUEL_TURN_TIMEOUT)} to act",
+                            inline=True)
+            embed.add_field(name="Challenger HP", value=result['challenger_hp'], inline=True)
+            embed.add_field(name="Defender HP", value=result['defender_hp'], inline=True)
 
-                update_combatant_stats(winner, ctx.guild.id, wins=winner_data['wins'] + 1)
-                update_combatant_stats(
-                    loser_data['user_id'], ctx.guild.id,
-                    losses=loser_data['losses'] + 1
-                )
+            await ctx.send(embed=embed)
 
-                # Award XP
-                add_experience(winner, ctx.guild.id, 50, "duel_win")
-                add_experience(loser_data['user_id'], ctx.guild.id, 15, "duel_loss")
+    except TurnAlreadyResolved:
+        await ctx.send(embed=medieval_response("That turn was already resolved!", success=False))
+    except Exception as e:
+        await ctx.send(embed=medieval_response(f"Error taking turn: {str(e)}", success=False))
 
-                # Handle wager
-                if duel['wager'] > 0:
-                    update_combatant_stats(winner, ctx.guild.id, prestige=winner_data['prestige'] + duel['wager'])
-                    update_combatant_stats(
-                        loser_data['user_id'], ctx.guild.id,
-                        prestige=max(0, loser_data['prestige'] - duel['wager'])
-                    )
+# ---------- WAR SYSTEM ----------
+def create_war(guild_id, challenger_id, defender_id, war_name, terrain, weather):
+    """Record an accepted war with both armies' starting power"""
+    with get_combat_db_connection() as db:
+        # Get army powers
+        challenger = get_enhanced_combatant(challenger_id, guild_id)
+        defender = get_enhanced_combatant(defender_id, guild_id)
 
-                db.commit()
+        challenger_power = calculate_army_power(challenger)
+        defender_power = calculate_army_power(defender)
 
-                winner_member = ctx.guild.get_member(winner)
-                await ctx.send(embed=medieval_embed(
-                    title="🏆 Duel Victory!",
-                    description=f"**{winner_member.display_name if winner_member else 'The victor'}** wins the duel!",
-                    color_name="green"
-                ))
-            else:
-                # Send turn result
-                opponent_id = duel['defender_id'] if is_challenger else duel['challenger_id']
-                opponent_member = ctx.guild.get_member(opponent_id)
-
-                embed = medieval_embed(
-                    title="⚔️ Action Executed!",
-                    description=f"**{ctx.author.display_name}** used **{action.replace('_', ' ').title()}**!",
-                    color_name="blue"
-                )
+        now = utcnow()
+        war_id = db.execute("""
+        INSERT INTO faction_wars (guild_id, war_name, war_type, team_a_leader,
+                                team_b_leader, terrain, weather, status,
+                                team_a_army_size, team_b_army_size,
+                                team_a_members, team_b_members, rng_seed,
+                                started_at, last_action)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (guild_id, war_name, "Field Battle",
+              challenger_id, defender_id, terrain,
+              weather, "active",
+              challenger_power['total'], defender_power['total'],
+              str([challenger_id]), str([defender_id]), new_rng_seed(),
+              now.isoformat(), now.isoformat())).lastrowid
+        db.commit()
+    turn_timeouts.schedule('war', war_id, now.timestamp() + WAR_TURN_TIMEOUT)
+
+ACTIVE_WAR_SQL = """
+SELECT * FROM faction_wars
+WHERE guild_id=? AND status='active' AND
+      (team_a_leader=? OR team_b_leader=?)"""
+
+HOT_QUERIES["get_active_war"] = ACTIVE_WAR_SQL
+
+# One per team on the clock; the WHERE clause rejects a turn that was already taken
+TEAM_A_TURN_SQL = """
+UPDATE faction_wars
+SET war_score_a=?, war_score_b=?, current_team='B',
+    current_tactic_a=?, turn=turn+1, last_action=?
+WHERE id=? AND status='active' AND turn=? AND current_team='A'"""
+
+TEAM_B_TURN_SQL = """
+UPDATE faction_wars
+SET war_score_b=?, war_score_a=?, current_team='A',
+    current_tactic_b=?, turn=turn+1, last_action=?
+WHERE id=? AND status='active' AND turn=? AND current_team='B'"""
+
+HOT_QUERIES["team_a_turn"] = TEAM_A_TURN_SQL
+HOT_QUERIES["team_b_turn"] = TEAM_B_TURN_SQL
+
+def get_active_war(guild_id, user_id):
+    """Get the active war a combatant leads a team in"""
+    with get_combat_db_connection() as db:
+        war = db.execute(ACTIVE_WAR_SQL, (guild_id, user_id, user_id)).fetchone()
+        return dict(war) if war else None
+
+def resolve_war_turn(war, user_id, guild_id, tactic):
+    """Apply one war turn and conclude the war after the final round, in one transaction"""
+    with combat_unit_of_work():
+        return _resolve_war_turn(war, user_id, guild_id, tactic)
+
+def _resolve_war_turn(war, user_id, guild_id, tactic):
+    is_team_a = war['team_a_leader'] == user_id
+
+    # Get combatants
+    team_a_leader = get_enhanced_combatant(war['team_a_leader'], guild_id)
+    team_b_leader = get_enhanced_combatant(war['team_b_leader'], guild_id)
+
+    if not team_a_leader or not team_b_leader:
+        return None
 
-                embed.add_field(name="Damage", value=f"{damage} HP", inline=True)
-                if critical:
-                    embed.add_field(name="Critical Hit!", value="⭐", inline=True)
-                embed.add_field(name="Next Turn", value=opponent_member.display_name if opponent_member else "Opponent", inline=True)
-                embed.add_field(name="Challenger HP", value=new_challenger_hp if not is_challenger else duel['challenger_hp'], inline=True)
-                embed.add_field(name="Defender HP", value=new_defender_hp if is_challenger else duel['defender_hp'], inline=True)
+    # Calculate army powers
+    team_a_power = calculate_army_power(team_a_leader)
+    team_b_power = calculate_army_power(team_b_leader)
 
-                await ctx.send(embed=embed)
+    # Get current tactics
+    attacker_tactic = tactic
+    defender_tactic = war['current_tactic_b'] if is_team_a else war['current_tactic_a']
 
-    except Exception as e:
-        await ctx.send(embed=medieval_response(f"Error taking turn: {str(e)}", success=False))
+    # Calculate damage from this turn's own generator so the turn can be replayed
+    rng = event_rng(war['rng_seed'], war['turn'])
+    if is_team_a:
+        damage, surprise, surprise_type = calculate_war_damage(
+            team_a_power['total'], team_b_power['total'],
+            war['terrain'], war['weather'], attacker_tactic, defender_tactic, rng
+        )
+    else:
+        damage, surprise, surprise_type = calculate_war_damage(
+            team_b_power['total'], team_a_power['total'],
+            war['terrain'], war['weather'], attacker_tactic, defender_tactic, rng
+        )
+
+    # Calculate casualties
+    if is_team_a:
+        casualty_rate = calculate_casualties(
+            team_b_power['total'], damage, war['terrain'], war['weather']
+        )
+        team_b_casualties = int(team_b_power['total'] * casualty_rate)
+        team_a_casualties = int(team_a_power['total'] * (casualty_rate * 0.5))
+    else:
+        casualty_rate = calculate_casualties(
+            team_a_power['total'], damage, war['terrain'], war['weather']
+        )
+        team_a_casualties = int(team_a_power['total'] * casualty_rate)
+        team_b_casualties = int(team_b_power['total'] * (casualty_rate * 0.5))
+
+    with get_combat_db_connection() as db:
+        # Update war stats
+        now = utcnow()
+        if is_team_a:
+            new_score_a = war['war_score_a'] + damage
+            new_score_b = war['war_score_b'] - damage
+            updated = db.execute(TEAM_A_TURN_SQL, (new_score_a, new_score_b, tactic, now.isoformat(), war['id'], war['turn']))
+        else:
+            new_score_b = war['war_score_b'] + damage
+            new_score_a = war['war_score_a'] - damage
+            updated = db.execute(TEAM_B_TURN_SQL, (new_score_b, new_score_a, tactic, now.isoformat(), war['id'], war['turn']))
+        # The command read `war` in an earlier call; only the turn it saw may be applied
+        if updated.rowcount == 0:
+            raise TurnAlreadyResolved(war['id'])
+
+        # Record casualties
+        stamp = sqlite_timestamp(now)
+        if is_team_a:
+            casualties = [(war['id'], war['team_b_leader'], guild_id, team_b_casualties, "battle",
+                           f"Team B suffered {team_b_casualties:,} casualties from Team A's {tactic}", stamp)]
+            if team_a_casualties > 0:
+                casualties.append((war['id'], war['team_a_leader'], guild_id, team_a_casualties, "counterattack",
+                                   f"Team A suffered {team_a_casualties:,} return casualties", stamp))
+        else:
+            casualties = [(war['id'], war['team_a_leader'], guild_id, team_a_casualties, "battle",
+                           f"Team A suffered {team_a_casualties:,} casualties from Team B's {tactic}", stamp)]
+            if team_b_casualties > 0:
+                casualties.append((war['id'], war['team_b_leader'], guild_id, team_b_casualties, "counterattack",
+                                   f"Team B suffered {team_b_casualties:,} return casualties", stamp))
+        record_history("war_casualties", ("war_id", "user_id", "guild_id", "soldiers_lost",
+                                          "casualty_type", "description", "timestamp"), casualties)
+
+        # Record war action
+        record_history("war_actions", ("war_id", "user_id", "guild_id", "action_type", "target_team",
+                                       "army_size_used", "soldiers_lost", "total_damage", "description",
+                                       "critical_success", "timestamp"),
+                       [(war['id'], user_id, guild_id, tactic,
+                         'B' if is_team_a else 'A',
+                         team_a_power['total'] if is_team_a else team_b_power['total'],
+                         team_b_casualties if is_team_a else team_a_casualties,
+                         damage, f"Used {tactic} tactic", surprise, stamp)])
+
+        db.commit()
+
+        # Check for war end
+        winner = None
+        if war['turn'] >= 10:  # 10 rounds max
+            winner = 'A' if new_score_a > new_score_b else 'B' if new_score_b > new_score_a else 'draw'
+
+            db.execute("""
+            UPDATE faction_wars SET status='ended', ended_at=?
+            WHERE id=?
+            """, (utcnow().isoformat(), war['id']))
+
+            # Award XP to winner
+            if winner != 'draw':
+                winner_id = war['team_a_leader'] if winner == 'A' else war['team_b_leader']
+                loser_id = war['team_b_leader'] if winner == 'A' else war['team_a_leader']
+                add_experience_bulk(guild_id, [
+                    (winner_id, 200, "war_victory"),
+                    (loser_id, 50, "war_participation")
+                ])
+
+            db.commit()
+            turn_timeouts.cancel('war', war['id'])
+        else:
+            turn_timeouts.schedule('war', war['id'], now.timestamp() + WAR_TURN_TIMEOUT)
+
+    winner_name = None
+    if winner == 'A':
+        winner_name = team_a_leader['character_name']
+    elif winner == 'B':
+        winner_name = team_b_leader['character_name']
+
+    return {
+        'damage': damage,
+        'surprise': surprise,
+        'surprise_type': surprise_type,
+        'team_a_casualties': team_a_casualties,
+        'team_b_casualties': team_b_casualties,
+        'score_a': new_score_a,
+        'score_b': new_score_b,
+        'winner': winner,
+        'winner_name': winner_name
+    }
 
-# ---------- WAR SYSTEM ----------
 class WarChallengeView(discord.ui.View):
     def __init__(self, challenger_id, defender_id, war_name, terrain, weather):
         super().__init__(timeout=300.0)
@@ -2001,26 +3931,8 @@ class WarChallengeView(discord.ui.View):
 
         # Create war in database
         try:
-            with get_combat_db_connection() as db:
-                # Get army powers
-                challenger = get_enhanced_combatant(self.challenger_id, interaction.guild.id)
-                defender = get_enhanced_combatant(self.defender_id, interaction.guild.id)
-
-                challenger_power = calculate_army_power(challenger)
-                defender_power = calculate_army_power(defender)
-
-                db.execute("""
-                INSERT INTO faction_wars (guild_id, war_name, war_type, team_a_leader,
-                                        team_b_leader, terrain, weather, status,
-                                        team_a_army_size, team_b_army_size,
-                                        team_a_members, team_b_members)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (interaction.guild.id, self.war_name, "Field Battle",
-                      self.challenger_id, self.defender_id, self.terrain,
-                      self.weather, "active",
-                      challenger_power['total'], defender_power['total'],
-                      str([self.challenger_id]), str([self.defender_id])))
-                db.commit()
+            await run_db(create_war, interaction.guild.id, self.challenger_id, self.defender_id,
+                         self.war_name, self.terrain, self.weather)
 
             await interaction.response.send_message(
                 embed=medieval_embed(
@@ -2068,8 +3980,8 @@ async def enhanced_war_cmd(ctx, opponent: discord.Member = None, war_name: str =
             ))
 
         # Check if both are registered
-        challenger = get_enhanced_combatant(ctx.author.id, ctx.guild.id)
-        defender = get_enhanced_combatant(opponent.id, ctx.guild.id)
+        challenger = await run_db(get_enhanced_combatant, ctx.author.id, ctx.guild.id)
+        defender = await run_db(get_enhanced_combatant, opponent.id, ctx.guild.id)
 
         if not challenger:
             return await ctx.send(embed=medieval_response(
@@ -2133,219 +4045,101 @@ async def war_turn_cmd(ctx, tactic: str = None):
     """Take your turn in a war"""
     try:
         # Get active war involving user
-        with get_combat_db_connection() as db:
-            war = db.execute("""
-            SELECT * FROM faction_wars
-            WHERE guild_id=? AND status='active' AND
-                  (team_a_leader=? OR team_b_leader=?)
-            """, (ctx.guild.id, ctx.author.id, ctx.author.id)).fetchone()
-
-            if not war:
-                return await ctx.send(embed=medieval_response(
-                    "Thou art not in an active war!",
-                    success=False
-                ))
-
-            # Determine which team user is on
-            is_team_a = war['team_a_leader'] == ctx.author.id
-            current_team = 'A' if is_team_a else 'B'
-
-            if war['current_team'] != current_team:
-                other_team = 'B' if current_team == 'A' else 'A'
-                return await ctx.send(embed=medieval_response(
-                    f"It is Team {other_team}'s turn!",
-                    success=False
-                ))
-
-            if not tactic:
-                # Show available tactics
-                embed = medieval_embed(
-                    title="⚔️ War Turn - Choose Tactic",
-                    description="Available battle tactics:",
-                    color_name="gold"
-                )
+        war = await run_db(get_active_war, ctx.guild.id, ctx.author.id)
 
-                for tactic_name, tactic_info in BATTLE_TACTICS.items():
-                    embed.add_field(
-                        name=tactic_name,
-                        value=f"{tactic_info['description']}\nDamage: {tactic_info['damage']}x | Risk: {tactic_info['risk']}x",
-                        inline=False
-                    )
-
-                return await ctx.send(embed=embed)
-
-            if tactic not in BATTLE_TACTICS:
-                return await ctx.send(embed=medieval_response(
-                    f"Invalid tactic! Choose from: {', '.join(BATTLE_TACTICS.keys())}",
-                    success=False
-                ))
-
-            # Get combatants
-            team_a_leader = get_enhanced_combatant(war['team_a_leader'], ctx.guild.id)
-            team_b_leader = get_enhanced_combatant(war['team_b_leader'], ctx.guild.id)
-
-            if not team_a_leader or not team_b_leader:
-                return await ctx.send(embed=medieval_response(
-                    "War participants not found!",
-                    success=False
-                ))
-
-            # Calculate army powers
-            team_a_power = calculate_army_power(team_a_leader)
-            team_b_power = calculate_army_power(team_b_leader)
-
-            # Get current tactics
-            attacker_tactic = tactic
-            defender_tactic = war['current_tactic_b'] if is_team_a else war['current_tactic_a']
-
-            # Calculate damage
-            if is_team_a:
-                damage, surprise, surprise_type = calculate_war_damage(
-                    team_a_power['total'], team_b_power['total'],
-                    war['terrain'], war['weather'], attacker_tactic, defender_tactic
-                )
-            else:
-                damage, surprise, surprise_type = calculate_war_damage(
-                    team_b_power['total'], team_a_power['total'],
-                    war['terrain'], war['weather'], attacker_tactic, defender_tactic
-                )
-
-            # Calculate casualties
-            if is_team_a:
-                casualty_rate = calculate_casualties(
-                    team_b_power['total'], damage, war['terrain'], war['weather']
-                )
-                team_b_casualties = int(team_b_power['total'] * casualty_rate)
-                team_a_casualties = int(team_a_power['total'] * (casualty_rate * 0.5))
-            else:
-                casualty_rate = calculate_casualties(
-                    team_a_power['total'], damage, war['terrain'], war['weather']
-                )
-                team_a_casualties = int(team_a_power['total'] * casualty_rate)
-                team_b_casualties = int(team_b_power['total'] * (casualty_rate * 0.5))
-
-            # Update war stats
-            if is_team_a:
-                new_score_a = war['war_score_a'] + damage
-                new_score_b = war['war_score_b'] - damage
-                db.execute("""
-                UPDATE faction_wars
-                SET war_score_a=?, war_score_b=?, current_team='B',
-                    current_tactic_a=?, turn=turn+1
-                WHERE id=?
-                """, (new_score_a, new_score_b, tactic, war['id']))
-            else:
-                new_score_b = war['war_score_b'] + damage
-                new_score_a = war['war_score_a'] - damage
-                db.execute("""
-                UPDATE faction_wars
-                SET war_score_b=?, war_score_a=?, current_team='A',
-                    current_tactic_b=?, turn=turn+1
-                WHERE id=?
-                """, (new_score_b, new_score_a, tactic, war['id']))
-
-            # Record casualties
-            if is_team_a:
-                db.execute("""
-                INSERT INTO war_casualties (war_id, user_id, guild_id, soldiers_lost,
-                                          casualty_type, description)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """, (war['id'], war['team_b_leader'], ctx.guild.id, team_b_casualties,
-                      "battle", f"Team B suffered {team_b_casualties:,} casualties from Team A's {tactic}"))
-
-                if team_a_casualties > 0:
-                    db.execute("""
-                    INSERT INTO war_casualties (war_id, user_id, guild_id, soldiers_lost,
-                                              casualty_type, description)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """, (war['id'], war['team_a_leader'], ctx.guild.id, team_a_casualties,
-                          "counterattack", f"Team A suffered {team_a_casualties:,} return casualties"))
-            else:
-                db.execute("""
-                INSERT INTO war_casualties (war_id, user_id, guild_id, soldiers_lost,
-                                          casualty_type, description)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """, (war['id'], war['team_a_leader'], ctx.guild.id, team_a_casualties,
-                      "battle", f"Team A suffered {team_a_casualties:,} casualties from Team B's {tactic}"))
-
-                if team_b_casualties > 0:
-                    db.execute("""
-                    INSERT INTO war_casualties (war_id, user_id, guild_id, soldiers_lost,
-                                              casualty_type, description)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """, (war['id'], war['team_b_leader'], ctx.guild.id, team_b_casualties,
-                          "counterattack", f"Team B suffered {team_b_casualties:,} return casualties"))
-
-            # Record war action
-            db.execute("""
-            INSERT INTO war_actions (war_id, user_id, guild_id, action_type,
-                                   target_team, army_size_used, soldiers_lost,
-                                   total_damage, description, critical_success)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (war['id'], ctx.author.id, ctx.guild.id, tactic,
-                  'B' if is_team_a else 'A',
-                  team_a_power['total'] if is_team_a else team_b_power['total'],
-                  team_b_casualties if is_team_a else team_a_casualties,
-                  damage, f"Used {tactic} tactic", surprise))
+        if not war:
+            return await ctx.send(embed=medieval_response(
+                "Thou art not in an active war!",
+                success=False
+            ))
 
-            db.commit()
+        # Determine which team user is on
+        is_team_a = war['team_a_leader'] == ctx.author.id
+        current_team = 'A' if is_team_a else 'B'
 
-            # Check for war end
-            if war['turn'] >= 10:  # 10 rounds max
-                winner = 'A' if new_score_a > new_score_b else 'B' if new_score_b > new_score_a else 'draw'
+        if war['current_team'] != current_team:
+            other_team = 'B' if current_team == 'A' else 'A'
+            return await ctx.send(embed=medieval_response(
+                f"It is Team {other_team}'s turn!",
+                success=False
+            ))
 
-                db.execute("""
-                UPDATE faction_wars SET status='ended', ended_at=?
-                WHERE id=?
-                """, (utcnow().isoformat(), war['id']))
+        if not tactic:
+            # Show available tactics
+            embed = medieval_embed(
+                title="⚔️ War Turn - Choose Tactic",
+                description="Available battle tactics:",
+                color_name="gold"
+            )
 
-                # Award XP to winner
-                if winner != 'draw':
-                    winner_id = war['team_a_leader'] if winner == 'A' else war['team_b_leader']
-                    add_experience(winner_id, ctx.guild.id, 200, "war_victory")
+            for tactic_name, tactic_info in BATTLE_TACTICS.items():
+                embed.add_field(
+                    name=tactic_name,
+                    value=f"{tactic_info['description']}\nDamage: {tactic_info['damage']}x | Risk: {tactic_info['risk']}x",
+                    inline=False
+                )
 
-                    loser_id = war['team_b_leader'] if winner == 'A' else war['team_a_leader']
-                    add_experience(loser_id, ctx.guild.id, 50, "war_participation")
+            return await ctx.send(embed=embed)
 
-                db.commit()
+        if tactic not in BATTLE_TACTICS:
+            return await ctx.send(embed=medieval_response(
+                f"Invalid tactic! Choose from: {', '.join(BATTLE_TACTICS.keys())}",
+                success=False
+            ))
 
-                winner_name = team_a_leader['character_name'] if winner == 'A' else team_b_leader['character_name'] if winner == 'B' else "None"
-                embed = medieval_embed(
-                    title="🏆 War Concluded!",
-                    description=f"**{war['war_name']}** has ended after {war['turn']} rounds!\n"
-                              f"**Winner:** {winner_name if winner != 'draw' else 'Draw!'}\n"
-                              f"Final Score - Team A: {new_score_a:,} | Team B: {new_score_b:,}",
-                    color_name="gold" if winner == 'draw' else "green"
-                )
+        result = await run_db(resolve_war_turn, war, ctx.author.id, ctx.guild.id, tactic)
+        if not result:
+            return await ctx.send(embed=medieval_response(
+                "War participants not found!",
+                success=False
+            ))
 
-                return await ctx.send(embed=embed)
+        new_score_a = result['score_a']
+        new_score_b = result['score_b']
+        winner = result['winner']
 
-            # Send turn result
+        # Check for war end
+        if winner:
             embed = medieval_embed(
-                title="⚔️ War Turn Executed!",
-                description=f"**{ctx.author.display_name}** used **{tactic}**!",
-                color_name="blue"
+                title="🏆 War Concluded!",
+                description=f"**{war['war_name']}** has ended after {war['turn']} rounds!\n"
+                          f"**Winner:** {result['winner_name'] if winner != 'draw' else 'Draw!'}\n"
+                          f"Final Score - Team A: {new_score_a:,} | Team B: {new_score_b:,}",
+                color_name="gold" if winner == 'draw' else "green"
             )
 
-            embed.add_field(name="Damage Inflicted", value=f"{damage:,}", inline=True)
-            embed.add_field(name="Enemy Casualties", value=f"{team_b_casualties if is_team_a else team_a_casualties:,}", inline=True)
-            embed.add_field(name="Friendly Casualties", value=f"{team_a_casualties if is_team_a else team_b_casualties:,}", inline=True)
+            return await ctx.send(embed=embed)
 
-            if surprise:
-                embed.add_field(name="Surprise!", value=f"{surprise_type.capitalize()} attack successful!", inline=False)
+        # Send turn result
+        embed = medieval_embed(
+            title="⚔️ War Turn Executed!",
+            description=f"**{ctx.author.display_name}** used **{tactic}**!",
+            color_name="blue"
+        )
 
-            embed.add_field(name="Current Score",
-                          value=f"Team A: {new_score_a if is_team_a else war['war_score_a']:,} | Team B: {new_score_b if not is_team_a else war['war_score_b']:,}",
-                          inline=False)
+        team_a_casualties = result['team_a_casualties']
+        team_b_casualties = result['team_b_casualties']
+        embed.add_field(name="Damage Inflicted", value=f"{result['damage']:,}", inline=True)
+        embed.add_field(name="Enemy Casualties", value=f"{team_b_casualties if is_team_a else team_a_casualties:,}", inline=True)
+        embed.add_field(name="Friendly Casualties", value=f"{team_a_casualties if is_team_a else team_b_casualties:,}", inline=True)
 
-            next_team = 'B' if current_team == 'A' else 'A'
-            next_leader = war['team_b_leader'] if next_team == 'B' else war['team_a_leader']
-            next_member = ctx.guild.get_member(next_leader)
+        if result['surprise']:
+            embed.add_field(name="Surprise!", value=f"{result['surprise_type'].capitalize()} attack successful!", inline=False)
 
-            embed.add_field(name="Next Turn", value=f"Team {next_team} - {next_member.display_name if next_member else 'Unknown'}", inline=False)
+        embed.add_field(name="Current Score",
+                      value=f"Team A: {new_score_a:,} | Team B: {new_score_b:,}",
+                      inline=False)
 
-            await ctx.send(embed=embed)
+        next_team = 'B' if current_team == 'A' else 'A'
+        next_leader = war['team_b_leader'] if next_team == 'B' else war['team_a_leader']
+        next_member = ctx.guild.get_member(next_leader)
+
+        embed.add_field(name="Next Turn", value=f"Team {next_team} - {next_member.display_name if next_member else 'Unknown'}", inline=False)
+
+        await ctx.send(embed=embed)
 
+    except TurnAlreadyResolved:
+        await ctx.send(embed=medieval_response("That turn was already resolved!", success=False))
     except Exception as e:
         await ctx.send(embed=medieval_response(f"Error taking war turn: {str(e)}", success=False))
 
@@ -2361,7 +4155,7 @@ class ArmyManagementView(discord.ui.View):
         if interaction.user.id != self.user_id:
             return await interaction.response.send_message("This menu is not for thee!", ephemeral=True)
 
-        combatant = get_enhanced_combatant(self.user_id, self.guild_id)
+        combatant = await run_db(get_enhanced_combatant, self.user_id, self.guild_id)
         if not combatant:
             return await interaction.response.send_message("Thou art not registered!", ephemeral=True)
 
@@ -2413,7 +4207,7 @@ class ArmyManagementView(discord.ui.View):
 async def army_manage_cmd(ctx):
     """Open army management interface"""
     try:
-        combatant = get_enhanced_combatant(ctx.author.id, ctx.guild.id)
+        combatant = await run_db(get_enhanced_combatant, ctx.author.id, ctx.guild.id)
         if not combatant:
             return await ctx.send(embed=medieval_response(
                 "Thou must first register as a combatant!",
@@ -2435,9 +4229,10 @@ async def army_manage_cmd(ctx):
             inline=True
         )
 
+        army_power = calculate_army_power(combatant)
         embed.add_field(
             name="⚡ Army Power",
-            value=f"**Total:** {calculate_army_power(combatant)['total']:,}\n"
+            value=f"**Total:** {army_power['total']:,}\n"
                   f"**Type:** {combatant['army_type']}\n"
                   f"**Formation:** {combatant.get('battle_formation', 'Line')}\n"
                   f"**Fortifications:** {combatant['fortifications']}",
@@ -2451,12 +4246,32 @@ async def army_manage_cmd(ctx):
         await ctx.send(embed=medieval_response(f"Error in army management: {str(e)}", success=False))
 
 # ---------- FORMATION COMMAND ----------
+def list_formations():
+    """Get all battle formations"""
+    return [dict(row) for row in game_tables.formations.values()]
+
+def set_army_formation(user_id, guild_id, formation_name):
+    """Switch an army's formation, returning the formation or None if unknown"""
+    formation = game_tables.formations.get(formation_name)
+    if not formation:
+        return None
+
+    with get_combat_db_connection() as db:
+        # Update army formation
+        db.execute("""
+        UPDATE armies SET battle_formation=? WHERE user_id=? AND guild_id=?
+        """, (formation_name, user_id, guild_id))
+        invalidate_combatant(user_id, guild_id)
+        db.commit()
+
+        return dict(formation)
+
 @bot.command(name="formation")
 @commands.guild_only()
 async def formation_cmd(ctx, formation_name: str = None):
     """Change or view battle formations"""
     try:
-        combatant = get_enhanced_combatant(ctx.author.id, ctx.guild.id)
+        combatant = await run_db(get_enhanced_combatant, ctx.author.id, ctx.guild.id)
         if not combatant:
             return await ctx.send(embed=medieval_response(
                 "Thou must first register as a combatant!",
@@ -2465,59 +4280,44 @@ async def formation_cmd(ctx, formation_name: str = None):
 
         if not formation_name:
             # Show available formations
-            with get_combat_db_connection() as db:
-                formations = db.execute("""
-                SELECT formation_name, infantry_bonus, cavalry_bonus, archer_bonus,
-                       defense_bonus, movement_penalty, description
-                FROM battle_formations
-                """).fetchall()
-
-                embed = medieval_embed(
-                    title="⚔️ Available Formations",
-                    description="Choose a formation with `!formation <name>`",
-                    color_name="gold"
+            formations = list_formations()
+
+            embed = medieval_embed(
+                title="⚔️ Available Formations",
+                description="Choose a formation with `!formation <name>`",
+                color_name="gold"
+            )
+
+            for formation in formations:
+                embed.add_field(
+                    name=f"**{formation['formation_name']}**",
+                    value=f"{formation['description']}\n"
+                          f"Infantry: {formation['infantry_bonus']}x | "
+                          f"Cavalry: {formation['cavalry_bonus']}x | "
+                          f"Archers: {formation['archer_bonus']}x | "
+                          f"Defense: {formation['defense_bonus']}x",
+                    inline=False
                 )
 
-                for formation in formations:
-                    embed.add_field(
-                        name=f"**{formation['formation_name']}**",
-                        value=f"{formation['description']}\n"
-                              f"Infantry: {formation['infantry_bonus']}x | "
-                              f"Cavalry: {formation['cavalry_bonus']}x | "
-                              f"Archers: {formation['archer_bonus']}x | "
-                              f"Defense: {formation['defense_bonus']}x",
-                        inline=False
-                    )
-
-                await ctx.send(embed=embed)
-                return
+            await ctx.send(embed=embed)
+            return
 
         # Change formation
-        with get_combat_db_connection() as db:
-            # Get formation details
-            formation = db.execute("""
-            SELECT * FROM battle_formations WHERE formation_name=?
-            """, (formation_name,)).fetchone()
-
-            if not formation:
-                return await ctx.send(embed=medieval_response(
-                    "Formation not found!",
-                    success=False
-                ))
-
-            # Update army formation
-            db.execute("""
-            UPDATE armies SET battle_formation=? WHERE user_id=? AND guild_id=?
-            """, (formation_name, ctx.author.id, ctx.guild.id))
-            db.commit()
+        formation = await run_db(set_army_formation, ctx.author.id, ctx.guild.id, formation_name)
 
-            embed = medieval_embed(
-                title="✅ Formation Changed!",
-                description=f"Thy army now uses the **{formation_name}** formation!\n*{formation['description']}*",
-                color_name="green"
-            )
+        if not formation:
+            return await ctx.send(embed=medieval_response(
+                "Formation not found!",
+                success=False
+            ))
 
-            await ctx.send(embed=embed)
+        embed = medieval_embed(
+            title="✅ Formation Changed!",
+            description=f"Thy army now uses the **{formation_name}** formation!\n*{formation['description']}*",
+            color_name="green"
+        )
+
+        await ctx.send(embed=embed)
 
     except Exception as e:
         await ctx.send(embed=medieval_response(f"Error changing formation: {str(e)}", success=False))
@@ -2528,7 +4328,7 @@ async def formation_cmd(ctx, formation_name: str = None):
 async def allocate_cmd(ctx, stat: str = None, amount: int = None):
     """Allocate stat points"""
     try:
-        combatant = get_enhanced_combatant(ctx.author.id, ctx.guild.id)
+        combatant = await run_db(get_enhanced_combatant, ctx.author.id, ctx.guild.id)
         if not combatant:
             return await ctx.send(embed=medieval_response(
                 "Thou must first register as a combatant!",
@@ -2591,7 +4391,8 @@ async def allocate_cmd(ctx, stat: str = None, amount: int = None):
         new_value = current_value + amount
         new_stat_points = combatant['stat_points'] - amount
 
-        update_combatant_stats(
+        await run_db(
+            update_combatant_stats,
             ctx.author.id, ctx.guild.id,
             **{stat.lower(): new_value, 'stat_points': new_stat_points}
         )
@@ -2662,7 +4463,8 @@ async def enhanced_help_cmd(ctx):
     embed.add_field(
         name="⚔️ Combat Systems",
         value="`!duel @opponent [wager]` - Duel with terrain/weather effects\n"
-              "`!turn <action>` - Take your turn in a duel\n"
+              f"`!turn <action>` - Take your turn in a duel; {describe_turn_clock(DUEL_TURN_TIMEOUT)} "
+              f"per turn or the duel is forfeited\n"
               "`!war <name> @opponent` - Declare war\n"
               "`!warturn <tactic>` - Take war turn",
         inline=False
@@ -2709,165 +4511,578 @@ async def enhanced_help_cmd(ctx):
     await ctx.send(embed=embed)
 
 # ---------- ACHIEVEMENTS SYSTEM ----------
-def check_achievements(user_id, guild_id):
-    """Check and award achievements"""
+def grant_achievements(db, user_id, guild_id, rules):
+    """Record the rules as earned and pay out rewards for the ones not held yet"""
+    earned = []
+    for rule in rules:
+        inserted = db.execute("""
+        INSERT OR IGNORE INTO player_achievements (user_id, guild_id, achievement_name, earned_at)
+        VALUES (?, ?, ?, ?)
+        """, (user_id, guild_id, rule.name, utcnow().isoformat())).rowcount
+        if inserted:
+            earned.append(rule)
+
+    if earned:
+        db.execute("""
+        UPDATE combatants SET prestige=prestige+? WHERE user_id=? AND guild_id=?
+        """, (sum(rule.reward for rule in earned), user_id, guild_id))
+        invalidate_combatant(user_id, guild_id)
+        db.commit()
+
+    return [{'name': rule.name, 'description': rule.description, 'reward': rule.reward} for rule in earned]
+
+def award_achievements(user_id, guild_id, changed, previous=None):
+    """Evaluate only the rules that depend on the changed columns.
+
+    `changed` maps columns to their new values and `previous` to the old ones
+    where known; a rule is a candidate only if the change crossed one of its
+    thresholds, so the database is not touched when nothing could be earned.
+    """
     try:
-        combatant = get_enhanced_combatant(user_id, guild_id)
-        if not combatant:
+        previous = previous or {}
+        rules_by_stat = game_tables.achievement_rules
+
+        candidates = {}
+        for column, value in changed.items():
+            for rule in rules_by_stat.get(column, ()):
+                threshold = rule.requirements[column]
+                if value >= threshold and previous.get(column, -math.inf) < threshold:
+                    candidates[rule.name] = rule
+        if not candidates:
             return []
 
-        with get_combat_db_connection() as db:
-            # Get all achievements
-            achievements = db.execute("""
-            SELECT * FROM achievements
-            """).fetchall()
-
-            # Get current achievements
-            current_achievements = eval(combatant['achievements'])
-
-            new_achievements = []
-            for achievement in achievements:
-                if achievement['achievement_name'] in current_achievements:
+        # Rules spanning several columns need the rest of the combatant's stats
+        stats = None
+        qualified = []
+        for rule in candidates.values():
+            if len(rule.requirements) > 1:
+                if stats is None:
+                    stats = dict(get_enhanced_combatant(user_id, guild_id) or {}, **changed)
+                if not rule.is_met(stats):
                     continue
+            qualified.append(rule)
 
-                # Check requirements
-                requirements = eval(achievement['requirement'])
-                meets_requirements = True
-
-                for req_key, req_value in requirements.items():
-                    if req_key == 'wins':
-                        if combatant['wins'] < req_value:
-                            meets_requirements = False
-                            break
-                    elif req_key == 'soldiers':
-                        if combatant['current_soldiers'] < req_value:
-                            meets_requirements = False
-                            break
-                    elif req_key == 'knights':
-                        if combatant['total_knights'] < req_value:
-                            meets_requirements = False
-                            break
-                    elif req_key == 'level':
-                        if combatant['level'] < req_value:
-                            meets_requirements = False
-                            break
-
-                if meets_requirements:
-                    # Award achievement
-                    current_achievements.append(achievement['achievement_name'])
-
-                    # Add reward to prestige
-                    new_prestige = combatant['prestige'] + achievement['reward']
-                    update_combatant_stats(user_id, guild_id,
-                                         achievements=str(current_achievements),
-                                         prestige=new_prestige)
-
-                    new_achievements.append({
-                        'name': achievement['achievement_name'],
-                        'description': achievement['description'],
-                        'reward': achievement['reward']
-                    })
-
-            return new_achievements
+        if not qualified:
+            return []
+        with get_combat_db_connection() as db:
+            return grant_achievements(db, user_id, guild_id, qualified)
 
     except Exception as e:
-        print(f"Error checking achievements: {e}")
+        if in_unit_of_work():
+            raise
+        print(f"Error awarding achievements: {e}")
         return []
 
-# ---------- BACKGROUND TASKS ----------
-@tasks.loop(minutes=30)
-async def update_army_supplies_task():
-    """Background task to update army supplies"""
-    try:
-        print("⚙️ Updating army supplies...")
-        with get_combat_db_connection() as db:
-            # Get all armies
-            armies = db.execute("""
-            SELECT user_id, guild_id FROM armies
-            """).fetchall()
+# ---------- TURN TIMEOUTS ----------
+def turn_deadline(row, timeout):
+    """Epoch second at which the side on the clock of a duel/war row forfeits"""
+    last_action = parse_db_timestamp(row['last_action'] or row.get('started_at') or row['created_at'])
+    return last_action.timestamp() + timeout
+
+def describe_turn_clock(seconds):
+    """Turn clock length for players, e.g. '15 minutes' or '1 hour'"""
+    minutes = max(1, round(seconds / 60))
+    if minutes % 60 == 0:
+        hours = minutes // 60
+        return f"{hours} hour{'s' if hours != 1 else ''}"
+    return f"{minutes} minute{'s' if minutes != 1 else ''}"
+
+def duel_turn_deadline(duel):
+    if duel.get('turn_expires_at'):
+        return parse_db_timestamp(duel['turn_expires_at']).timestamp()
+    # Duels from before the turn clock: give them one clock from their last action
+    return turn_deadline(duel, DUEL_TURN_TIMEOUT)
+
+def war_turn_deadline(war):
+    return turn_deadline(war, WAR_TURN_TIMEOUT)
+
+def load_turn_deadlines():
+    """Deadlines of every active duel and war, to rebuild the scheduler on startup"""
+    with get_combat_db_connection() as db:
+        duels = db.execute("""
+        SELECT id, last_action, created_at, turn_expires_at FROM active_duels WHERE status='active'
+        """).fetchall()
+        wars = db.execute("""
+        SELECT id, last_action, started_at, created_at FROM faction_wars WHERE status='active'
+        """).fetchall()
+    return ([('duel', row['id'], duel_turn_deadline(dict(row))) for row in duels] +
+            [('war', row['id'], war_turn_deadline(dict(row))) for row in wars])
+
+def close_legacy_duels(db, duels, now):
+    """Close duels from before the turn clock; nobody agreed to one, so nothing is paid out"""
+    db.executemany("UPDATE active_duels SET status='expired', last_action=? WHERE id=?",
+                   [(now.isoformat(), duel['id']) for duel in duels])
+
+def forfeit_stale_duels(db, duels, now):
+    """The combatant on the clock loses each duel: wins/losses and the wager settle, no XP.
+
+    Returns one forfeit per duel for announcing in its channel.
+    """
+    db.executemany("UPDATE active_duels SET status='forfeited', last_action=? WHERE id=?",
+                   [(now.isoformat(), duel['id']) for duel in duels])
+
+    results = []
+    for duel in duels:
+        loser = duel['current_turn_user']
+        winner = duel['defender_id'] if loser == duel['challenger_id'] else duel['challenger_id']
+        results.append((duel['guild_id'], winner, loser, duel['wager'] or 0))
+
+    db.executemany("""
+    UPDATE combatants SET wins=wins+1, prestige=prestige+?, last_active=?
+    WHERE user_id=? AND guild_id=?
+    """, [(wager, now.isoformat(), winner, guild_id) for guild_id, winner, _, wager in results])
+    db.executemany("""
+    UPDATE combatants SET losses=losses+1, prestige=MAX(0, prestige-?)
+    WHERE user_id=? AND guild_id=?
+    """, [(wager, loser, guild_id) for guild_id, _, loser, wager in results])
+
+    for guild_id, winner, loser, _ in results:
+        invalidate_combatant(winner, guild_id)
+        invalidate_combatant(loser, guild_id)
+        row = db.execute("SELECT wins FROM combatants WHERE user_id=? AND guild_id=?",
+                         (winner, guild_id)).fetchone()
+        if row:
+            award_achievements(winner, guild_id, {'wins': row['wins']}, {'wins': row['wins'] - 1})
+
+    return [{'channel_id': duel['channel_id'], 'winner': winner, 'loser': loser, 'wager': wager}
+            for duel, (_, winner, loser, wager) in zip(duels, results)]
+
+def expire_stale_turns(duel_ids, war_ids):
+    """Forfeit every listed duel and close every listed war whose turn deadline has passed.
+
+    One unit of work for the whole batch. Deadlines are re-checked against the
+    stored rows, so an entry whose turn was taken since it was scheduled is
+    returned in 'pending' with its new deadline instead of being expired.
+    Duels from before the turn clock are closed without a winner.
+    """
+    now = utcnow()
+    pending = []
+    stale_duels = []
+    legacy_duels = []
+    stale_wars = []
+    forfeits = []
+    with combat_unit_of_work() as db:
+        if duel_ids:
+            rows = db.execute(f"""
+            SELECT * FROM active_duels WHERE status='active' AND id IN ({','.join('?' * len(duel_ids))})
+            """, list(duel_ids)).fetchall()
+            for duel in map(dict, rows):
+                deadline = duel_turn_deadline(duel)
+                if deadline > now.timestamp():
+                    pending.append(('duel', duel['id'], deadline))
+                elif duel['turn_expires_at']:
+                    stale_duels.append(duel)
+                else:
+                    legacy_duels.append(duel)
+            if stale_duels:
+                forfeits = forfeit_stale_duels(db, stale_duels, now)
+            if legacy_duels:
+                close_legacy_duels(db, legacy_duels, now)
+
+        if war_ids:
+            rows = db.execute(f"""
+            SELECT id, last_action, started_at, created_at FROM faction_wars
+            WHERE status='active' AND id IN ({','.join('?' * len(war_ids))})
+            """, list(war_ids)).fetchall()
+            for war in map(dict, rows):
+                deadline = war_turn_deadline(war)
+                if deadline > now.timestamp():
+                    pending.append(('war', war['id'], deadline))
+                else:
+                    stale_wars.append(war['id'])
+            db.executemany("UPDATE faction_wars SET status='forfeited', ended_at=? WHERE id=?",
+                           [(now.isoformat(), war_id) for war_id in stale_wars])
+
+    return {'duels': len(stale_duels) + len(legacy_duels), 'wars': len(stale_wars),
+            'pending': pending, 'forfeits': forfeits}
+
+async def announce_duel_forfeits(forfeits):
+    """Tell each duel's channel who ran out the clock and who won"""
+    for forfeit in forfeits:
+        channel = bot.get_channel(forfeit['channel_id']) if forfeit['channel_id'] else None
+        if channel is None:
+            continue
+        embed = medieval_embed(
+            title="⌛ Duel Forfeited",
+            description=f"<@{forfeit['loser']}> let the turn clock run out. <@{forfeit['winner']}> wins the duel!",
+            color_name="red"
+        )
+        if forfeit['wager']:
+            embed.add_field(name="🎯 Wager", value=f"{forfeit['wager']} prestige to the victor", inline=True)
+        try:
+            await channel.send(content=f"<@{forfeit['loser']}> <@{forfeit['winner']}>", embed=embed)
+        except discord.HTTPException as e:
+            print(f"Error announcing duel forfeit: {e}")
+
+class TurnTimeoutScheduler:
+    """In-memory heap of duel and war turn deadlines, expired in batches on the event loop.
+
+    The heap only decides when to look; `expire_stale_turns` re-checks each row,
+    so a stale or superseded entry costs at most a no-op check. Rescheduling
+    pushes a new entry and `_deadlines` marks which one is current.
+    """
+
+    def __init__(self, batch_window=1.0):
+        self.batch_window = batch_window
+        self._heap = []
+        self._deadlines = {}
+        self._lock = Lock()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self.expired = {'duels': 0, 'wars': 0}
+
+    def schedule(self, kind, row_id, deadline):
+        """Track (or move) the deadline of a duel or war; safe to call from any thread.
+
+        Inside a unit of work the change waits for the unit to commit, so a
+        rolled-back turn leaves the deadline that is still in the database.
+        """
+        self._change(kind, row_id, deadline)
+
+    def cancel(self, kind, row_id):
+        """Stop tracking a duel or war that has ended; deferred like schedule"""
+        self._change(kind, row_id, None)
+
+    def apply(self, changes):
+        """Apply the (kind, row_id, deadline or None) changes a unit of work deferred"""
+        for kind, row_id, deadline in changes:
+            self._set(kind, row_id, deadline)
+
+    def _change(self, kind, row_id, deadline):
+        unit = getattr(_unit_of_work_state, 'unit', None)
+        if unit is not None:
+            unit.deadlines.append((kind, row_id, deadline))
+        else:
+            self._set(kind, row_id, deadline)
 
-            for army in armies:
-                try:
-                    combatant = get_enhanced_combatant(army['user_id'], army['guild_id'])
-                    if not combatant:
-                        continue
-
-                    # Calculate total army size
-                    total_army = (
-                        combatant['current_soldiers'] +
-                        combatant['total_knights'] * 10 +
-                        combatant['total_archers'] * 3 +
-                        combatant['total_cavalry'] * 8 +
-                        combatant['total_siege'] * 15
-                    )
-
-                    # Calculate days since last check
-                    last_check = dt.fromisoformat(combatant['last_supply_check']) if combatant['last_supply_check'] else utcnow()
-                    hours_passed = max(1, (utcnow() - last_check).seconds // 3600)
-
-                    # Calculate supply consumption
-                    consumption = calculate_supply_consumption(total_army, hours_passed / 24)
-                    new_supplies = max(0, combatant['supplies'] - consumption)
-
-                    # Update supplies
-                    db.execute("""
-                    UPDATE armies
-                    SET supplies=?, last_supply_check=?
-                    WHERE user_id=? AND guild_id=?
-                    """, (new_supplies, utcnow().isoformat(), army['user_id'], army['guild_id']))
+    def _set(self, kind, row_id, deadline):
+        with self._lock:
+            if deadline is None:
+                self._deadlines.pop((kind, row_id), None)
+                return
+            self._deadlines[(kind, row_id)] = deadline
+            heapq.heappush(self._heap, (deadline, kind, row_id))
+        self._notify()
+
+    def pending(self):
+        with self._lock:
+            return len(self._deadlines)
+
+    def pending_by_kind(self):
+        counts = {'duel': 0, 'war': 0}
+        with self._lock:
+            for kind, _ in self._deadlines:
+                counts[kind] += 1
+        return counts
+
+    def _notify(self):
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass  # Loop already closed
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, kind, row_id = heapq.heappop(self._heap)
+                if self._deadlines.get((kind, row_id)) == deadline:
+                    del self._deadlines[(kind, row_id)]
+                    due.append((kind, row_id))
+            next_deadline = self._heap[0][0] if self._heap else None
+        return due, next_deadline
+
+    def start(self):
+        """Rebuild deadlines from the database and start expiring them; idempotent"""
+        if self._task and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
 
-                    # If supplies are very low, apply morale penalty
-                    if new_supplies <= 10:
-                        db.execute("""
-                        UPDATE armies
-                        SET morale=GREATEST(1, morale - 5)
-                        WHERE user_id=? AND guild_id=?
-                        """, (army['user_id'], army['guild_id']))
+    async def _expire(self, due):
+        duel_ids = [row_id for kind, row_id in due if kind == 'duel']
+        war_ids = [row_id for kind, row_id in due if kind == 'war']
+        try:
+            report = await run_db(expire_stale_turns, duel_ids, war_ids)
+        except Exception:
+            # Keep the batch; it is retried once the failure has had time to clear
+            retry_at = time.time() + 30
+            for kind, row_id in due:
+                self.schedule(kind, row_id, retry_at)
+            raise
+        for kind, row_id, deadline in report['pending']:
+            self.schedule(kind, row_id, deadline)
+        self.expired['duels'] += report['duels']
+        self.expired['wars'] += report['wars']
+        if report['duels'] or report['wars']:
+            print(f"⌛ Turn timeouts: {report['duels']} duels forfeited, {report['wars']} wars closed")
+        await announce_duel_forfeits(report['forfeits'])
+
+    async def _run(self):
+        try:
+            for kind, row_id, deadline in await run_db(load_turn_deadlines):
+                self.schedule(kind, row_id, deadline)
+            print(f"⌛ Tracking {self.pending()} turn deadlines")
+        except Exception as e:
+            print(f"Error loading turn deadlines: {e}")
+
+        while True:
+            try:
+                self._wakeup.clear()
+                due, next_deadline = self._pop_due(time.time())
+                if due:
+                    # Let deadlines landing in the same moment join this batch
+                    await asyncio.sleep(self.batch_window)
+                    more, _ = self._pop_due(time.time())
+                    await self._expire(due + more)
+                    continue
 
-                except Exception as e:
-                    print(f"Error updating supplies for army {army['user_id']}: {e}")
+                timeout = None if next_deadline is None else max(0.0, next_deadline - time.time())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error expiring turn timeouts: {e}")
+                await asyncio.sleep(self.batch_window)
 
-            db.commit()
+turn_timeouts = TurnTimeoutScheduler()
 
-        print("✅ Army supplies updated")
+# ---------- BACKGROUND TASKS ----------
+def compact_idle_army_supplies(chunk_size=SUPPLY_CHUNK_SIZE, idle_hours=SUPPLY_IDLE_HOURS):
+    """Settle supply accrual for armies nobody has touched in `idle_hours`.
+
+    Active armies accrue lazily whenever they are read or mutated, so this
+    only catches up the idle rows. Runs over rowid ranges, one short
+    transaction per chunk so command writes are never locked out for the sweep.
+    """
+    started = time.perf_counter()
+    now = utcnow().isoformat()
+
+    with get_combat_db_connection() as db:
+        bounds = db.execute("SELECT MIN(rowid), MAX(rowid), COUNT(*) FROM armies").fetchone()
+    first_rowid, last_rowid, army_count = bounds[0], bounds[1], bounds[2]
+
+    chunks = 0
+    updated = 0
+    if army_count:
+        for chunk_start in range(first_rowid, last_rowid + 1, chunk_size):
+            with combat_unit_of_work() as db:
+                updated += db.execute(f"""
+                {SUPPLY_ACCRUAL_SQL}
+                AND {SUPPLY_ELAPSED_HOURS_SQL} >= :idle_hours
+                AND rowid BETWEEN :chunk_start AND :chunk_end
+                """, {'now': now, 'idle_hours': idle_hours, 'chunk_start': chunk_start,
+                      'chunk_end': chunk_start + chunk_size - 1}).rowcount
+            chunks += 1
+
+    invalidate_all_combatants()
+    return {
+        'armies': army_count or 0,
+        'compacted': updated,
+        'chunks': chunks,
+        'seconds': time.perf_counter() - started
+    }
+
+RESET_WEEKLY_LIMITS_SQL = """
+UPDATE armies
+SET weekly_recruitment_used=0, recruitment_cooldown=NULL
+WHERE recruitment_cooldown IS NOT NULL AND
+      datetime(recruitment_cooldown) <= datetime('now')"""
+
+RESET_DAILY_ACTIONS_SQL = """
+UPDATE armies
+SET daily_actions=3, last_daily_reset=?
+WHERE datetime(last_daily_reset) <= datetime('now', '-1 day')"""
+
+HOT_QUERIES["reset_weekly_limits"] = RESET_WEEKLY_LIMITS_SQL
+HOT_QUERIES["reset_daily_actions"] = RESET_DAILY_ACTIONS_SQL
+
+def reset_expired_weekly_limits():
+    """Clear weekly recruitment usage for armies whose cooldown has passed"""
+    with get_combat_db_connection() as db:
+        db.execute(RESET_WEEKLY_LIMITS_SQL)
+        invalidate_all_combatants()
+        db.commit()
+
+def reset_expired_daily_actions():
+    """Restore daily actions for armies last reset over a day ago"""
+    with get_combat_db_connection() as db:
+        db.execute(RESET_DAILY_ACTIONS_SQL, (utcnow().isoformat(),))
+        invalidate_all_combatants()
+        db.commit()
+
+@tasks.loop(hours=6)
+@timed_task("update_army_supplies_task")
+async def update_army_supplies_task():
+    """Background task to settle supplies for idle armies"""
+    try:
+        print("⚙️ Compacting idle army supplies...")
+        report = await run_db(compact_idle_army_supplies)
+        print(f"✅ Army supplies compacted: {report['compacted']}/{report['armies']} idle armies "
+              f"in {report['chunks']} chunks, {report['seconds']:.2f}s")
     except Exception as e:
         print(f"Error in supply update task: {e}")
 
+@tasks.loop(minutes=5)
+@timed_task("refresh_game_tables_task")
+async def refresh_game_tables_task():
+    """Pick up hand edits to the static formation, siege and achievement tables"""
+    try:
+        await run_db(refresh_game_tables)
+    except Exception as e:
+        print(f"Error refreshing static tables: {e}")
+
 @tasks.loop(hours=24)
+@timed_task("reset_weekly_limits")
 async def reset_weekly_limits():
     """Reset weekly recruitment limits"""
     try:
         print("⚙️ Resetting weekly limits...")
-        with get_combat_db_connection() as db:
-            db.execute("""
-            UPDATE armies
-            SET weekly_recruitment_used=0, recruitment_cooldown=NULL
-            WHERE recruitment_cooldown IS NOT NULL AND
-                  datetime(recruitment_cooldown) <= datetime('now')
-            """)
-            db.commit()
-
+        await run_db(reset_expired_weekly_limits)
         print("✅ Weekly limits reset")
     except Exception as e:
         print(f"Error resetting weekly limits: {e}")
 
 @tasks.loop(hours=24)
+@timed_task("reset_daily_actions")
 async def reset_daily_actions():
     """Reset daily actions for all players"""
     try:
         print("⚙️ Resetting daily actions...")
-        with get_combat_db_connection() as db:
-            db.execute("""
-            UPDATE armies
-            SET daily_actions=3, last_daily_reset=?
-            WHERE datetime(last_daily_reset) <= datetime('now', '-1 day')
-            """, (utcnow().isoformat(),))
-            db.commit()
-
+        await run_db(reset_expired_daily_actions)
         print("✅ Daily actions reset")
     except Exception as e:
         print(f"Error resetting daily actions: {e}")
 
+# ---------- LOOP WATCHDOG ----------
+def describe_blocked_operation(frame):
+    """Name the command a blocked loop is running, from the nearest ctx/interaction on its stack"""
+    while frame is not None:
+        for name, prefix in (('ctx', PREFIX), ('interaction', '/')):
+            command = getattr(frame.f_locals.get(name), 'command', None)
+            if command is not None:
+                return f"{prefix}{command.qualified_name}"
+        frame = frame.f_back
+    return None
+
+class LoopWatchdog:
+    """Heartbeat on the event loop, and a thread that captures the loop's stack when a beat is late.
+
+    Blocking calls in a coroutine delay every beat scheduled behind them; once a
+    beat is LOOP_STALL_MS overdue the watchdog thread records the loop thread's
+    stack, the running task and the command it belongs to. The stall's final
+    length is filled in by the beat that finally runs.
+    """
+
+    def __init__(self, threshold_ms=LOOP_STALL_MS, interval=0.1, history=50):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.stalls = deque(maxlen=history)
+        self.total_stalls = 0
+        self._lock = Lock()
+        self._loop = None
+        self._loop_thread = None
+        self._last_beat = None
+        self._stall = None
+        self._reported = 0
+
+    def start(self, loop):
+        """Start beating on `loop` (call from the loop's thread); idempotent"""
+        if self._loop is not None:
+            return
+        self._loop = loop
+        self._loop_thread = get_ident()
+        self._last_beat = time.perf_counter()
+        loop.call_later(self.interval, self._beat)
+        Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def _beat(self):
+        now = time.perf_counter()
+        with self._lock:
+            lag = max(0.0, now - self._last_beat - self.interval)
+            self._last_beat = now
+            if self._stall is not None:
+                self._stall['lag_ms'] = round(lag * 1000, 1)
+                self._stall = None
+        metrics.observe("combat_event_loop_lag_seconds", lag)
+        self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        while not self._loop.is_closed():
+            time.sleep(self.interval)
+            with self._lock:
+                last_beat, stalled = self._last_beat, self._stall is not None
+            if not stalled and time.perf_counter() - last_beat - self.interval >= self.threshold:
+                self._capture(last_beat)
+
+    def _capture(self, last_beat):
+        frame = sys._current_frames().get(self._loop_thread)
+        try:
+            operation = describe_blocked_operation(frame)
+            task = asyncio.current_task(self._loop)
+        except Exception:
+            operation, task = None, None
+        stall = {
+            'at': utcnow().isoformat(),
+            'operation': operation or 'unknown',
+            'task': task.get_name() if task else None,
+            'stack': traceback.format_stack(frame, limit=30) if frame else [],
+        }
+        with self._lock:
+            # The loop may have beaten while the stack was taken; then that stack is not a stall
+            overdue = time.perf_counter() - self._last_beat - self.interval
+            if self._stall is not None or self._last_beat != last_beat or overdue < self.threshold:
+                return
+            stall['lag_ms'] = round(overdue * 1000, 1)
+            self._stall = stall
+            self.stalls.append(stall)
+            self.total_stalls += 1
+        metrics.inc("combat_loop_stalls_total", operation=stall['operation'])
+        print(f"🐌 Event loop blocked {stall['lag_ms']:.0f}+ ms in {stall['operation']}")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'threshold_ms': self.threshold * 1000,
+                'total_stalls': self.total_stalls,
+                'stalls': [dict(stall) for stall in reversed(self.stalls)],
+            }
+
+    def summary(self):
+        """Stalls since the previous summary, grouped by operation"""
+        with self._lock:
+            new = min(self.total_stalls - self._reported, len(self.stalls))
+            recent = list(self.stalls)[len(self.stalls) - new:]
+            self._reported = self.total_stalls
+        by_operation = {}
+        for stall in recent:
+            by_operation[stall['operation']] = by_operation.get(stall['operation'], 0) + 1
+        return {
+            'count': len(recent),
+            'worst_ms': max((stall['lag_ms'] for stall in recent), default=0.0),
+            'by_operation': by_operation,
+        }
+
+loop_watchdog = LoopWatchdog()
+
+@tasks.loop(minutes=10)
+@timed_task("log_loop_stalls")
+async def log_loop_stalls():
+    """Periodic summary of event loop stalls caught by the watchdog"""
+    report = loop_watchdog.summary()
+    if report['count']:
+        worst = ", ".join(f"{operation} ×{count}" for operation, count in
+                          sorted(report['by_operation'].items(), key=lambda item: -item[1]))
+        print(f"🐌 Event loop stalled {report['count']} times in the last 10 minutes "
+              f"(worst {report['worst_ms']:.0f} ms): {worst}")
+
 # ---------- ON READY ----------
 @bot.event
 async def on_ready():
@@ -2890,12 +5105,16 @@ async def on_ready():
             print(f"❌ Failed to sync slash commands: {e}")
 
         # Initialize database
-        init_combat_db()
+        await run_db(init_combat_db)
 
         # Start background tasks
         update_army_supplies_task.start()
         reset_weekly_limits.start()
         reset_daily_actions.start()
+        refresh_game_tables_task.start()
+        turn_timeouts.start()
+        loop_watchdog.start(asyncio.get_running_loop())
+        log_loop_stalls.start()
 
     except Exception as e:
         print(f"Error in on_ready: {e}")
@@ -2941,6 +5160,42 @@ async def on_command_error(ctx, error):
             success=False
         ))
 
+# ---------- COMMAND METRICS ----------
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.metrics_started = time.perf_counter()
+    current_operation.set(f"{PREFIX}{ctx.command.qualified_name}")
+
+@bot.after_invoke
+async def record_command_timer(ctx):
+    started = getattr(ctx, 'metrics_started', None)
+    if started is not None:
+        metrics.observe("combat_command_seconds", time.perf_counter() - started,
+                        command=ctx.command.qualified_name, kind="prefix",
+                        outcome="error" if ctx.command_failed else "ok")
+
+def record_app_command(interaction, command, outcome):
+    """Slash commands are timed from the tree's interaction check, or from Discord's creation stamp"""
+    if command is None:
+        return
+    started = interaction.extras.get('started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+    else:
+        elapsed = (utcnow() - interaction.created_at).total_seconds()
+    metrics.observe("combat_command_seconds", max(0.0, elapsed),
+                    command=command.qualified_name, kind="slash", outcome=outcome)
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    record_app_command(interaction, command, "ok")
+
+@tree.error
+async def on_app_command_error(interaction, error):
+    record_app_command(interaction, interaction.command, "error")
+    print(f"Slash command error: {error}")
+    traceback.print_exception(type(error), error, error.__traceback__)
+
 # ---------- KEEP-ALIVE SERVER ----------
 app = flask.Flask(__name__)
 
@@ -2948,6 +5203,29 @@ app = flask.Flask(__name__)
 def home():
     return "Medieval Combat Bot is alive! ⚔️ Strategic warfare & army management running."
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/debug/loop')
+def loop_debug_endpoint():
+    """Recent event loop stalls, newest first, with the loop thread's stack at capture time"""
+    if not DEBUG_ENDPOINTS:
+        return flask.Response("Debug endpoints are off; set DEBUG_ENDPOINTS=1\n", status=404, mimetype="text/plain")
+    return flask.jsonify(loop_watchdog.snapshot())
+
+@app.route('/profile/queries')
+def query_profile_endpoint():
+    """Top-N query report; ?top=20&sort=total|calls|max|rows, ?reset=1 to start over"""
+    if not query_profiler or not DEBUG_ENDPOINTS:
+        return flask.Response("Query profiling is off; set DB_PROFILE=1 and DEBUG_ENDPOINTS=1\n",
+                              status=404, mimetype="text/plain")
+    args = flask.request.args
+    report = query_profiler.report(top=args.get('top', 20, type=int), sort=args.get('sort', 'total'))
+    if args.get('reset'):
+        query_profiler.reset()
+    return flask.Response(report, mimetype="text/plain")
+
 def run_flask():
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
 
@@ -2967,7 +5245,14 @@ if __name__ == "__main__":
 
         # Initialize database and start the bot
         init_combat_db()
+        if DB_RECORD:
+            start_workload_recording(DB_RECORD)
         bot.run(TOKEN)
+        db_executor.shutdown()
+        history_writer.close()
+        if workload_recorder:
+            workload_recorder.close()
+        connection_pool.close_all()
     except Exception as e:
         print(f"Failed to start combat bot: {e}")
         traceback.print_exc()
@@ -0,0 +1,439 @@
+"""Offline Monte Carlo balance simulator for the combat engine in main.py.
+
+Runs headless duels and wars as NumPy array operations over the same tables
+the bot uses (DUEL_ACTIONS, BATTLE_TACTICS, TERRAIN_EFFECTS, WEATHER_EFFECTS)
+so builds, tactics, terrain and weather can be compared without live games or
+a database.
+
+Usage:
+    python simulate.py duels [--duels N] [--seed S] [--max-turns T]
+    python simulate.py wars [--wars-per-cell N] [--army-a NAME] [--army-b NAME] [--seed S]
+    python simulate.py {duels,wars} --check
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+
+import numpy as np
+
+import main
+
+# ---------- LOOKUP GRIDS ----------
+TERRAINS = tuple(main.TERRAIN_EFFECTS)
+WEATHERS = tuple(main.WEATHER_EFFECTS)
+ACTIONS = tuple(main.DUEL_ACTIONS)
+STATS = ('strength', 'agility', 'intelligence', 'vitality', 'luck')
+UNITS = ('total_knights', 'total_archers', 'total_cavalry', 'total_siege')
+ACTION_CLASSES = ('infantry', 'archery', 'cavalry', 'defense')
+
+# Per-action columns
+ACTION_STAT = np.array([STATS.index(main.DUEL_ACTIONS[a]['stat']) for a in ACTIONS])
+ACTION_MULTIPLIER = np.array([main.DUEL_ACTIONS[a]['multiplier'] for a in ACTIONS])
+ACTION_CLASS = np.array([ACTION_CLASSES.index(main.DUEL_ACTIONS[a]['terrain']) for a in ACTIONS])
+ACTION_MAGIC = np.array([a == "magic_bolt" for a in ACTIONS])
+
+# TERRAIN_GRID[terrain, action class] and the weather attack multiplier
+TERRAIN_GRID = np.array([[main.TERRAIN_EFFECTS[t].get(c, 1.0) for c in ACTION_CLASSES] for t in TERRAINS])
+WEATHER_MULTIPLIER = np.array([main.WEATHER_EFFECTS[w].get('morale', 1.0) * main.WEATHER_EFFECTS[w].get('archery', 1.0)
+                               for w in WEATHERS])
+
+# War grids: terrain mix used by calculate_war_damage, casualty defense and ambush chance
+TACTICS = tuple(main.BATTLE_TACTICS)
+DEFAULT_TACTIC = TACTICS.index("Frontal Assault")
+TACTIC_DAMAGE = np.array([main.BATTLE_TACTICS[t]['damage'] for t in TACTICS])
+TERRAIN_WAR_MIX = np.array([
+    main.TERRAIN_EFFECTS[t].get('infantry', 1.0) * 0.3 + main.TERRAIN_EFFECTS[t].get('cavalry', 1.0) * 0.3 +
+    main.TERRAIN_EFFECTS[t].get('archery', 1.0) * 0.2 + main.TERRAIN_EFFECTS[t].get('defense', 1.0) * 0.2
+    for t in TERRAINS
+])
+TERRAIN_DEFENSE = np.array([main.TERRAIN_EFFECTS[t].get('defense', 1.0) for t in TERRAINS])
+TERRAIN_AMBUSH = np.array([main.TERRAIN_EFFECTS[t].get('ambush', 1.0) for t in TERRAINS])
+WEATHER_MORALE = np.array([main.WEATHER_EFFECTS[w].get('morale', 1.0) for w in WEATHERS])
+
+ARMY_TYPE_NAMES = tuple(main.ARMY_TYPES)
+ARMY_TYPE_BONUS = np.array([[main.ARMY_TYPES[a][unit] for unit in ('infantry', 'archers', 'cavalry', 'siege')]
+                            for a in ARMY_TYPE_NAMES])
+WAR_ROUNDS = 10
+
+# Stat builds with the same 50 points spent differently; action None picks at random each turn
+DUEL_BUILDS = {
+    "Brute": ({'strength': 20, 'agility': 8, 'intelligence': 5, 'vitality': 12, 'luck': 5}, "power_strike"),
+    "Duelist": ({'strength': 8, 'agility': 20, 'intelligence': 5, 'vitality': 8, 'luck': 9}, "quick_strike"),
+    "Mage": ({'strength': 5, 'agility': 8, 'intelligence': 22, 'vitality': 8, 'luck': 7}, "magic_bolt"),
+    "Bulwark": ({'strength': 8, 'agility': 5, 'intelligence': 8, 'vitality': 22, 'luck': 7}, "shield_wall"),
+    "Balanced": ({'strength': 10, 'agility': 10, 'intelligence': 10, 'vitality': 10, 'luck': 10}, None),
+}
+
+# ---------- DUEL ENGINE ----------
+def combatant_arrays(combatant, n):
+    """Broadcast a combatant dict (stats and unit counts) to (n,) float arrays"""
+    return {key: np.broadcast_to(np.asarray(combatant.get(key, 0), dtype=float), (n,))
+            for key in STATS + UNITS}
+
+def enhanced_damage(rng, attacker, defender, action, terrain, weather):
+    """Vectorized calculate_enhanced_damage; every argument is an (n,) array or dict of them"""
+    n = action.shape[0]
+    action_class = ACTION_CLASS[action]
+
+    knight_bonus = attacker['total_knights'] * 3
+    archer_bonus = attacker['total_archers'] * 2
+    cavalry_bonus = attacker['total_cavalry'] * 2.5
+    unit_bonus = np.choose(action_class, [knight_bonus, archer_bonus, cavalry_bonus, knight_bonus + archer_bonus])
+
+    stat_matrix = np.stack([attacker[stat] for stat in STATS])
+    attack_stat = np.take_along_axis(stat_matrix, ACTION_STAT[action][None, :], axis=0)[0]
+    stat_bonus = (attack_stat + unit_bonus) * ACTION_MULTIPLIER[action]
+
+    defense_bonus = np.where(ACTION_MAGIC[action], defender['intelligence'], defender['vitality']) * 1.8
+
+    stat_bonus = stat_bonus * TERRAIN_GRID[terrain, action_class] * WEATHER_MULTIPLIER[weather]
+
+    base_damage = rng.integers(15, 36, n)
+    damage = np.trunc((base_damage + stat_bonus - defense_bonus) * rng.uniform(0.7, 1.3, n))
+    damage = np.maximum(5, damage)
+
+    crit_chance = (attacker['agility'] + attacker['luck'] + attacker['total_knights'] // 10) * 0.005
+    critical = rng.random(n) < crit_chance
+    damage = np.where(critical, np.trunc(damage * rng.uniform(1.5, 2.5, n)), damage)
+    return damage.astype(np.int64), critical
+
+def simulate_duels(rng, challenger, defender, terrain, weather, challenger_action, defender_action,
+                   max_turns=200, starting_hp=100):
+    """Play out n duels in lockstep; the challenger strikes first as in create_duel.
+
+    Actions are (n,) action indices, or -1 to pick uniformly at random every turn.
+    Returns (winner, turns): winner is 1 for the challenger, -1 for the defender
+    and 0 for duels still running after max_turns.
+    """
+    n = terrain.shape[0]
+    hp = np.full((2, n), starting_hp, dtype=np.int64)
+    sides = (challenger, defender)
+    actions = (challenger_action, defender_action)
+    winner = np.zeros(n, dtype=np.int8)
+    turns = np.zeros(n, dtype=np.int32)
+    active = np.arange(n)
+
+    for turn in range(max_turns):
+        if active.size == 0:
+            break
+        side = turn % 2
+        attacker = {key: values[active] for key, values in sides[side].items()}
+        target = {key: values[active] for key, values in sides[1 - side].items()}
+
+        action = actions[side][active]
+        random_action = action < 0
+        if random_action.any():
+            action = np.where(random_action, rng.integers(0, len(ACTIONS), active.size), action)
+
+        damage, _ = enhanced_damage(rng, attacker, target, action, terrain[active], weather[active])
+        hp[1 - side, active] = np.maximum(0, hp[1 - side, active] - damage)
+        turns[active] += 1
+
+        fallen = hp[1 - side, active] <= 0
+        winner[active[fallen]] = 1 if side == 0 else -1
+        active = active[~fallen]
+
+    return winner, turns
+
+def build_arrays(name, n):
+    stats, action = DUEL_BUILDS[name]
+    action_index = -1 if action is None else ACTIONS.index(action)
+    return combatant_arrays(stats, n), np.full(n, action_index)
+
+# ---------- WAR ENGINE ----------
+# Army compositions, in the shape of get_enhanced_combatant rows
+WAR_ARMIES = {
+    "Levy": {'current_soldiers': 400, 'total_knights': 5, 'total_archers': 40, 'total_cavalry': 20,
+             'total_siege': 2, 'army_type': "Infantry Heavy", 'morale': 80, 'battle_formation': "Line"},
+    "Standard": {'current_soldiers': 300, 'total_knights': 20, 'total_archers': 60, 'total_cavalry': 40,
+                 'total_siege': 5, 'army_type': "Balanced", 'morale': 100, 'battle_formation': "Line"},
+    "Horde": {'current_soldiers': 200, 'total_knights': 30, 'total_archers': 30, 'total_cavalry': 90,
+              'total_siege': 0, 'army_type': "Cavalry Heavy", 'morale': 100, 'battle_formation': "Wedge"},
+    "Siege Train": {'current_soldiers': 250, 'total_knights': 15, 'total_archers': 70, 'total_cavalry': 10,
+                    'total_siege': 25, 'army_type': "Siege Specialized", 'morale': 90, 'battle_formation': "Square"},
+}
+
+def army_power(armies, formation_bonuses=None):
+    """Vectorized calculate_army_power()['total'] over a dict of (n,) composition arrays"""
+    if formation_bonuses is None:
+        formation_bonuses = main.game_tables.formation_bonuses
+    type_index = np.array([ARMY_TYPE_NAMES.index(t) if t in main.ARMY_TYPES else ARMY_TYPE_NAMES.index('Balanced')
+                           for t in armies['army_type']])
+    bonus = ARMY_TYPE_BONUS[type_index]
+
+    total = (
+        armies['current_soldiers'] * bonus[:, 0] +
+        armies['total_knights'] * 10 * bonus[:, 0] +
+        armies['total_archers'] * 3 * bonus[:, 1] +
+        armies['total_cavalry'] * 8 * bonus[:, 2] +
+        armies['total_siege'] * 15 * bonus[:, 3]
+    )
+    morale_multiplier = 0.5 + (armies['morale'] / 100) * 0.5
+    formation = np.array([formation_bonuses.get(name, 1.0) for name in armies['battle_formation']])
+    return np.trunc(total * morale_multiplier * formation).astype(np.int64)
+
+def army_arrays(army, n):
+    """Broadcast a composition dict to (n,) arrays (object arrays for the names)"""
+    return {key: np.full(n, value, dtype=object if isinstance(value, str) else float)
+            for key, value in army.items()}
+
+def war_damage(rng, attacker_power, terrain, weather, attacker_tactic, defender_tactic):
+    """Vectorized calculate_war_damage; returns (damage, surprise)"""
+    n = attacker_power.shape[0]
+    base_damage = attacker_power * 0.1 + rng.integers(-50, 51, n)
+    defender_damage = TACTIC_DAMAGE[defender_tactic]
+    # A zero-damage defending tactic (Full Retreat) divides by zero in the live
+    # engine, which then falls back to 5% of attacker power with no surprise roll
+    retreating = defender_damage == 0
+    modifier = (TERRAIN_WAR_MIX[terrain] * WEATHER_MULTIPLIER[weather] *
+                TACTIC_DAMAGE[attacker_tactic] / np.where(retreating, 1.0, defender_damage))
+    damage = np.maximum(10, np.trunc(base_damage * modifier))
+
+    surprise = (rng.random(n) < TERRAIN_AMBUSH[terrain] * 0.1) & ~retreating
+    damage = np.where(surprise, np.trunc(damage * rng.uniform(1.3, 1.8, n)), damage)
+    damage = np.where(retreating, np.trunc(attacker_power * 0.05), damage)
+    return damage.astype(np.int64), surprise
+
+def casualty_rate(army_power_received, damage, terrain, weather):
+    """Vectorized calculate_casualties"""
+    rate = damage / (army_power_received + 1000) / (TERRAIN_DEFENSE[terrain] * WEATHER_MORALE[weather])
+    return np.clip(rate, 0.05, 0.5)
+
+def simulate_wars(rng, power_a, power_b, tactic_a, tactic_b, terrain, weather, rounds=WAR_ROUNDS):
+    """Play out n full wars the way _resolve_war_turn does.
+
+    Team A acts first and the teams alternate; each side attacks against the
+    tactic the other side used last (Frontal Assault until it has acted).
+    Army power stays fixed for the whole war, as casualties are only recorded.
+    Returns (score_a, score_b, casualties_a, casualties_b, surprises).
+    """
+    n = terrain.shape[0]
+    score = np.zeros((2, n), dtype=np.int64)
+    casualties = np.zeros((2, n), dtype=np.int64)
+    surprises = np.zeros(n, dtype=np.int32)
+    powers = (power_a, power_b)
+    tactics = (tactic_a, tactic_b)
+    last_tactic = [np.full(n, DEFAULT_TACTIC), np.full(n, DEFAULT_TACTIC)]
+
+    for turn in range(rounds):
+        side, other = turn % 2, 1 - turn % 2
+        damage, surprise = war_damage(rng, powers[side], terrain, weather, tactics[side], last_tactic[other])
+        rate = casualty_rate(powers[other], damage, terrain, weather)
+
+        casualties[other] += np.trunc(powers[other] * rate).astype(np.int64)
+        casualties[side] += np.trunc(powers[side] * (rate * 0.5)).astype(np.int64)
+        score[side] += damage
+        score[other] -= damage
+        surprises += surprise
+        last_tactic[side] = tactics[side]
+
+    return score[0], score[1], casualties[0], casualties[1], surprises
+
+# ---------- REPORTS ----------
+def duel_balance_report(total_duels, seed=0, max_turns=200):
+    """Round-robin every build pairing across random terrain/weather and print the results"""
+    rng = np.random.default_rng(seed)
+    names = tuple(DUEL_BUILDS)
+    per_pair = max(1, total_duels // (len(names) ** 2))
+
+    win_matrix = np.zeros((len(names), len(names)))
+    turn_sum = np.zeros((len(TERRAINS), len(WEATHERS)))
+    turn_count = np.zeros((len(TERRAINS), len(WEATHERS)))
+    unfinished = 0
+
+    started = time.perf_counter()
+    for i, first in enumerate(names):
+        for j, second in enumerate(names):
+            challenger, challenger_action = build_arrays(first, per_pair)
+            defender, defender_action = build_arrays(second, per_pair)
+            terrain = rng.integers(0, len(TERRAINS), per_pair)
+            weather = rng.integers(0, len(WEATHERS), per_pair)
+
+            winner, turns = simulate_duels(rng, challenger, defender, terrain, weather,
+                                           challenger_action, defender_action, max_turns)
+            win_matrix[i, j] = np.mean(winner == 1)
+            unfinished += int(np.sum(winner == 0))
+            np.add.at(turn_sum, (terrain, weather), turns)
+            np.add.at(turn_count, (terrain, weather), 1)
+    elapsed = time.perf_counter() - started
+    simulated = per_pair * len(names) ** 2
+
+    print(f"Challenger win probability ({per_pair:,} duels per pairing, row = challenger)")
+    print(f"{'':>10}" + "".join(f"{name:>10}" for name in names))
+    for i, name in enumerate(names):
+        print(f"{name:>10}" + "".join(f"{win_matrix[i, j]:>10.3f}" for j in range(len(names))))
+
+    print("\nExpected turns to finish (row = terrain, column = weather)")
+    expected = np.divide(turn_sum, turn_count, out=np.zeros_like(turn_sum), where=turn_count > 0)
+    print(f"{'':>18}" + "".join(f"{name[:10]:>11}" for name in WEATHERS))
+    for t, terrain_name in enumerate(TERRAINS):
+        print(f"{terrain_name:>18}" + "".join(f"{expected[t, w]:>11.2f}" for w in range(len(WEATHERS))))
+
+    if unfinished:
+        print(f"\n⚠️ {unfinished:,} duels still running after {max_turns} turns")
+    print(f"\n{simulated:,} duels in {elapsed:.2f}s — {simulated / elapsed:,.0f} duels/sec")
+    return {'win_matrix': win_matrix, 'expected_turns': expected, 'duels_per_sec': simulated / elapsed}
+
+def war_balance_report(wars_per_cell, army_a="Standard", army_b="Standard", seed=0, chunk_cells=256):
+    """Sweep every tactic pairing over the full terrain x weather grid and print outcome distributions"""
+    rng = np.random.default_rng(seed)
+    n_tactics, n_terrains, n_weathers = len(TACTICS), len(TERRAINS), len(WEATHERS)
+    power_a = int(army_power(army_arrays(WAR_ARMIES[army_a], 1))[0])
+    power_b = int(army_power(army_arrays(WAR_ARMIES[army_b], 1))[0])
+
+    # Every (tactic_a, tactic_b, terrain, weather) cell
+    cells = np.stack(np.meshgrid(np.arange(n_tactics), np.arange(n_tactics), np.arange(n_terrains),
+                                 np.arange(n_weathers), indexing='ij'), axis=-1).reshape(-1, 4)
+    wins_a = np.zeros(len(cells))
+    wins_b = np.zeros(len(cells))
+    casualties_a = np.zeros(len(cells))
+    casualties_b = np.zeros(len(cells))
+    margin = np.zeros(len(cells))
+
+    started = time.perf_counter()
+    for chunk_start in range(0, len(cells), chunk_cells):
+        chunk = cells[chunk_start:chunk_start + chunk_cells]
+        cell_id = np.repeat(np.arange(len(chunk)), wars_per_cell)
+        tactic_a, tactic_b, terrain, weather = (np.repeat(chunk[:, k], wars_per_cell) for k in range(4))
+        n = cell_id.shape[0]
+
+        score_a, score_b, lost_a, lost_b, _ = simulate_wars(
+            rng, np.full(n, power_a), np.full(n, power_b), tactic_a, tactic_b, terrain, weather
+        )
+        window = slice(chunk_start, chunk_start + len(chunk))
+        wins_a[window] = np.bincount(cell_id, score_a > score_b, len(chunk))
+        wins_b[window] = np.bincount(cell_id, score_b > score_a, len(chunk))
+        casualties_a[window] = np.bincount(cell_id, lost_a, len(chunk))
+        casualties_b[window] = np.bincount(cell_id, lost_b, len(chunk))
+        margin[window] = np.bincount(cell_id, score_a - score_b, len(chunk))
+    elapsed = time.perf_counter() - started
+    simulated = len(cells) * wars_per_cell
+
+    # Collapse terrain and weather into per-pairing distributions
+    shape = (n_tactics, n_tactics, n_terrains * n_weathers)
+    per_pair = wars_per_cell * n_terrains * n_weathers
+    pair_wins_a = wins_a.reshape(shape).sum(axis=2) / per_pair
+    pair_wins_b = wins_b.reshape(shape).sum(axis=2) / per_pair
+
+    print(f"{army_a} (power {power_a:,}) vs {army_b} (power {power_b:,}), "
+          f"{per_pair:,} wars per tactic pairing over {n_terrains}x{n_weathers} terrain/weather")
+    print("\nTeam A win probability (row = A tactic, column = B tactic)")
+    short = [tactic.split()[0][:9] for tactic in TACTICS]
+    print(f"{'':>20}" + "".join(f"{name:>10}" for name in short))
+    for i, tactic in enumerate(TACTICS):
+        print(f"{tactic:>20}" + "".join(f"{pair_wins_a[i, j]:>10.3f}" for j in range(n_tactics)))
+
+    print(f"\n{'A tactic':>20} {'B tactic':>20} {'A win':>7} {'draw':>7} {'B win':>7} "
+          f"{'margin':>9} {'A lost':>9} {'B lost':>9}")
+    pair_margin = margin.reshape(shape).sum(axis=2) / per_pair
+    pair_lost_a = casualties_a.reshape(shape).sum(axis=2) / per_pair
+    pair_lost_b = casualties_b.reshape(shape).sum(axis=2) / per_pair
+    for i, first in enumerate(TACTICS):
+        for j, second in enumerate(TACTICS):
+            draws = 1 - pair_wins_a[i, j] - pair_wins_b[i, j]
+            print(f"{first:>20} {second:>20} {pair_wins_a[i, j]:>7.3f} {draws:>7.3f} {pair_wins_b[i, j]:>7.3f} "
+                  f"{pair_margin[i, j]:>9.0f} {pair_lost_a[i, j]:>9.0f} {pair_lost_b[i, j]:>9.0f}")
+
+    print(f"\n{simulated:,} wars ({len(cells):,} cells) in {elapsed:.2f}s — {simulated / elapsed:,.0f} wars/sec")
+    return {'win_a': pair_wins_a, 'win_b': pair_wins_b, 'wars_per_sec': simulated / elapsed}
+
+# ---------- ENGINE CHECK ----------
+def check_duel_engine(samples=20000, seed=1):
+    """Compare the vectorized damage against calculate_enhanced_damage for every action"""
+    print("Vectorized damage vs calculate_enhanced_damage (mean damage, crit rate)")
+    rng = np.random.default_rng(seed)
+    main.random.seed(seed)
+    attacker_stats = dict(DUEL_BUILDS["Balanced"][0], total_knights=12, total_archers=20, total_cavalry=8)
+    defender_stats = dict(DUEL_BUILDS["Bulwark"][0])
+    attacker = combatant_arrays(attacker_stats, samples)
+    defender = combatant_arrays(defender_stats, samples)
+
+    failures = 0
+    for index, action in enumerate(ACTIONS):
+        terrain_index = index % len(TERRAINS)
+        weather_index = index % len(WEATHERS)
+        damage, critical = enhanced_damage(
+            rng, attacker, defender, np.full(samples, index),
+            np.full(samples, terrain_index), np.full(samples, weather_index)
+        )
+        reference = [main.calculate_enhanced_damage(attacker_stats, defender_stats, action,
+                                                    TERRAINS[terrain_index], WEATHERS[weather_index])
+                     for _ in range(samples)]
+        reference_damage = np.array([value for value, _ in reference])
+        reference_crit = np.mean([crit for _, crit in reference])
+
+        # Means must agree within ~5 standard errors
+        tolerance = 5 * np.sqrt(damage.var() / samples + reference_damage.var() / samples)
+        ok = abs(damage.mean() - reference_damage.mean()) <= tolerance
+        failures += not ok
+        print(f"  {action:<18} {damage.mean():8.2f} vs {reference_damage.mean():8.2f}  "
+              f"crit {critical.mean():.3f} vs {reference_crit:.3f}  {'ok' if ok else 'MISMATCH'}")
+    return failures
+
+def check_war_engine(samples=20000, seed=2):
+    """Compare army power, war damage and casualty rates against main.py"""
+    print("Vectorized war engine vs main.py")
+    rng = np.random.default_rng(seed)
+    main.random.seed(seed)
+    failures = 0
+
+    for name, army in WAR_ARMIES.items():
+        expected = main.calculate_army_power(army)['total']
+        actual = int(army_power(army_arrays(army, 1))[0])
+        ok = expected == actual
+        failures += not ok
+        print(f"  power {name:<12} {actual:>8,} vs {expected:>8,}  {'ok' if ok else 'MISMATCH'}")
+
+    power = main.calculate_army_power(WAR_ARMIES["Standard"])['total']
+    for index, tactic in enumerate(TACTICS):
+        terrain_index, weather_index = index % len(TERRAINS), (index * 3) % len(WEATHERS)
+        defender_tactic = TACTICS[(index + 2) % len(TACTICS)]
+        damage, _ = war_damage(rng, np.full(samples, power), np.full(samples, terrain_index),
+                               np.full(samples, weather_index), np.full(samples, index),
+                               np.full(samples, TACTICS.index(defender_tactic)))
+        rate = casualty_rate(np.full(samples, power), damage, np.full(samples, terrain_index),
+                             np.full(samples, weather_index))
+        with contextlib.redirect_stdout(io.StringIO()):
+            # The live engine prints on its Full Retreat fallback path
+            reference = np.array([main.calculate_war_damage(power, power, TERRAINS[terrain_index],
+                                                            WEATHERS[weather_index], tactic, defender_tactic)[0]
+                                  for _ in range(samples)])
+        reference_rate = np.array([main.calculate_casualties(power, value, TERRAINS[terrain_index],
+                                                             WEATHERS[weather_index]) for value in reference])
+
+        tolerance = 5 * np.sqrt(damage.var() / samples + reference.var() / samples)
+        ok = abs(damage.mean() - reference.mean()) <= tolerance and abs(rate.mean() - reference_rate.mean()) < 0.01
+        failures += not ok
+        print(f"  {tactic:<20} damage {damage.mean():8.2f} vs {reference.mean():8.2f}  "
+              f"casualty rate {rate.mean():.3f} vs {reference_rate.mean():.3f}  {'ok' if ok else 'MISMATCH'}")
+    return failures
+
+# ---------- RUN ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["duels", "wars"])
+    parser.add_argument("--duels", type=int, default=1_000_000, help="total duels to simulate")
+    parser.add_argument("--wars-per-cell", type=int, default=1000,
+                        help="wars per (tactic, tactic, terrain, weather) cell")
+    parser.add_argument("--army-a", choices=list(WAR_ARMIES), default="Standard")
+    parser.add_argument("--army-b", choices=list(WAR_ARMIES), default="Standard")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-turns", type=int, default=200)
+    parser.add_argument("--check", action="store_true", help="verify the vectorized engine against main.py")
+    args = parser.parse_args()
+
+    if args.mode == "wars":
+        # Formation bonuses come from the static tables; seed them without a database
+        columns = ('formation_name', 'infantry_bonus', 'cavalry_bonus', 'archer_bonus',
+                   'defense_bonus', 'movement_penalty', 'description')
+        main.game_tables = main.GameTables(formations={row[0]: dict(zip(columns, row))
+                                                       for row in main.DEFAULT_FORMATIONS})
+        if args.check:
+            sys.exit(1 if check_war_engine() else 0)
+        war_balance_report(args.wars_per_cell, args.army_a, args.army_b, args.seed)
+    else:
+        if args.check:
+            sys.exit(1 if check_duel_engine() else 0)
+        duel_balance_report(args.duels, args.seed, args.max_turns)
@@ -0,0 +1,229 @@
+"""Replay a recorded SQL workload against a scratch copy of the database.
+
+Record with DB_RECORD=path.jsonl.gz (the bot or loadtest.py); recording starts
+with a snapshot of the database, written beside the log. The replayer copies
+that snapshot, applies the current init_combat_db to the copy (so schema, index
+and PRAGMA changes in main.py are what gets measured) and re-executes every
+session, one connection per session, statements in their recorded order.
+
+Usage:
+    python workload.py summary load.jsonl.gz
+    python workload.py replay load.jsonl.gz                          # as fast as possible, 8 threads
+    python workload.py replay load.jsonl.gz --speed 2 --concurrency 4  # recorded pacing, twice as fast
+    python workload.py replay load.jsonl.gz --db other.db --no-init
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+main = None  # Imported by run once DB_PATH points at the scratch copy
+
+TRANSACTION_END = ("COMMIT", "END", "ROLLBACK")
+
+# ---------- LOG READING ----------
+def decode_params(params):
+    """Undo the recorder's JSON encoding: lists back to tuples, {'$b': hex} back to bytes"""
+    if isinstance(params, list):
+        return tuple(decode_params(value) for value in params)
+    if isinstance(params, dict):
+        if set(params) == {'$b'}:
+            return bytes.fromhex(params['$b'])
+        return {key: decode_params(value) for key, value in params.items()}
+    return params
+
+def read_workload(path):
+    """Header and the statements of a workload log, grouped into sessions ordered by start time"""
+    header = None
+    queries = {}
+    sessions = {}
+    with gzip.open(path, "rt", encoding="utf-8") as log:
+        try:
+            for line in log:
+                record = json.loads(line)
+                if header is None:
+                    header = record
+                elif 'sql' in record:
+                    queries[record['q']] = record['sql']
+                else:
+                    record['sql'] = queries[record['q']]
+                    sessions.setdefault(record['s'], []).append(record)
+        except (EOFError, zlib.error, json.JSONDecodeError):
+            print(f"⚠️ {path} ends mid-record (recorder not closed); replaying what was flushed")
+    return header, sorted(sessions.values(), key=lambda statements: statements[0]['t'])
+
+# ---------- REPLAY ----------
+class ReplayStats:
+    def __init__(self):
+        self._lock = Lock()
+        self.latencies = {}  # operation -> [seconds]
+        self.recorded_ms = {}  # operation -> total recorded ms
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self.locked = 0
+        self.errors = {}
+        self.skipped = 0
+
+    def add(self, operation, seconds, recorded_ms):
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            self.recorded_ms[operation] = self.recorded_ms.get(operation, 0.0) + recorded_ms
+
+    def fail(self, error):
+        with self._lock:
+            if "locked" in str(error) or "busy" in str(error):
+                self.locked += 1
+            else:
+                self.errors[str(error)] = self.errors.get(str(error), 0) + 1
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def waited(self, seconds):
+        with self._lock:
+            self.lock_waits += 1
+            self.lock_wait_seconds += seconds
+
+def replay_session(pool, statements, stats):
+    """Re-execute one recorded session on its own pooled connection"""
+    conn = pool.acquire()
+    try:
+        for record in statements:
+            sql = record['sql']
+            keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+            if keyword in TRANSACTION_END and not conn.in_transaction:
+                stats.skip()
+                continue
+            params = decode_params(record['p'])
+            started = time.perf_counter()
+            try:
+                if record.get('many'):
+                    conn.executemany(sql, params)
+                else:
+                    conn.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                stats.fail(e)
+                continue
+            elapsed = time.perf_counter() - started
+            if keyword == "BEGIN" and elapsed >= main.LOCK_WAIT_THRESHOLD:
+                stats.waited(elapsed)
+            stats.add(record['op'], elapsed, record['ms'])
+    finally:
+        pool.release(conn)
+
+def replay(sessions, db_path, speed, concurrency):
+    """Replay every session; speed 0 runs flat out, otherwise sessions start at recorded time / speed"""
+    pool = main.CombatConnectionPool(db_path, max_size=concurrency)
+    stats = ReplayStats()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as executor:
+        futures = []
+        for statements in sessions:
+            if speed > 0:
+                delay = started + statements[0]['t'] / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(replay_session, pool, statements, stats))
+        for future in futures:
+            future.result()
+    wall_seconds = time.perf_counter() - started
+    pool.close_all()
+    return stats, wall_seconds
+
+def scratch_copy(source, target):
+    """Copy `source` with the backup API, so a live database is read consistently and never written"""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+# ---------- REPORT ----------
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def summarize(sessions):
+    operations = {}
+    for statements in sessions:
+        for record in statements:
+            totals = operations.setdefault(record['op'], [0, 0.0])
+            totals[0] += 1
+            totals[1] += record['ms']
+    statements = sum(totals[0] for totals in operations.values())
+    span = max((session[-1]['t'] for session in sessions), default=0.0)
+    print(f"{len(sessions):,} sessions, {statements:,} statements over {span:.1f}s recorded")
+    print(f"{'operation':<36} {'statements':>10} {'recorded ms':>12}")
+    for operation, (calls, ms) in sorted(operations.items(), key=lambda item: -item[1][1]):
+        print(f"{operation:<36} {calls:>10,} {ms:>12.1f}")
+
+def report(stats, wall_seconds, sessions):
+    everything = sorted(seconds for values in stats.latencies.values() for seconds in values)
+    print(f"\nReplayed {len(everything):,} statements from {len(sessions):,} sessions in {wall_seconds:.2f}s "
+          f"= {len(everything) / wall_seconds:,.0f} statements/s")
+    print(f"Statement latency: p50 {percentile(everything, 0.5) * 1000:.2f} ms, "
+          f"p95 {percentile(everything, 0.95) * 1000:.2f} ms, p99 {percentile(everything, 0.99) * 1000:.2f} ms")
+    print(f"Write lock: {stats.lock_waits} BEGINs waited ({stats.lock_wait_seconds:.2f}s), "
+          f"{stats.locked} statements failed busy/locked")
+    print(f"\n{'operation':<36} {'statements':>10} {'replay ms':>10} {'recorded ms':>12} {'p95 ms':>8}")
+    for operation, values in sorted(stats.latencies.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        print(f"{operation:<36} {len(values):>10,} {sum(values) * 1000:>10.1f} "
+              f"{stats.recorded_ms[operation]:>12.1f} {percentile(values, 0.95) * 1000:>8.2f}")
+    if stats.skipped:
+        print(f"\n{stats.skipped} COMMIT/ROLLBACK statements skipped outside a transaction")
+    if stats.errors:
+        print(f"\n{sum(stats.errors.values())} statements failed against the copy (state drift from the snapshot):")
+        for message, occurrences in sorted(stats.errors.items(), key=lambda item: -item[1])[:10]:
+            print(f"  {occurrences:>6} {message}")
+
+# ---------- RUN ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["summary", "replay"])
+    parser.add_argument("log", help="workload log written with DB_RECORD")
+    parser.add_argument("--db", help="database to replay against (default: the log's snapshot)")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="replay at recorded pacing times this factor; 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions replayed at once")
+    parser.add_argument("--no-init", action="store_true", help="replay on the copy as is, without init_combat_db")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch copy afterwards")
+    args = parser.parse_args()
+
+    header, sessions = read_workload(args.log)
+    if args.mode == "summary":
+        summarize(sessions)
+        sys.exit(0)
+
+    source = args.db or (header or {}).get('snapshot')
+    if not source or not os.path.exists(source):
+        sys.exit(f"No database to replay against: pass --db (snapshot {source!r} not found)")
+    scratch = tempfile.mktemp(prefix="replay-", suffix=".db")
+    scratch_copy(source, scratch)
+    os.environ["DB_PATH"] = scratch
+    os.environ.pop("DB_RECORD", None)
+
+    import main
+    if not args.no_init:
+        main.init_combat_db()
+    main.connection_pool.close_all()
+
+    stats, wall_seconds = replay(sessions, scratch, args.speed, args.concurrency)
+    report(stats, wall_seconds, sessions)
+
+    if args.keep:
+        print(f"\nScratch copy kept at {scratch}")
+    else:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(scratch + suffix):
+                os.remove(scratch + suffix)
+    sys.exit(1 if stats.locked else 0)